@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+算法识别平台命令行入口（无界面）
+"""
+
+import os
+import sys
+import argparse
+
+from utils.inference_utils import InferenceJob, MultiModelJob, PageOCRJob, CascadeJob
+from utils.answer_utils import AnswerMatcher
+from utils.import_utils import scan_tree, validate_paths, ImportReport
+from utils.export_utils import create_result_writer
+from utils.cache_utils import TensorCache
+from utils.batch_utils import AdaptiveBatchController
+from utils.watch_utils import FolderWatcher
+from utils.distributed_utils import Coordinator, Worker, is_loopback_host, TOKEN_ENV
+from utils.memory_utils import MemoryMonitor, STAGE_LABELS, MB
+
+
+def collect_inputs(inputs):
+    """展开输入路径：目录递归收集其中的图像和归档文件"""
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            # 并行扫描目录树，顺序与按名称排序的 os.walk 相同
+            paths.extend(scan_tree([path])[0])
+        else:
+            paths.append(path)
+    return paths
+
+
+def validate_inputs(paths):
+    """只读取文件头校验输入，剔除损坏或不支持的文件并打印说明"""
+    valid, skipped = validate_paths(paths)
+    if skipped:
+        print(f"跳过 {len(skipped)} 个文件:\n{ImportReport(valid, skipped, 0.0, 0.0).summary()}", file=sys.stderr)
+    return valid
+
+
+def format_accuracy(accuracy):
+    """格式化正确率"""
+    return f"{accuracy:.1f}%" if accuracy is not None else ''
+
+
+def format_result_line(result, model_names=None):
+    """将结果格式化为制表符分隔的一行，多模型对比时各模型并列输出"""
+    fields = [result['image_path']]
+    if model_names:
+        models = result.get('models', {})
+        for name in model_names:
+            entry = models.get(name, {})
+            fields += [str(entry.get('prediction', '')), format_accuracy(entry.get('accuracy'))]
+        fields.append(result['answer'])
+    else:
+        fields += [
+            str(result['prediction']),
+            f"{result['confidence']:.4f}",
+            result['answer'],
+            format_accuracy(result['accuracy']),
+        ]
+    fields.append(result['status'] + ('（复用）' if result.get('reused_from') else ''))
+    return '\t'.join(fields)
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="算法识别平台命令行工具")
+    parser.add_argument('inputs', nargs='*', help="图像文件、tar/zip归档或目录")
+    parser.add_argument('-m', '--model', action='append',
+                        help="ONNX模型文件，重复指定多个模型时进行对比识别")
+    parser.add_argument('-c', '--config', default=None, help="模型配置文件（默认自动查找）")
+    parser.add_argument('--det-model', default=None, help="文本检测模型，指定后进行整页OCR")
+    parser.add_argument('--det-workers', type=int, default=None, help="整页OCR的检测线程数（默认为CPU核数）")
+    parser.add_argument('--cascade-fast', default=None, metavar='MODEL',
+                        help="级联识别的快速模型：先用它识别，低置信度或空文本的图像再交给 -m 指定的大模型")
+    parser.add_argument('--cascade-threshold', type=float, default=0.9, help="级联识别的置信度阈值（默认0.9）")
+    parser.add_argument('--cascade-compare', action='store_true',
+                        help="级联识别时所有图像都再用大模型识别一次，统计仅用大模型的耗时和正确率，用于调整阈值")
+    parser.add_argument('-o', '--output', default=None, help="导出文件（.csv/.jsonl/.parquet），结果逐条写出")
+    parser.add_argument('--watch', default=None, metavar='DIR', help="监视目录，持续识别新写入的图像（Ctrl+C 结束）")
+    parser.add_argument('--watch-existing', action='store_true', help="监视时也识别目录中已有的文件")
+    parser.add_argument('--batch-window-ms', type=int, default=100, help="监视时合并为一批的等待时间（毫秒），默认100")
+    parser.add_argument('--report', default=None, metavar='PATH', help="评测报告（JSON）：CER/WER、混淆矩阵、耗时分位数等")
+    parser.add_argument('--tensor-cache', default=None, metavar='DIR', help="预处理张量缓存目录，重复运行时跳过解码和预处理")
+    parser.add_argument('--tensor-cache-size', type=int, default=2048, metavar='MB', help="张量缓存大小上限（MB），默认2048")
+    parser.add_argument('--adaptive-batch', action='store_true', help="根据实测吞吐量自动调整批大小，并记录最优值")
+    parser.add_argument('--max-batch-size', type=int, default=64, help="自适应批大小的上限（默认64）")
+    parser.add_argument('--latency-target-ms', type=float, default=None, help="单批推理耗时上限（毫秒），超过时减小批大小")
+    parser.add_argument('--memory-budget-mb', type=int, default=None, help="进程内存上限（MB），超过时减小批大小")
+    parser.add_argument('--coordinator', default=None, metavar='[HOST:]PORT',
+                        help="作为协调节点运行：切分输入并分配给工作节点，合并结果（不需要模型）；HOST默认127.0.0.1")
+    parser.add_argument('--worker', default=None, metavar='URL', help="作为工作节点运行，从协调节点领取任务")
+    parser.add_argument('--token', default=os.environ.get(TOKEN_ENV), metavar='TOKEN',
+                        help=f"协调节点与工作节点的共享令牌（默认读取环境变量 {TOKEN_ENV}），协调节点监听非本机地址时必须设置")
+    parser.add_argument('--lease-size', type=int, default=256, help="每个租约包含的输入文件数（默认256）")
+    parser.add_argument('--lease-ttl', type=float, default=60.0, help="租约超时秒数，超时未续约则重新分配（默认60）")
+    parser.add_argument('--memory-log', default=None, metavar='PATH',
+                        help="内存监测：定期采样常驻内存和各阶段存活内存，写出CSV时间序列并提示持续增长（会拖慢处理）")
+    parser.add_argument('--memory-interval', type=float, default=10.0, help="内存采样间隔秒数（默认10）")
+    parser.add_argument('--validate', action='store_true', help="识别前只读取文件头校验输入，跳过损坏或不支持的文件")
+    parser.add_argument('--dedup', action='store_true', help="重复图像只推理一次")
+    parser.add_argument('--dedup-distance', type=int, default=0, help="大于0时按感知哈希复用近似重复图像的结果，为视为重复的最大汉明距离（默认0，仅复用像素完全相同的图像）")
+    args = parser.parse_args(argv)
+    if args.coordinator:
+        if not args.inputs:
+            parser.error("协调节点需要指定输入文件")
+        if not args.token and not is_loopback_host(parse_address(args.coordinator)[0]):
+            parser.error(f"协调节点监听非本机地址时需要用 --token 或环境变量 {TOKEN_ENV} 设置共享令牌")
+    elif not args.model:
+        parser.error("需要指定模型 -m")
+    elif args.worker:
+        if args.inputs or args.watch or args.output:
+            parser.error("工作节点从协调节点领取输入，结果由协调节点写出")
+    elif not args.inputs and not args.watch:
+        parser.error("需要指定输入文件或 --watch 目录")
+    if args.model and (len(args.model) > 1 or args.cascade_fast or args.det_model):
+        # 去重、张量缓存和自适应批大小只作用于单模型识别
+        single_only = [name for name, enabled in (('--dedup', args.dedup), ('--tensor-cache', args.tensor_cache),
+                                                  ('--adaptive-batch', args.adaptive_batch)) if enabled]
+        if single_only:
+            parser.error(f"{'、'.join(single_only)} 仅支持单模型识别，不能用于多模型对比、--cascade-fast 或 --det-model")
+    return args
+
+
+def print_memory_growth(sample):
+    """内存采样回调：某一列开始持续增长时提示"""
+    for name, slope in sample['newly_growing'].items():
+        print(f"内存持续增长: {STAGE_LABELS.get(name, name)}，约 {slope * 1000 / MB:.2f} MB/千张", file=sys.stderr)
+
+
+def parse_address(address):
+    """解析 [HOST:]PORT"""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def run_coordinator(args):
+    """协调节点：等待工作节点处理完所有租约，按输入顺序合并结果"""
+    image_paths = collect_inputs(args.inputs)
+    if args.validate:
+        image_paths = validate_inputs(image_paths)
+    host, port = parse_address(args.coordinator)
+    coordinator = Coordinator(image_paths, host, port, args.lease_size, args.lease_ttl, config_path=args.config,
+                              token=args.token)
+    print(f"协调节点 {coordinator.address}: {len(image_paths)} 个输入, {len(coordinator.leases)} 个租约",
+          file=sys.stderr)
+
+    result_writer = None
+    successful = 0
+    total = 0
+    try:
+        for result in coordinator.iter_results():
+            total += 1
+            if result['status'] == '成功':
+                successful += 1
+            # 导出字段由工作节点的任务类型决定，收到第一条结果后再创建写出器
+            job_info = coordinator.job_info or {}
+            if args.output and result_writer is None:
+                result_writer = create_result_writer(args.output, job_info.get('result_fields'))
+            if result_writer is not None:
+                result_writer.write(result)
+            else:
+                print(format_result_line(result, job_info.get('model_names')))
+    finally:
+        if result_writer is not None:
+            result_writer.close()
+
+    status = coordinator.get_status()
+    print(f"处理完成: {successful}/{total} 成功, 工作节点 {status['workers']} 个, "
+          f"重新分配租约 {status['reassigned']} 次", file=sys.stderr)
+    if args.report and coordinator.evaluator is not None:
+        coordinator.evaluator.save_report(args.report)
+        print(f"评测报告已写出到 {args.report}", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    if args.coordinator:
+        return run_coordinator(args)
+
+    image_paths = collect_inputs(args.inputs)
+    if args.validate:
+        image_paths = validate_inputs(image_paths)
+    if len(args.model) > 1:
+        job = MultiModelJob(args.model, image_paths, answer_matcher=AnswerMatcher())
+        model_names = job.model_names
+    elif args.cascade_fast:
+        job = CascadeJob(args.cascade_fast, args.model[0], image_paths, args.config,
+                         threshold=args.cascade_threshold, compare=args.cascade_compare,
+                         answer_matcher=AnswerMatcher())
+        model_names = None
+    elif args.det_model:
+        job = PageOCRJob(args.det_model, args.model[0], image_paths, args.config, answer_matcher=AnswerMatcher(),
+                         det_workers=args.det_workers)
+        model_names = None
+    else:
+        tensor_cache = None
+        if args.tensor_cache:
+            tensor_cache = TensorCache(args.tensor_cache, args.tensor_cache_size * 1024 ** 2)
+        batch_controller = None
+        if args.adaptive_batch:
+            memory_budget = args.memory_budget_mb * 1024 ** 2 if args.memory_budget_mb else None
+            batch_controller = AdaptiveBatchController(max_size=args.max_batch_size,
+                                                       latency_target_ms=args.latency_target_ms,
+                                                       memory_budget_bytes=memory_budget)
+        job = InferenceJob(args.model[0], image_paths, args.config,
+                           dedup=args.dedup, dedup_distance=args.dedup_distance,
+                           answer_matcher=AnswerMatcher(), tensor_cache=tensor_cache,
+                           batch_controller=batch_controller)
+        model_names = None
+    result_writer = None
+    if args.output:
+        # 监视目录时文件被重写后会再次识别，同一文件只保留最新的结果
+        result_writer = create_result_writer(args.output, job.result_fields, unique=bool(args.watch))
+    job.result_writer = result_writer
+    memory_monitor = None
+    if args.memory_log:
+        # 在加载模型前开始跟踪，模型加载的分配也计入
+        memory_monitor = MemoryMonitor(args.memory_log, args.memory_interval, on_sample=print_memory_growth)
+        memory_monitor.start()
+        job.memory_monitor = memory_monitor
+    job.load()
+
+    if args.worker:
+        # 工作节点：结果回传给协调节点，由协调节点合并写出
+        worker = Worker(args.worker, job, token=args.token)
+        print(f"工作节点 {worker.worker_id} 已连接 {args.worker}", file=sys.stderr)
+        worker.run()
+        print(f"工作节点处理完成: {worker.processed} 张", file=sys.stderr)
+        return 0
+
+    successful = 0
+    total = 0
+    watcher = None
+    try:
+        if args.watch:
+            watcher = FolderWatcher(args.watch, include_existing=args.watch_existing)
+            print(f"正在监视 {watcher.directory}（{watcher.mode}），Ctrl+C 结束", file=sys.stderr)
+            batches = job.iter_watch_results(watcher, args.batch_window_ms / 1000.0)
+        else:
+            batches = [job.iter_results()]
+        for results in batches:
+            for result in results:
+                total += 1
+                if result['status'] == '成功':
+                    successful += 1
+                # 写出到文件时不再逐行打印
+                if result_writer is None:
+                    print(format_result_line(result, model_names), flush=bool(watcher))
+    except KeyboardInterrupt:
+        if watcher is None:
+            raise
+    finally:
+        if watcher is not None:
+            watcher.close()
+        if result_writer is not None:
+            result_writer.close()
+        if memory_monitor is not None:
+            memory_monitor.stop()
+
+    print(f"处理完成: {successful}/{total} 成功", file=sys.stderr)
+    report = job.evaluator.report()
+    if report.get('cer', {}).get('rate') is not None:
+        print(f"CER: {report['cer']['rate']:.2%}, WER: {report['wer']['rate']:.2%}", file=sys.stderr)
+    if args.report:
+        job.evaluator.save_report(args.report)
+        print(f"评测报告已写出到 {args.report}", file=sys.stderr)
+    if getattr(job, 'tensor_cache', None) is not None:
+        print(f"张量缓存: 命中 {job.tensor_cache.hits} 张, 未命中 {job.tensor_cache.misses} 张", file=sys.stderr)
+    if getattr(job, 'batch_controller', None) is not None:
+        controller = job.batch_controller
+        print(f"批大小: {controller.best_batch_size}（{controller.best_throughput:.1f} 张/秒）", file=sys.stderr)
+    if 'cascade' in report:
+        cascade = report['cascade']
+        line = f"级联识别: 升级 {cascade['escalated']}/{cascade['total']} 张"
+        if cascade['escalation_rate'] is not None:
+            line += f"（{cascade['escalation_rate']:.1%}）"
+        if cascade['speedup'] is not None:
+            line += f", 推理加速 {cascade['speedup']:.2f}x" + ("（估算）" if cascade['large_only_estimated'] else "")
+        print(line, file=sys.stderr)
+        if cascade['large_only_mean_accuracy'] is not None:
+            print(f"平均正确率: 级联 {cascade['mean_accuracy']:.1f}%, "
+                  f"仅大模型 {cascade['large_only_mean_accuracy']:.1f}%, "
+                  f"仅快速模型 {cascade['fast_only_mean_accuracy']:.1f}%", file=sys.stderr)
+    if job.deduplicator is not None:
+        print(f"去重节省推理: {job.saved_inferences} 次", file=sys.stderr)
+    if memory_monitor is not None:
+        memory = memory_monitor.report()
+        stages = sorted(((name, series['mb']) for name, series in memory['series'].items()
+                         if name not in ('rss', 'traced', 'traced_peak')), key=lambda item: item[1], reverse=True)
+        print(f"内存: 常驻 {memory['series']['rss']['mb']:.0f} MB（"
+              + ", ".join(f"{STAGE_LABELS.get(name, name)} {mb:.1f}" for name, mb in stages[:5])
+              + f"），时间序列已写出到 {args.memory_log}", file=sys.stderr)
+        if memory['growing']:
+            print("持续增长: " + ", ".join(
+                f"{STAGE_LABELS.get(name, name)} {memory['series'][name]['mb_per_1000_images']:.2f} MB/千张"
+                for name in memory['growing']), file=sys.stderr)
+    if model_names:
+        for summary in job.get_model_summary():
+            print(f"{summary['model']}: {summary['images']} 张, {summary['images_per_second']:.1f} 张/秒",
+                  file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
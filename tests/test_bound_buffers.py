@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IOBinding缓冲区测试：批行数按分档大小分配缓冲区，不同大小的批共用少量缓冲区，填充行不影响结果
+
+    python -m pytest tests/test_bound_buffers.py
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.model_utils import ModelConfig, MODEL_KIND_CLASSIFICATION
+from test_reduced_decode import build_test_model, create_loader
+
+
+def test_batches_share_bucketed_buffers(tmp_path):
+    model_path = str(tmp_path / 'cls.onnx')
+    build_test_model(model_path, MODEL_KIND_CLASSIFICATION, len(ModelConfig().classDict))
+    loader = create_loader(model_path)
+
+    rng = np.random.default_rng(0)
+    arrays = [rng.random((1, 3, 224, 224), dtype=np.float32) for _ in range(12)]
+    expected = [loader.predict_arrays([array])[0] for array in arrays]
+
+    for count in range(1, len(arrays) + 1):
+        results = loader.predict_arrays(arrays[:count])
+        assert [r[0] for r in results] == [e[0] for e in expected[:count]]
+        np.testing.assert_allclose([r[1] for r in results], [e[1] for e in expected[:count]], rtol=1e-5)
+
+    # 1..12行只用到 1、2、4、8、16 五档缓冲区
+    assert sorted(shape[0] for shape in loader._bound_buffers) == [1, 2, 4, 8, 16]
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+去重测试：感知哈希相同但内容不同的图像不复用结果，内容完全相同的才复用
+
+    python -m pytest tests/test_dedup.py
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.dedup_utils import Deduplicator, dhash
+
+
+def make_pair():
+    """两张 dHash 相同、像素不同的图像：只改动一个像素，缩小后相邻格的大小关系不变"""
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (64, 272, 3), dtype=np.uint8)
+    other = img.copy()
+    other[10, 10] ^= 1
+    return img, other
+
+
+def test_hash_collision_is_not_reused():
+    img, other = make_pair()
+    assert dhash(img) == dhash(other)
+
+    dedup = Deduplicator()
+    dedup.add(dedup.compute_key(img), 'a.png', 'abc', 0.9)
+    assert dedup.lookup(dedup.compute_key(other)) is None
+    assert dedup.lookup(dedup.compute_key(img.copy())) == ('a.png', 'abc', 0.9)
+    assert dedup.saved_inferences == 1
+
+
+def test_near_duplicates_are_opt_in():
+    img, other = make_pair()
+    dedup = Deduplicator(max_distance=2)
+    dedup.add(dedup.compute_key(img), 'a.png', 'abc', 0.9)
+    assert dedup.lookup(dedup.compute_key(other)) == ('a.png', 'abc', 0.9)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分布式识别测试：工作节点处理某个租约出错时放弃该租约，超时后重新分配；协调节点校验共享令牌
+
+    python -m pytest tests/test_distributed.py
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.model_utils import MODEL_KIND_CLASSIFICATION
+from utils.distributed_utils import Coordinator, Worker
+
+
+class FakeModelLoader:
+    def get_model_kind(self):
+        return MODEL_KIND_CLASSIFICATION
+
+
+class FlakyJob:
+    """第一次处理租约时出错，之后正常返回结果"""
+
+    result_fields = ['image_path', 'prediction', 'status']
+
+    def __init__(self):
+        self.model_loader = FakeModelLoader()
+        self.image_paths = []
+        self.failed = False
+
+    def iter_results(self):
+        if not self.failed:
+            self.failed = True
+            raise Exception("模拟的推理错误")
+        for path in self.image_paths:
+            yield {'image_path': path, 'prediction': 'ok', 'status': '成功'}
+
+
+def run_coordinator(coordinator):
+    return list(coordinator.iter_results(shutdown_grace=0.1))
+
+
+def test_failed_lease_is_reassigned():
+    paths = [f"img{i}.png" for i in range(6)]
+    coordinator = Coordinator(paths, port=0, lease_size=2, lease_ttl=0.5, token='secret')
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(run_coordinator(coordinator)))
+    thread.start()
+
+    worker = Worker(coordinator.address, FlakyJob(), token='secret')
+    worker.run()
+    thread.join(timeout=10)
+
+    assert [result['image_path'] for result in results] == paths
+    assert coordinator.reassigned == 1
+    assert worker.processed == len(paths)
+
+
+def test_token_required_off_loopback():
+    with pytest.raises(Exception):
+        Coordinator([], host='0.0.0.0', port=0)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+缩小解码的一致性和耗时测试：在生成的JPEG上比较缩小解码与完整解码的 top-1、置信度和输入张量，并报告两者的解码耗时
+
+    python -m pytest -s tests/test_reduced_decode.py          # 使用随机权重生成的小模型（需要onnx）
+    python tests/test_reduced_decode.py model.onnx [...]      # 使用实际模型，打印对比表
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.model_utils import (ModelLoader, ModelConfig, find_config_file, read_image_header, MODEL_KIND_TEXT,
+                               MODEL_KIND_CLASSIFICATION, REDUCED_DECODE_FORMATS)
+
+
+# 置信度允许的差异
+MAX_CONFIDENCE_DIFF = 0.02
+# 归一化后输入张量允许的平均绝对差；文本行完整解码后按线性插值缩小，细笔画的混叠使差异略大
+MAX_TENSOR_DIFFS = {
+    MODEL_KIND_TEXT: 0.08,
+    MODEL_KIND_CLASSIFICATION: 0.05,
+}
+# 每张图像的计时次数，取中位数
+TIMING_RUNS = 5
+
+
+def make_text_line(text, height, seed):
+    """生成白底黑字的文本行JPEG，行高为 height"""
+    rng = np.random.default_rng(seed)
+    scale = height / 40.0
+    thickness = max(1, int(scale * 2))
+    (width, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+    img = np.full((height, width + height // 2, 3), 255, dtype=np.uint8)
+    cv2.putText(img, text, (height // 4, int(height * 0.75)), cv2.FONT_HERSHEY_SIMPLEX, scale,
+                (0, 0, 0), thickness, cv2.LINE_AA)
+    # 轻微噪声，接近扫描件
+    noise = rng.normal(0, 6, img.shape)
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def make_photo(width, height, seed):
+    """生成由平滑色块组成的照片类JPEG"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(20):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(height // 20, height // 5))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(img, center, radius, color, -1, cv2.LINE_AA)
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def generate_images(model_kind):
+    """按模型类型生成测试图像：[(名称, JPEG数据), ...]；尺寸覆盖缩小 2/4/8 倍的情况"""
+    if model_kind == MODEL_KIND_TEXT:
+        texts = ['ab12cd', 'Hello World 2024', 'reduced decode', 'X7Y8Z9 0123456789']
+        return [(f"line_h{height}_{i}.jpg", make_text_line(text, height, i))
+                for height in (120, 240, 480) for i, text in enumerate(texts)]
+    return [(f"photo_{width}x{height}.jpg", make_photo(width, height, i))
+            for i, (width, height) in enumerate([(800, 600), (1600, 1200), (3000, 2000), (4000, 3000)])]
+
+
+def time_decode(loader, data, reduced):
+    """解码耗时的中位数（毫秒）"""
+    timings = []
+    for _ in range(TIMING_RUNS):
+        start = time.perf_counter()
+        loader.decode_image(data, reduced=reduced)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def compare_decodes(loader, images):
+    """逐张比较缩小解码与完整解码
+        :return: 每张图像的对比结果字典列表
+    """
+    rows = []
+    for name, data in images:
+        full = loader.decode_image(data, reduced=False)
+        reduced = loader.decode_image(data, reduced=True)
+        (full_text, full_conf), (reduced_text, reduced_conf) = loader.predict_images([full, reduced])
+        tensor_diff = float(np.abs(loader.preprocess_decoded(full) - loader.preprocess_decoded(reduced)).mean())
+        rows.append({
+            'name': name,
+            'full_size': full.shape[1::-1],
+            'reduced_size': reduced.shape[1::-1],
+            'full_prediction': full_text,
+            'reduced_prediction': reduced_text,
+            'confidence_diff': abs(full_conf - reduced_conf),
+            'tensor_diff': tensor_diff,
+            'full_ms': time_decode(loader, data, False),
+            'reduced_ms': time_decode(loader, data, True),
+        })
+    return rows
+
+
+def print_report(model_path, rows):
+    """打印对比表和耗时汇总"""
+    print(f"\n{os.path.basename(model_path)}")
+    # 中文字符显示宽度为2，表头按显示宽度对齐
+    print(f"{'图像':<24}{'完整尺寸':>10}{'缩小尺寸':>10}{'top-1':>8}{'置信度差':>8}{'张量差':>8}"
+          f"{'完整ms':>8}{'缩小ms':>8}")
+    for row in rows:
+        print(f"{row['name']:<26}{'x'.join(map(str, row['full_size'])):>14}"
+              f"{'x'.join(map(str, row['reduced_size'])):>14}"
+              f"{'一致' if row['full_prediction'] == row['reduced_prediction'] else '不同':>6}"
+              f"{row['confidence_diff']:>12.4f}{row['tensor_diff']:>11.4f}"
+              f"{row['full_ms']:>10.2f}{row['reduced_ms']:>10.2f}")
+    full_ms = sum(row['full_ms'] for row in rows)
+    reduced_ms = sum(row['reduced_ms'] for row in rows)
+    matched = sum(row['full_prediction'] == row['reduced_prediction'] for row in rows)
+    print(f"top-1一致 {matched}/{len(rows)}，解码总耗时 完整 {full_ms:.1f}ms / 缩小 {reduced_ms:.1f}ms"
+          f"（{full_ms / max(reduced_ms, 1e-9):.1f}倍）")
+
+
+def build_test_model(path, model_kind, num_classes):
+    """生成随机权重的小模型：按列（文本）或按网格（分类）平均池化后接全连接层，输出对空间位置敏感"""
+    onnx = pytest.importorskip('onnx')
+    from onnx import helper, numpy_helper, TensorProto
+
+    rng = np.random.default_rng(0)
+    if model_kind == MODEL_KIND_TEXT:
+        # [N,3,48,320] -> 每8列一个时间步 [N,3,1,40] -> [N,40,3] -> [N,40,C]
+        inputs = helper.make_tensor_value_info('TextRecognizerInput', TensorProto.FLOAT, ['batch', 3, 48, 320])
+        weights = numpy_helper.from_array(rng.standard_normal((3, num_classes)).astype(np.float32) * 20, 'W')
+        shape = numpy_helper.from_array(np.array([0, 3, 40], dtype=np.int64), 'shape')
+        nodes = [
+            helper.make_node('AveragePool', ['TextRecognizerInput'], ['pooled'], kernel_shape=[48, 8], strides=[48, 8]),
+            helper.make_node('Reshape', ['pooled', 'shape'], ['steps']),
+            helper.make_node('Transpose', ['steps'], ['steps_t'], perm=[0, 2, 1]),
+            helper.make_node('MatMul', ['steps_t', 'W'], ['logits']),
+            helper.make_node('Softmax', ['logits'], ['output'], axis=-1),
+        ]
+        initializers = [weights, shape]
+    else:
+        # [N,3,224,224] -> 8x8网格 [N,3,8,8] -> [N,192] -> [N,K]
+        inputs = helper.make_tensor_value_info('ImageClassificationInput', TensorProto.FLOAT, ['batch', 3, 224, 224])
+        weights = numpy_helper.from_array(rng.standard_normal((192, num_classes)).astype(np.float32), 'W')
+        nodes = [
+            helper.make_node('AveragePool', ['ImageClassificationInput'], ['pooled'], kernel_shape=[28, 28],
+                             strides=[28, 28]),
+            helper.make_node('Flatten', ['pooled'], ['flat']),
+            helper.make_node('MatMul', ['flat', 'W'], ['logits']),
+            helper.make_node('Softmax', ['logits'], ['output'], axis=-1),
+        ]
+        initializers = [weights]
+    outputs = helper.make_tensor_value_info('output', TensorProto.FLOAT, None)
+    graph = helper.make_graph(nodes, 'reduced_decode_test', [inputs], [outputs], initializers)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+def create_loader(model_path, config_path=None):
+    loader = ModelLoader(model_path, config_path or find_config_file(model_path))
+    loader.load_model()
+    return loader
+
+
+@pytest.fixture(scope='module')
+def model_dir():
+    with tempfile.TemporaryDirectory() as directory:
+        yield directory
+
+
+@pytest.mark.parametrize('model_kind', [MODEL_KIND_TEXT, MODEL_KIND_CLASSIFICATION])
+def test_reduced_decode_parity(model_dir, model_kind):
+    config = ModelConfig()
+    num_classes = len(config.character) if model_kind == MODEL_KIND_TEXT else len(config.classDict)
+    model_path = os.path.join(model_dir, f"{model_kind}.onnx")
+    build_test_model(model_path, model_kind, num_classes)
+    loader = create_loader(model_path)
+    assert loader.get_model_kind() == model_kind
+
+    images = generate_images(model_kind)
+    rows = compare_decodes(loader, images)
+    print_report(model_path, rows)
+
+    for (name, data), row in zip(images, rows):
+        assert read_image_header(data)[0] in REDUCED_DECODE_FORMATS
+        # 生成的图像都足够大，应当确实缩小解码
+        assert row['reduced_size'][0] < row['full_size'][0], name
+        assert row['reduced_prediction'] == row['full_prediction'], name
+        assert row['confidence_diff'] <= MAX_CONFIDENCE_DIFF, name
+        assert row['tensor_diff'] <= MAX_TENSOR_DIFFS[model_kind], name
+
+
+def test_read_image_header_buffers():
+    data = make_photo(640, 480, 0)
+    # bytes、bytearray、memoryview和uint8数组（如归档成员、HTTP上传的文件）都直接读取图像头
+    for source in (data, bytearray(data), memoryview(data), np.frombuffer(data, dtype=np.uint8)):
+        assert read_image_header(source) == ('JPEG', 640, 480)
+    assert read_image_header(b'not an image') is None
+
+
+def main(model_paths):
+    """对实际模型运行对比，打印对比表"""
+    for model_path in model_paths:
+        loader = create_loader(model_path)
+        print_report(model_path, compare_decodes(loader, generate_images(loader.get_model_kind())))
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python tests/test_reduced_decode.py model.onnx [...]")
+        sys.exit(2)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监视目录测试：归档中的损坏成员在归档已写完时直接记录为失败，不被丢弃、也不按已删除的文件处理
+
+    python -m pytest tests/test_watch_archive.py
+"""
+
+import io
+import os
+import sys
+import time
+import tarfile
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils.model_utils import ModelConfig, MODEL_KIND_TEXT
+from utils.inference_utils import InferenceJob
+from utils.watch_utils import FolderWatcher
+from utils.archive_utils import image_basename
+from test_reduced_decode import build_test_model
+
+
+def make_line_png():
+    img = np.full((48, 200, 3), 255, dtype=np.uint8)
+    cv2.putText(img, 'ab12', (5, 38), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+    return cv2.imencode('.png', img)[1].tobytes()
+
+
+def add_member(tf, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tf.addfile(info, io.BytesIO(data))
+
+
+@pytest.mark.parametrize('use_inotify', [False, True])
+def test_corrupt_archive_member_is_reported(tmp_path, use_inotify):
+    model_path = str(tmp_path / 'rec.onnx')
+    build_test_model(model_path, MODEL_KIND_TEXT, len(ModelConfig().character))
+    job = InferenceJob(model_path, [])
+    job.load()
+
+    watch_dir = tmp_path / 'incoming'
+    watch_dir.mkdir()
+    watcher = FolderWatcher(str(watch_dir), settle_seconds=0.1, poll_interval=0.1, use_inotify=use_inotify)
+    try:
+        # 先写到临时文件名再改名，归档交出时已经写完
+        archive_path = watch_dir / 'shard.tar'
+        with tarfile.open(str(watch_dir / 'shard.tar.part'), 'w') as tf:
+            add_member(tf, 'good.png', make_line_png())
+            add_member(tf, 'bad.png', b'not an image' * 10)
+        os.rename(str(watch_dir / 'shard.tar.part'), str(archive_path))
+
+        results = []
+        deadline = time.monotonic() + 5.0
+        for batch in job.iter_watch_results(watcher, batch_window=0.05,
+                                            should_stop=lambda: len(results) >= 2 or time.monotonic() > deadline):
+            results.extend(batch)
+    finally:
+        watcher.close()
+
+    by_name = {image_basename(result['image_path']): result for result in results}
+    assert sorted(by_name) == ['bad.png', 'good.png']
+    assert by_name['good.png']['status'] == '成功'
+    assert by_name['bad.png']['status'].startswith('失败')
+    assert by_name['bad.png']['image_path'] == f"{archive_path}::bad.png"
+    # 归档没有放回等待，也没有被当作已删除的文件
+    assert str(archive_path) in watcher.processed
+    assert str(archive_path) not in watcher.candidates
+    assert not watcher.retries
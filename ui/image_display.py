@@ -1,7 +1,8 @@
 import os
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QScrollArea, QGridLayout, QMessageBox, QDialog, QHBoxLayout, QPushButton
 from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtGui import QPixmap, QFont
+from PyQt5.QtGui import QPixmap, QFont, QImageReader
+from utils.archive_utils import is_archive
 
 
 class ImagePreviewDialog(QDialog):
@@ -19,10 +20,21 @@ class ImagePreviewDialog(QDialog):
 
 
 class ImageDisplayWidget(QWidget):
-    """图像显示组件，支持多图像缩略图网格展示"""
+    """图像显示组件，支持多图像缩略图网格展示
+
+    click_to_predict 为True（批处理进行中）时点击缩略图发出 predict_requested，否则打开大图预览
+    导入大量图像时只为前 MAX_THUMBNAILS 张生成缩略图，其余只计数
+    """
+    predict_requested = pyqtSignal(str)
+    MAX_THUMBNAILS = 300
+    THUMBNAIL_SIZE = 120
+
     def __init__(self):
         super().__init__()
         self.image_paths = []
+        self.click_to_predict = False
+        # 缩略图占用的内存（字节），供内存监测统计
+        self.thumbnail_bytes = 0
         self.init_ui()
         
     def init_ui(self):
@@ -93,35 +105,63 @@ class ImageDisplayWidget(QWidget):
             if widget:
                 widget.setParent(None)
         
+        self.thumbnail_bytes = 0
+
         # 网格参数
         col_count = 3
         row = 0
         col = 0
-        for idx, image_path in enumerate(self.image_paths):
-            pixmap = QPixmap(image_path)
-            if not pixmap.isNull():
-                thumb = pixmap.scaled(120, 120, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        for idx, image_path in enumerate(self.image_paths[:self.MAX_THUMBNAILS]):
+            if is_archive(image_path):
+                # 归档分片不生成缩略图
+                label = QLabel("[归档]")
+            else:
+                thumb = self.load_thumbnail(image_path)
+                if thumb.isNull():
+                    continue
                 label = ClickableLabel(image_path)
                 label.setPixmap(thumb)
-                label.setAlignment(Qt.AlignCenter)
-                label.setStyleSheet("border: 1px solid #ccc; padding: 3px;")
-                label.clicked.connect(self.show_preview)
-                # 文件名
-                filename = os.path.basename(image_path)
-                filename_label = QLabel(filename)
-                filename_label.setAlignment(Qt.AlignCenter)
-                filename_label.setWordWrap(True)
-                # 容器
-                container = QWidget()
-                container_layout = QVBoxLayout(container)
-                container_layout.setContentsMargins(2,2,2,2)
-                container_layout.addWidget(label)
-                container_layout.addWidget(filename_label)
-                self.scroll_layout.addWidget(container, row, col)
-                col += 1
-                if col >= col_count:
-                    col = 0
-                    row += 1
+                self.thumbnail_bytes += thumb.width() * thumb.height() * thumb.depth() // 8
+                label.clicked.connect(self.on_image_clicked)
+            label.setAlignment(Qt.AlignCenter)
+            label.setStyleSheet("border: 1px solid #ccc; padding: 3px;")
+            # 文件名
+            filename = os.path.basename(image_path)
+            filename_label = QLabel(filename)
+            filename_label.setAlignment(Qt.AlignCenter)
+            filename_label.setWordWrap(True)
+            # 容器
+            container = QWidget()
+            container_layout = QVBoxLayout(container)
+            container_layout.setContentsMargins(2,2,2,2)
+            container_layout.addWidget(label)
+            container_layout.addWidget(filename_label)
+            self.scroll_layout.addWidget(container, row, col)
+            col += 1
+            if col >= col_count:
+                col = 0
+                row += 1
+
+        hidden = len(self.image_paths) - self.MAX_THUMBNAILS
+        if hidden > 0:
+            more_label = QLabel(f"另有 {hidden} 张图像未显示缩略图")
+            more_label.setAlignment(Qt.AlignCenter)
+            self.scroll_layout.addWidget(more_label, row + (1 if col else 0), 0, 1, col_count)
+
+    def load_thumbnail(self, image_path):
+        """按缩略图尺寸解码（JPEG可在解码时缩小），避免为大图完整解码"""
+        reader = QImageReader(image_path)
+        size = reader.size()
+        if size.isValid():
+            reader.setScaledSize(size.scaled(self.THUMBNAIL_SIZE, self.THUMBNAIL_SIZE, Qt.KeepAspectRatio))
+        image = reader.read()
+        return QPixmap.fromImage(image)
+
+    def on_image_clicked(self, image_path):
+        if self.click_to_predict:
+            self.predict_requested.emit(image_path)
+        else:
+            self.show_preview(image_path)
 
     def show_preview(self, image_path):
         dlg = ImagePreviewDialog(image_path, self)
@@ -1,15 +1,18 @@
 import os
 import numpy as np
 from PyQt5.QtWidgets import (QMainWindow, QVBoxLayout, QHBoxLayout, QWidget,
-                             QPushButton, QProgressBar, QSplitter, QMessageBox, QFileDialog, QLabel)
+                             QPushButton, QProgressBar, QSplitter, QMessageBox, QFileDialog, QLabel,
+                             QCheckBox)
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
 
 from .image_display import ImageDisplayWidget
 from .result_table import ResultTableWidget
-from .model_processor import ModelProcessor
+from .model_processor import ModelProcessor, FolderWatchProcessor, ImageImportProcessor
 from utils.model_utils import find_config_file
 from utils.answer_utils import AnswerMatcher
+from utils.cache_utils import DEFAULT_CACHE_DIR
+from utils.memory_utils import STAGE_LABELS
 
 
 class AlgorithmRecognitionPlatform(QMainWindow):
@@ -17,8 +20,13 @@ class AlgorithmRecognitionPlatform(QMainWindow):
     def __init__(self):
         super().__init__()
         self.model_path = None
+        self.model_paths = []  # 选择多个模型时进入对比模式
+        self.det_model_path = None  # 文本检测模型，设置后进行整页OCR
         self.image_paths = []
         self.config_path = None
+        self.export_path = None
+        self.watch_processor = None  # 监视目录线程，运行期间模型保持加载
+        self.import_processor = None  # 图像导入线程（扫描目录、校验文件头）
         self.answer_matcher = AnswerMatcher()  # 加载标准答案
         self.init_ui()
         
@@ -45,6 +53,9 @@ class AlgorithmRecognitionPlatform(QMainWindow):
         self.avg_acc_label.setFont(QFont("Arial", 10, QFont.Bold))
         self.avg_acc_label.setStyleSheet("color: #1976d2; padding: 0 30px;")
         self.statusBar().addPermanentWidget(self.avg_acc_label)
+        self.memory_label = QLabel("")
+        self.memory_label.setStyleSheet("padding: 0 10px;")
+        self.statusBar().addPermanentWidget(self.memory_label)
         self.center()
         
     def setup_styles(self):
@@ -95,15 +106,52 @@ class AlgorithmRecognitionPlatform(QMainWindow):
         self.upload_image_btn = QPushButton("上传图像")
         self.upload_image_btn.clicked.connect(self.upload_images)
         button_layout.addWidget(self.upload_image_btn)
+
+        self.add_folder_btn = QPushButton("添加文件夹")
+        self.add_folder_btn.setToolTip("递归导入文件夹中的图像和归档文件，损坏或不支持的文件在识别前剔除")
+        self.add_folder_btn.clicked.connect(self.add_folder)
+        button_layout.addWidget(self.add_folder_btn)
         
         self.upload_model_btn = QPushButton("加载模型")
         self.upload_model_btn.clicked.connect(self.upload_model)
         button_layout.addWidget(self.upload_model_btn)
         
+        self.upload_det_model_btn = QPushButton("加载检测模型")
+        self.upload_det_model_btn.setToolTip("加载文本检测模型后对整页图像先检测文本行再识别，取消选择则恢复单行识别")
+        self.upload_det_model_btn.clicked.connect(self.upload_det_model)
+        button_layout.addWidget(self.upload_det_model_btn)
+        
         self.process_btn = QPushButton("开始识别")
         self.process_btn.clicked.connect(self.start_processing)
         self.process_btn.setEnabled(False)
         button_layout.addWidget(self.process_btn)
+
+        self.watch_btn = QPushButton("监视目录")
+        self.watch_btn.setToolTip("选择目录后持续识别新写入的图像，模型只加载一次，结果逐批追加到表格")
+        self.watch_btn.clicked.connect(self.toggle_watch)
+        button_layout.addWidget(self.watch_btn)
+
+        self.export_btn = QPushButton("导出设置")
+        self.export_btn.setToolTip("选择导出文件，识别过程中逐条写出结果")
+        self.export_btn.clicked.connect(self.choose_export_path)
+        button_layout.addWidget(self.export_btn)
+
+        self.dedup_checkbox = QCheckBox("重复图像去重")
+        self.dedup_checkbox.setToolTip("像素完全相同的图像只推理一次，其余复用结果")
+        button_layout.addWidget(self.dedup_checkbox)
+
+        self.cache_checkbox = QCheckBox("预处理缓存")
+        self.cache_checkbox.setToolTip(f"缓存预处理结果，重复识别同一批图像时跳过解码和预处理\n缓存目录: {DEFAULT_CACHE_DIR}")
+        button_layout.addWidget(self.cache_checkbox)
+
+        self.batch_checkbox = QCheckBox("自适应批大小")
+        self.batch_checkbox.setToolTip("根据实测吞吐量和内存自动调整批大小，最优值按模型和主机记录")
+        button_layout.addWidget(self.batch_checkbox)
+
+        self.memory_checkbox = QCheckBox("内存监测")
+        self.memory_checkbox.setToolTip("定期采样内存并按处理阶段归类，发现持续增长时提示（会拖慢处理）\n"
+                                        "设置了导出文件时在其旁边写出 .memory.csv 时间序列")
+        button_layout.addWidget(self.memory_checkbox)
         
         button_layout.addStretch()
         main_layout.addLayout(button_layout)
@@ -120,6 +168,7 @@ class AlgorithmRecognitionPlatform(QMainWindow):
         
         # 左侧图像显示区域
         self.image_display = ImageDisplayWidget()
+        self.image_display.predict_requested.connect(self.predict_single)
         content_splitter.addWidget(self.image_display)
         
         # 右侧结果表格区域
@@ -134,35 +183,103 @@ class AlgorithmRecognitionPlatform(QMainWindow):
         """上传图像"""
         file_dialog = QFileDialog()
         file_dialog.setFileMode(QFileDialog.ExistingFiles)
-        file_dialog.setNameFilter("图像文件 (*.png *.jpg *.jpeg)")
+        file_dialog.setNameFilter("图像或归档文件 (*.png *.jpg *.jpeg *.tar *.zip)")
         
         if file_dialog.exec_():
             new_image_paths = file_dialog.selectedFiles()
             if new_image_paths:
-                self.image_display.add_image(new_image_paths)  # 追加到显示组件
-                self.image_paths = self.image_display.get_image_paths()  # 从显示组件获取完整列表
-                self.statusBar().showMessage(f"已上传 {len(new_image_paths)} 张图像，总计 {len(self.image_paths)} 张")
-                self.update_process_button()
+                self.start_import(new_image_paths)
+
+    def add_folder(self):
+        """递归导入文件夹"""
+        directory = QFileDialog.getExistingDirectory(self, "添加文件夹")
+        if directory:
+            self.start_import([directory])
+
+    def start_import(self, paths):
+        """在后台线程中扫描目录并校验文件头"""
+        self.set_buttons_enabled(False)
+        self.progress_bar.setVisible(True)
+        self.update_progress(0)
+        self.statusBar().showMessage("正在导入图像...")
+        self.import_processor = ImageImportProcessor(paths)
+        self.import_processor.progress_signal.connect(self.update_progress)
+        self.import_processor.result_signal.connect(self.handle_import)
+        self.import_processor.error_signal.connect(self.handle_error)
+        self.import_processor.start()
+
+    def handle_import(self, data):
+        """追加导入的图像，并提示跳过的文件"""
+        self.import_processor = None
+        self.progress_bar.setVisible(False)
+        self.set_buttons_enabled(True)
+        new_image_paths = data['paths']
+        if new_image_paths:
+            self.image_display.add_image(new_image_paths)  # 追加到显示组件
+            self.image_paths = self.image_display.get_image_paths()  # 从显示组件获取完整列表
+            self.update_process_button()
+        message = f"已上传 {len(new_image_paths)} 张图像，总计 {len(self.image_paths)} 张"
+        if data['skipped']:
+            message += f"，跳过 {len(data['skipped'])} 个文件"
+        self.statusBar().showMessage(message)
+        if data['skipped']:
+            QMessageBox.warning(self, "跳过的文件",
+                                f"以下 {len(data['skipped'])} 个文件损坏或不是支持的图像，不会参与识别：\n\n"
+                                f"{data['summary']}")
         
     def upload_model(self):
         """上传模型"""
         file_dialog = QFileDialog()
+        file_dialog.setFileMode(QFileDialog.ExistingFiles)
         file_dialog.setNameFilter("ONNX模型文件 (*.onnx)")
         
         if file_dialog.exec_():
-            self.model_path = file_dialog.selectedFiles()[0]
-            self.statusBar().showMessage(f"已上传模型: {os.path.basename(self.model_path)}")
+            self.model_paths = file_dialog.selectedFiles()
+            self.model_path = self.model_paths[0]
+            if len(self.model_paths) > 1:
+                self.statusBar().showMessage(f"已上传 {len(self.model_paths)} 个模型，将进行对比识别")
+            else:
+                self.statusBar().showMessage(f"已上传模型: {os.path.basename(self.model_path)}")
             
             # 尝试查找配置文件
             self.find_config_file()
+            self.update_option_controls()
             self.update_process_button()
             
+    def upload_det_model(self):
+        """上传文本检测模型（整页OCR），取消选择则清除"""
+        path, _ = QFileDialog.getOpenFileName(self, "加载文本检测模型", "", "ONNX模型文件 (*.onnx)")
+        self.det_model_path = path or None
+        if self.det_model_path:
+            self.statusBar().showMessage(f"已加载检测模型: {os.path.basename(self.det_model_path)}，将进行整页OCR")
+        else:
+            self.statusBar().showMessage("已清除检测模型，按单行文本识别")
+        self.update_option_controls()
+
+    def choose_export_path(self):
+        """选择结果导出文件，取消选择则不导出"""
+        path, _ = QFileDialog.getSaveFileName(self, "导出结果", "results.csv",
+                                              "CSV文件 (*.csv);;JSON Lines文件 (*.jsonl);;Parquet文件 (*.parquet)")
+        self.export_path = path or None
+        if self.export_path:
+            self.statusBar().showMessage(f"识别结果将导出到: {self.export_path}")
+        else:
+            self.statusBar().showMessage("已取消结果导出")
+
     def find_config_file(self):
         """查找配置文件"""
         self.config_path = find_config_file(self.model_path)
         # if self.config_path:
         #     self.statusBar().showMessage(f"已找到配置文件: {os.path.basename(self.config_path)}")
             
+    def update_option_controls(self):
+        """去重、预处理缓存和自适应批大小只作用于单模型识别，多模型对比和整页OCR时禁用"""
+        single_model = len(self.model_paths) <= 1 and not self.det_model_path
+        for checkbox in (self.dedup_checkbox, self.cache_checkbox, self.batch_checkbox):
+            if not single_model:
+                checkbox.setChecked(False)
+            checkbox.setEnabled(single_model)
+
     def update_process_button(self):
         """更新处理按钮状态"""
         # 同步图像路径
@@ -177,71 +294,193 @@ class AlgorithmRecognitionPlatform(QMainWindow):
             
         # 禁用按钮
         self.upload_image_btn.setEnabled(False)
+        self.add_folder_btn.setEnabled(False)
         self.upload_model_btn.setEnabled(False)
+        self.upload_det_model_btn.setEnabled(False)
         self.process_btn.setEnabled(False)
+        self.watch_btn.setEnabled(False)
         
         # 显示进度条
         self.progress_bar.setVisible(True)
-        self.progress_bar.setValue(0)
+        self.update_progress(0)
         
         # 创建处理线程
-        self.processor = ModelProcessor(self.model_path, self.image_paths, self.config_path)
+        model_path = self.model_paths if len(self.model_paths) > 1 else self.model_path
+        self.processor = ModelProcessor(model_path, self.image_paths, self.config_path,
+                                        dedup=self.dedup_checkbox.isChecked(),
+                                        answer_matcher=self.answer_matcher,
+                                        export_path=self.export_path,
+                                        det_model_path=self.det_model_path,
+                                        tensor_cache_dir=DEFAULT_CACHE_DIR if self.cache_checkbox.isChecked() else None,
+                                        adaptive_batch=self.batch_checkbox.isChecked(),
+                                        **self.get_memory_options())
         self.processor.progress_signal.connect(self.update_progress)
+        self.processor.memory_signal.connect(self.update_memory)
         self.processor.result_signal.connect(self.handle_results)
         self.processor.error_signal.connect(self.handle_error)
+        self.processor.interactive_signal.connect(self.handle_interactive_result)
+        self.image_display.click_to_predict = True
         self.processor.start()
         
+    def toggle_watch(self):
+        """开始或停止监视目录"""
+        if self.watch_processor is not None:
+            self.watch_btn.setEnabled(False)
+            self.watch_processor.requestInterruption()
+            return
+        if not self.model_path:
+            QMessageBox.warning(self, "警告", "请先上传模型")
+            return
+        directory = QFileDialog.getExistingDirectory(self, "选择监视目录")
+        if not directory:
+            return
+
+        self.set_buttons_enabled(False)
+        self.watch_btn.setText("停止监视")
+        self.result_table.update_results([])
+        model_path = self.model_paths if len(self.model_paths) > 1 else self.model_path
+        self.watch_processor = FolderWatchProcessor(directory, model_path, self.config_path,
+                                                    dedup=self.dedup_checkbox.isChecked(),
+                                                    answer_matcher=self.answer_matcher,
+                                                    export_path=self.export_path,
+                                                    det_model_path=self.det_model_path,
+                                                    adaptive_batch=self.batch_checkbox.isChecked(),
+                                                    **self.get_memory_options())
+        self.watch_processor.batch_signal.connect(self.handle_watch_batch)
+        self.watch_processor.memory_signal.connect(self.update_memory)
+        self.watch_processor.status_signal.connect(self.statusBar().showMessage)
+        self.watch_processor.error_signal.connect(self.handle_error)
+        self.watch_processor.finished.connect(self.watch_finished)
+        self.statusBar().showMessage("正在加载模型...")
+        self.watch_processor.start()
+
+    def get_memory_options(self):
+        """内存监测选项，缩略图的内存由界面统计"""
+        return {
+            'memory_profile': self.memory_checkbox.isChecked(),
+            'memory_gauges': {'thumbnails': lambda: self.image_display.thumbnail_bytes}
+        }
+
+    def update_memory(self, data):
+        """在状态栏显示当前内存占用，持续增长的阶段标红"""
+        stages = sorted(data['stages_mb'].items(), key=lambda item: item[1], reverse=True)
+        self.memory_label.setToolTip('\n'.join(f"{STAGE_LABELS.get(name, name)}: {mb:.1f} MB"
+                                                for name, mb in stages))
+        text = f"内存：{data['rss_mb']:.0f} MB"
+        if data['growing']:
+            text += "（持续增长：" + "、".join(STAGE_LABELS.get(name, name) for name in data['growing']) + "）"
+            self.memory_label.setStyleSheet("color: #d32f2f; padding: 0 10px;")
+        else:
+            self.memory_label.setStyleSheet("padding: 0 10px;")
+        self.memory_label.setText(text)
+
+    def handle_watch_batch(self, data):
+        """追加监视目录识别出的一批结果，被重写后再次识别的文件替换原来的行"""
+        self.result_table.append_results(data['results'], data.get('model_names'), replace=True)
+        self.result_table.table.scrollToBottom()
+        if data['mean_accuracy'] is not None:
+            self.avg_acc_label.setText(f"平均正确率：{data['mean_accuracy']:.2f}%")
+        self.statusBar().showMessage(f"监视中：已识别 {data['total']} 张")
+
+    def watch_finished(self):
+        """监视线程结束，恢复界面"""
+        self.watch_processor = None
+        self.watch_btn.setText("监视目录")
+        self.watch_btn.setEnabled(True)
+        self.set_buttons_enabled(True)
+
+    def set_buttons_enabled(self, enabled):
+        """处理期间禁用上传和识别按钮"""
+        self.upload_image_btn.setEnabled(enabled)
+        self.add_folder_btn.setEnabled(enabled)
+        self.upload_model_btn.setEnabled(enabled)
+        self.upload_det_model_btn.setEnabled(enabled)
+        if enabled:
+            self.update_process_button()
+        else:
+            self.process_btn.setEnabled(False)
+
+    def predict_single(self, image_path):
+        """批处理进行中点击缩略图：在下一个批边界插队识别该图像"""
+        if self.processor.request_prediction(image_path):
+            self.statusBar().showMessage(f"正在插队识别: {os.path.basename(image_path)}")
+        else:
+            self.image_display.show_preview(image_path)
+
+    def handle_interactive_result(self, result):
+        """显示插队识别的结果"""
+        name = os.path.basename(result['image_path'])
+        if result['status'] != '成功':
+            self.statusBar().showMessage(f"{name}: {result['status']}")
+            return
+        message = f"{name}: {result['prediction']}（置信度 {result['confidence']:.4f}"
+        if result.get('accuracy') is not None:
+            message += f"，正确率 {result['accuracy']:.1f}%"
+        message += f"，推理 {result['infer_ms']:.0f}ms）"
+        self.statusBar().showMessage(message)
+
     def update_progress(self, value):
-        """更新进度条"""
+        """更新进度条，value 为负数时（总数未知）显示为忙碌状态"""
+        if value < 0:
+            self.progress_bar.setRange(0, 0)
+            return
+        self.progress_bar.setRange(0, 100)
         self.progress_bar.setValue(value)
         
     def handle_results(self, data):
-        """处理结果"""
-
-        # 增加标准答案和正确率
-        for result in data['results']:
-            filename = os.path.basename(result['image_path'])
-            answer = self.answer_matcher.get_answer(filename)
-            result['answer'] = answer if answer is not None else ''
-            if answer is not None:
-                result['accuracy'] = self.answer_matcher.calculate_accuracy(result['prediction'], answer)
-            else:
-                result['accuracy'] = None
-
-        self.result_table.update_results(data['results'])
+        """处理结果（标准答案和正确率已由处理线程补充）"""
+        self.image_display.click_to_predict = False
+        self.result_table.update_results(data['results'], data.get('model_names'))
 
-        # 计算平均正确率
-        acc_list = [r['accuracy'] for r in data['results'] if r.get('accuracy') is not None]
-        if acc_list:
-            avg_acc = sum(acc_list) / len(acc_list)
-            self.avg_acc_label.setText(f"平均正确率：{avg_acc:.2f}%")
+        # 平均正确率等统计由处理线程流式累加
+        report = data['report']
+        if report['mean_accuracy'] is not None:
+            self.avg_acc_label.setText(f"平均正确率：{report['mean_accuracy']:.2f}%")
         else:
             self.avg_acc_label.setText("平均正确率：-")
 
-        # 计算统计信息
-        successful = sum(1 for r in data['results'] if r['status'] == '成功')
+        successful = report['successful']
         total = data['total']
         # 恢复按钮状态
         self.upload_image_btn.setEnabled(True)
+        self.add_folder_btn.setEnabled(True)
         self.upload_model_btn.setEnabled(True)
+        self.upload_det_model_btn.setEnabled(True)
         self.process_btn.setEnabled(True)
+        self.watch_btn.setEnabled(True)
         self.progress_bar.setVisible(False)
-        self.statusBar().showMessage(f"处理完成: {successful}/{total} 成功")
+        message = f"处理完成: {successful}/{total} 成功"
+        if data.get('saved_inferences'):
+            message += f"，去重节省推理 {data['saved_inferences']} 次"
+        if data.get('cache_hits'):
+            message += f"，缓存命中 {data['cache_hits']} 张"
+        if data.get('batch_size'):
+            message += f"，批大小 {data['batch_size']}"
+        if self.export_path:
+            message += f"，结果已导出到 {os.path.basename(self.export_path)}"
+        self.statusBar().showMessage(message)
         # 显示统计信息
         if successful > 0:
             avg_confidence = np.mean([r['confidence'] for r in data['results'] if r['status'] == '成功'])
+            summary = ''.join(f"\n{s['model']}: {s['images_per_second']:.1f} 张/秒"
+                              for s in data.get('model_summary', []))
             QMessageBox.information(self, "处理完成", 
                                   f"处理完成！\n"
-                                  f"成功识别: {successful}/{total}")
+                                  f"成功识别: {successful}/{total}"
+                                  f"{summary}")
         
     def handle_error(self, error_msg):
         """处理错误"""
         QMessageBox.critical(self, "错误", f"处理过程中发生错误:\n{error_msg}")
+        self.image_display.click_to_predict = False
         
         # 恢复按钮状态
         self.upload_image_btn.setEnabled(True)
+        self.add_folder_btn.setEnabled(True)
         self.upload_model_btn.setEnabled(True)
+        self.upload_det_model_btn.setEnabled(True)
         self.process_btn.setEnabled(True)
+        self.watch_btn.setEnabled(True)
         self.progress_bar.setVisible(False)
         
         self.statusBar().showMessage("处理失败") 
@@ -1,71 +1,258 @@
-import os
-import numpy as np
+import threading
 from PyQt5.QtCore import QThread, pyqtSignal
-from utils.model_utils import ModelLoader, find_config_file
+from utils.inference_utils import InferenceJob, MultiModelJob, PageOCRJob
+from utils.export_utils import create_result_writer
+from utils.cache_utils import TensorCache
+from utils.batch_utils import AdaptiveBatchController
+from utils.eval_utils import get_report_path
+from utils.watch_utils import FolderWatcher
+from utils.schedule_utils import PriorityScheduler
+from utils.import_utils import import_images
+from utils.memory_utils import MemoryMonitor, get_memory_log_path, MB
 
 
 class ModelProcessor(QThread):
-    """模型处理线程，避免界面卡顿"""
+    """模型处理线程，避免界面卡顿
+
+    model_path 传入多个模型路径的列表时进入多模型对比模式；
+    指定 det_model_path 时进行整页OCR（先检测文本行再识别）；
+    处理过程中可通过 request_prediction 插队识别单张图像，结果由 interactive_signal 发出；
+    开启 memory_profile 时定期采样内存，由 memory_signal 发出（指定了导出文件时同时写出时间序列）
+    """
     progress_signal = pyqtSignal(int)
     result_signal = pyqtSignal(dict)
     error_signal = pyqtSignal(str)
-    
-    def __init__(self, model_path, image_paths, config_path=None):
+    interactive_signal = pyqtSignal(dict)
+    memory_signal = pyqtSignal(dict)
+
+    def __init__(self, model_path, image_paths, config_path=None, dedup=False,
+                 answer_matcher=None, export_path=None, det_model_path=None, tensor_cache_dir=None,
+                 adaptive_batch=False, memory_profile=False, memory_gauges=None):
         super().__init__()
         self.model_path = model_path
         self.image_paths = image_paths
         self.config_path = config_path
+        self.dedup = dedup
+        self.answer_matcher = answer_matcher
+        self.export_path = export_path
+        self.det_model_path = det_model_path
+        self.tensor_cache_dir = tensor_cache_dir
+        self.adaptive_batch = adaptive_batch
+        self.memory_profile = memory_profile
+        # 内存监测的量表（名称 -> 返回字节数的函数），如界面缩略图
+        self.memory_gauges = memory_gauges or {}
         self.model_loader = None
-        
+        self.job = None
+        self.scheduler = PriorityScheduler()
+
+    def create_job(self):
+        """按模型和选项创建推理任务"""
+        multi_model = isinstance(self.model_path, (list, tuple)) and len(self.model_path) > 1
+        if (multi_model or self.det_model_path) and (self.dedup or self.tensor_cache_dir or self.adaptive_batch):
+            raise Exception("去重、预处理缓存和自适应批大小仅支持单模型识别")
+        if multi_model:
+            return MultiModelJob(list(self.model_path), self.image_paths, answer_matcher=self.answer_matcher)
+        model_path = self.model_path[0] if isinstance(self.model_path, (list, tuple)) else self.model_path
+        if self.det_model_path:
+            return PageOCRJob(self.det_model_path, model_path, self.image_paths, self.config_path,
+                              answer_matcher=self.answer_matcher)
+        tensor_cache = TensorCache(self.tensor_cache_dir) if self.tensor_cache_dir else None
+        batch_controller = AdaptiveBatchController() if self.adaptive_batch else None
+        return InferenceJob(model_path, self.image_paths, self.config_path, dedup=self.dedup,
+                            answer_matcher=self.answer_matcher, tensor_cache=tensor_cache,
+                            batch_controller=batch_controller)
+
+    def start_memory_monitor(self, job):
+        """按需开始内存监测，处理线程中累积的结果列表计入"结果"阶段"""
+        if not self.memory_profile:
+            return None
+        csv_path = get_memory_log_path(self.export_path) if self.export_path else None
+        monitor = MemoryMonitor(csv_path, on_sample=self.emit_memory_sample)
+        monitor.register_stage('results', [ModelProcessor.run, FolderWatchProcessor.run])
+        for name, func in self.memory_gauges.items():
+            monitor.add_gauge(name, func)
+        monitor.start()
+        job.memory_monitor = monitor
+        return monitor
+
+    def emit_memory_sample(self, sample):
+        values = sample['values']
+        self.memory_signal.emit({
+            'rss_mb': values['rss'] / MB,
+            'stages_mb': {name: value / MB for name, value in values.items()
+                          if name not in ('rss', 'traced', 'traced_peak')},
+            'growing': sample['growing']
+        })
+
     def run(self):
+        result_writer = None
+        memory_monitor = None
         try:
-            # 查找配置文件
-            if not self.config_path:
-                self.config_path = find_config_file(self.model_path)
-            
-            # 创建模型加载器
-            self.model_loader = ModelLoader(self.model_path, self.config_path)
-            
-            # 加载模型
+            job = self.create_job()
+
+            # 指定了导出文件时，结果边产生边写出
+            if self.export_path:
+                result_writer = create_result_writer(self.export_path, job.result_fields)
+                job.result_writer = result_writer
+
+            # 加载模型（含配置文件查找和标签映射）
             self.progress_signal.emit(20)
-            self.model_loader.load_model()
-            
-            # 加载标签映射
-            if self.config_path and os.path.exists(self.config_path):
-                import json
-                with open(self.config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    if 'label_map_file' in config:
-                        self.model_loader.load_label_map(config['label_map_file'])
-            
+            memory_monitor = self.start_memory_monitor(job)
+            job.load()
+            self.config_path = job.config_path
+            self.model_loader = job.model_loader
+            self.model_loader.scheduler = self.scheduler
+            self.job = job
+
             results = []
-            total_images = len(self.image_paths)
-            
-            for i, img_path in enumerate(self.image_paths):
-                try:
-                    # 进行预测
-                    prediction, confidence = self.model_loader.predict(img_path)
-                    
-                    results.append({
-                        'image_path': img_path,
-                        'prediction': prediction,
-                        'confidence': confidence,
-                        'status': '成功'
-                    })
-                    
-                except Exception as e:
-                    results.append({
-                        'image_path': img_path,
-                        'prediction': '错误',
-                        'confidence': 0.0,
-                        'status': f'失败: {str(e)}'
-                    })
-                
-                progress = 20 + int(70 * (i + 1) / total_images)
-                self.progress_signal.emit(progress)
-            
+            # 归档文件按其中的图像成员计数；压缩的tar计数需要多解压一遍，总数未知时进度条显示为忙碌状态
+            total_images = job.count_images()
+            if total_images is None:
+                self.progress_signal.emit(-1)
+
+            for i, result in enumerate(job.iter_results()):
+                results.append(result)
+
+                if total_images is not None:
+                    progress = 20 + int(70 * (i + 1) / max(1, total_images))
+                    self.progress_signal.emit(progress)
+            if total_images is None:
+                total_images = len(results)
+
+            if result_writer is not None:
+                result_writer.close()
+                result_writer = None
+
+            # 评测报告随导出文件一起写出
+            report = job.evaluator.report()
+            if self.export_path:
+                job.evaluator.save_report(get_report_path(self.export_path))
+
             self.progress_signal.emit(100)
-            self.result_signal.emit({'results': results, 'total': total_images})
-            
+            data = {'results': results, 'total': total_images, 'saved_inferences': job.saved_inferences,
+                    'report': report}
+            if getattr(job, 'tensor_cache', None) is not None:
+                data['cache_hits'] = job.tensor_cache.hits
+            if getattr(job, 'batch_controller', None) is not None:
+                data['batch_size'] = job.batch_controller.best_batch_size
+            if isinstance(job, MultiModelJob):
+                data['model_names'] = job.model_names
+                data['model_summary'] = job.get_model_summary()
+            self.result_signal.emit(data)
+
+        except Exception as e:
+            self.error_signal.emit(str(e))
+        finally:
+            if result_writer is not None:
+                result_writer.close()
+            if memory_monitor is not None:
+                memory_monitor.stop()
+
+    def request_prediction(self, img_path):
+        """插队识别单张图像，模型尚未加载完成时返回False"""
+        job = self.job
+        if job is None or not self.isRunning():
+            return False
+        threading.Thread(target=self._predict_interactive, args=(job, img_path), daemon=True).start()
+        return True
+
+    def _predict_interactive(self, job, img_path):
+        """在独立线程中等待批边界并识别"""
+        try:
+            result = job.predict_interactive(img_path)
+        except Exception as e:
+            result = {
+                'image_path': img_path,
+                'prediction': '错误',
+                'confidence': 0.0,
+                'status': f'失败: {str(e)}'
+            }
+        self.interactive_signal.emit(result)
+
+
+class FolderWatchProcessor(ModelProcessor):
+    """目录监视线程：模型只加载一次，新图像写完后按小批识别，每批结果立即发出
+
+    调用 requestInterruption() 停止监视。
+    """
+    batch_signal = pyqtSignal(dict)
+    status_signal = pyqtSignal(str)
+
+    def __init__(self, watch_dir, model_path, config_path=None, batch_window=0.1, **kwargs):
+        super().__init__(model_path, [], config_path, **kwargs)
+        self.watch_dir = watch_dir
+        self.batch_window = batch_window
+
+    def run(self):
+        result_writer = None
+        watcher = None
+        memory_monitor = None
+        try:
+            job = self.create_job()
+            if self.export_path:
+                # 文件被重写后会再次识别，同一文件只保留最新的结果
+                result_writer = create_result_writer(self.export_path, job.result_fields, unique=True)
+                job.result_writer = result_writer
+            memory_monitor = self.start_memory_monitor(job)
+            job.load()
+            self.config_path = job.config_path
+            self.model_loader = job.model_loader
+            self.model_loader.scheduler = self.scheduler
+            self.job = job
+
+            watcher = FolderWatcher(self.watch_dir)
+            self.status_signal.emit(f"正在监视 {self.watch_dir}（{watcher.mode}）")
+            model_names = job.model_names if isinstance(job, MultiModelJob) else None
+            total = 0
+            for results in job.iter_watch_results(watcher, self.batch_window, self.isInterruptionRequested):
+                total += len(results)
+                self.batch_signal.emit({
+                    'results': results,
+                    'model_names': model_names,
+                    'total': total,
+                    'mean_accuracy': job.evaluator.mean_accuracy
+                })
+
+            if self.export_path:
+                job.evaluator.save_report(get_report_path(self.export_path))
+            self.status_signal.emit(f"已停止监视，共识别 {total} 张")
         except Exception as e:
-            self.error_signal.emit(str(e)) 
\ No newline at end of file
+            self.error_signal.emit(str(e))
+        finally:
+            if watcher is not None:
+                watcher.close()
+            if result_writer is not None:
+                result_writer.close()
+            if memory_monitor is not None:
+                memory_monitor.stop()
+
+
+class ImageImportProcessor(QThread):
+    """图像导入线程：并行扫描目录并校验文件头，不阻塞界面
+
+    完成后 result_signal 发出 {'paths': 可识别的文件, 'skipped': [(文件, 原因), ...], 'summary': 跳过说明, ...}
+    """
+    progress_signal = pyqtSignal(int)
+    result_signal = pyqtSignal(dict)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, paths):
+        super().__init__()
+        # 目录或单个文件
+        self.paths = paths
+
+    def run(self):
+        try:
+            report = import_images(self.paths, progress=self.report_progress)
+            self.result_signal.emit({
+                'paths': report.paths,
+                'skipped': report.skipped,
+                'summary': report.summary(),
+                'scan_seconds': report.scan_seconds,
+                'validate_seconds': report.validate_seconds
+            })
+        except Exception as e:
+            self.error_signal.emit(str(e))
+
+    def report_progress(self, checked, total):
+        self.progress_signal.emit(int(100 * checked / max(1, total)))
@@ -1,13 +1,15 @@
-import os
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QTableWidget, QTableWidgetItem
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont, QColor
+from utils.archive_utils import image_basename
 
 
 class ResultTableWidget(QWidget):
     """结果表格组件"""
     def __init__(self):
         super().__init__()
+        # 图像路径 -> 行号，同一图像再次识别（监视目录时文件被重写）时替换原来的行
+        self.row_by_path = {}
         self.init_ui()
         
     def init_ui(self):
@@ -28,35 +30,89 @@ class ResultTableWidget(QWidget):
         
         self.setLayout(layout)
         
-    def update_results(self, results):
-        """更新结果表格"""
-        self.table.setRowCount(len(results))
-        
-        for i, result in enumerate(results):
+    def update_results(self, results, model_names=None):
+        """更新结果表格
+            :param model_names: 多模型对比时的模型名称，各模型的预测结果和正确率并列显示
+        """
+        self.set_headers(model_names)
+        self.table.setRowCount(0)
+        self.append_results(results, model_names)
+
+    def set_headers(self, model_names=None):
+        """按单模型或多模型对比设置表头"""
+        if model_names:
+            headers = ["图像"]
+            for name in model_names:
+                headers += [f"{name} 预测结果", f"{name} 正确率"]
+            headers += ["正确答案", "状态"]
+        else:
+            headers = ["图像", "预测结果", "正确答案", "正确率", "状态"]
+        self.table.setColumnCount(len(headers))
+        self.table.setHorizontalHeaderLabels(headers)
+
+    def append_results(self, results, model_names=None, replace=False):
+        """在表格末尾追加结果（监视目录时逐批追加）
+            :param replace: 已在表格中的图像替换原来的行，而不是追加新行
+        """
+        if self.table.rowCount() == 0:
+            self.set_headers(model_names)
+            self.row_by_path = {}
+        column_count = self.table.columnCount()
+
+        rows = []
+        row_count = self.table.rowCount()
+        for result in results:
+            i = self.row_by_path.get(result['image_path']) if replace else None
+            if i is None:
+                i = row_count
+                row_count += 1
+                self.row_by_path[result['image_path']] = i
+            rows.append(i)
+        self.table.setRowCount(row_count)
+
+        for i, result in zip(rows, results):
             # 图像名称
-            image_name = os.path.basename(result['image_path'])
+            image_name = image_basename(result['image_path'])
             self.table.setItem(i, 0, QTableWidgetItem(image_name))
-            
-            # 预测结果
-            self.table.setItem(i, 1, QTableWidgetItem(str(result['prediction'])))
-            
-            # 置信度
-            # confidence = f"{result['confidence']:.4f}" if result['confidence'] > 0 else "N/A"
-            # self.table.setItem(i, 2, QTableWidgetItem(confidence))
-
-            # 正确答案
-            self.table.setItem(i, 2, QTableWidgetItem(str(result.get('answer', ''))))
-            # 正确率
-            acc = result.get('accuracy', None)
-            acc_str = f"{acc:.1f}%" if acc is not None else ""
-            self.table.setItem(i, 3, QTableWidgetItem(acc_str))
+
+            if model_names:
+                # 各模型的预测结果和正确率
+                models = result.get('models', {})
+                for j, name in enumerate(model_names):
+                    entry = models.get(name, {})
+                    self.table.setItem(i, 1 + 2 * j, QTableWidgetItem(str(entry.get('prediction', ''))))
+                    self.table.setItem(i, 2 + 2 * j, QTableWidgetItem(self.format_accuracy(entry.get('accuracy'))))
+                # 正确答案
+                self.table.setItem(i, column_count - 2, QTableWidgetItem(str(result.get('answer', ''))))
+            else:
+                # 预测结果
+                self.table.setItem(i, 1, QTableWidgetItem(str(result['prediction'])))
+
+                # 置信度
+                # confidence = f"{result['confidence']:.4f}" if result['confidence'] > 0 else "N/A"
+                # self.table.setItem(i, 2, QTableWidgetItem(confidence))
+
+                # 正确答案
+                self.table.setItem(i, 2, QTableWidgetItem(str(result.get('answer', ''))))
+                # 正确率
+                self.table.setItem(i, 3, QTableWidgetItem(self.format_accuracy(result.get('accuracy', None))))
             
             # 状态
             status_item = QTableWidgetItem(result['status'])
-            if result['status'] == '成功':
+            if result.get('reused_from'):
+                # 重复图像，复用了代表图像的结果
+                status_item.setText(f"{result['status']}（复用）")
+                status_item.setToolTip(f"复用自: {image_basename(result['reused_from'])}")
+                status_item.setBackground(QColor(200, 230, 255))  # 浅蓝色
+            elif result['status'] == '成功':
                 status_item.setBackground(QColor(200, 255, 200))  # 浅绿色
             else:
                 status_item.setBackground(QColor(255, 200, 200))  # 浅红色
-            self.table.setItem(i, 4, status_item)
+            self.table.setItem(i, column_count - 1, status_item)
         
-        self.table.resizeColumnsToContents() 
\ No newline at end of file
+        self.table.resizeColumnsToContents()
+
+    @staticmethod
+    def format_accuracy(acc):
+        """格式化正确率"""
+        return f"{acc:.1f}%" if acc is not None else ""
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+归档分片工具模块（tar/zip），用于大量小图像的顺序读取
+"""
+
+import os
+import mmap
+import struct
+import tarfile
+import zipfile
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.zip')
+# 归档成员路径的分隔符，形如 "shard-0001.tar::images/0001.jpg"
+MEMBER_SEPARATOR = '::'
+
+
+def is_image_file(name):
+    """判断文件名是否为支持的图像格式"""
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_archive(path):
+    """判断路径是否为支持的归档文件"""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def make_member_path(archive_path, member_name):
+    """由归档路径和成员名组成成员路径"""
+    return f"{archive_path}{MEMBER_SEPARATOR}{member_name}"
+
+
+def split_member_path(path):
+    """拆分成员路径，普通文件返回 (path, None)"""
+    if MEMBER_SEPARATOR in path:
+        archive_path, member_name = path.split(MEMBER_SEPARATOR, 1)
+        return archive_path, member_name
+    return path, None
+
+
+def image_basename(path):
+    """获取图像文件名，归档成员取成员自身的文件名（用于标准答案匹配）"""
+    archive_path, member_name = split_member_path(path)
+    if member_name is None:
+        return os.path.basename(path)
+    return member_name.rsplit('/', 1)[-1]
+
+
+class ArchiveReader:
+    """归档读取器
+
+    未压缩的tar和以存储方式（不压缩）写入的zip成员直接从内存映射中切片，不产生拷贝；
+    压缩的tar以流方式顺序读取，压缩的zip成员按需解压。
+    产出的memoryview在下一次迭代前有效，使用方不应长期持有。
+    """
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self._file = None
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _open_mmap(self):
+        """以只读方式内存映射归档文件，空文件返回None"""
+        if self._mmap is None and os.path.getsize(self.archive_path) > 0:
+            self._file = open(self.archive_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def close(self):
+        """关闭内存映射和文件"""
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # 仍有成员视图未释放，交由垃圾回收关闭
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def is_plain_tar(self):
+        """是否为未压缩的tar"""
+        return self.archive_path.lower().endswith('.tar')
+
+    def is_zip(self):
+        """是否为zip"""
+        return self.archive_path.lower().endswith('.zip')
+
+    def count_images(self):
+        """统计归档中的图像成员数量
+            :return: 成员数量；压缩的tar没有索引，计数需要完整解压一遍，返回None
+        """
+        if not self.is_zip() and not self.is_plain_tar():
+            return None
+        if self.is_zip():
+            mm = self._open_mmap()
+            if mm is None:
+                return 0
+            with zipfile.ZipFile(self._file) as zf:
+                return sum(1 for info in zf.infolist() if not info.is_dir() and is_image_file(info.filename))
+        return sum(1 for _ in self.iter_member_names())
+
+    def iter_member_names(self):
+        """按顺序遍历图像成员名（tar只读取头部）"""
+        if self.is_zip():
+            mm = self._open_mmap()
+            if mm is None:
+                return
+            with zipfile.ZipFile(self._file) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir() and is_image_file(info.filename):
+                        yield info.filename
+        else:
+            for member, _ in self._iter_tar(read_data=False):
+                yield member
+
+    def iter_members(self):
+        """按顺序遍历图像成员
+            :return: 生成 (成员名, 编码后的图像数据) ，数据为memoryview或bytes
+        """
+        if self.is_zip():
+            yield from self._iter_zip()
+        else:
+            yield from self._iter_tar(read_data=True)
+
+    def _iter_zip(self):
+        mm = self._open_mmap()
+        if mm is None:
+            return
+        view = memoryview(mm)
+        try:
+            with zipfile.ZipFile(self._file) as zf:
+                for info in zf.infolist():
+                    if info.is_dir() or not is_image_file(info.filename):
+                        continue
+                    if info.compress_type == zipfile.ZIP_STORED:
+                        # 本地文件头固定30字节，其后为文件名和扩展字段
+                        name_len, extra_len = struct.unpack('<HH', mm[info.header_offset + 26:info.header_offset + 30])
+                        start = info.header_offset + 30 + name_len + extra_len
+                        yield info.filename, view[start:start + info.compress_size]
+                    else:
+                        yield info.filename, zf.read(info)
+        finally:
+            view.release()
+
+    def _iter_tar(self, read_data):
+        if self.is_plain_tar():
+            mm = self._open_mmap()
+            if mm is None:
+                return
+            view = memoryview(mm)
+            mm.seek(0)
+            try:
+                with tarfile.open(fileobj=mm, mode='r:') as tf:
+                    for member in tf:
+                        if member.isfile() and is_image_file(member.name):
+                            data = view[member.offset_data:member.offset_data + member.size] if read_data else None
+                            yield member.name, data
+                        # 不保留已遍历的成员信息，保证内存占用与分片大小无关
+                        tf.members = []
+            finally:
+                view.release()
+        else:
+            with tarfile.open(self.archive_path, mode='r|*') as tf:
+                for member in tf:
+                    if member.isfile() and is_image_file(member.name):
+                        data = tf.extractfile(member).read() if read_data else None
+                        yield member.name, data
+                    tf.members = []
+
+
+def count_image_sources(paths):
+    """统计路径列表中的图像数量（归档按成员数计）
+        :return: 图像数量；含有压缩的tar时无法低成本计数，返回None
+    """
+    total = 0
+    for path in paths:
+        if not isinstance(path, tuple) and is_archive(path):
+            with ArchiveReader(path) as reader:
+                count = reader.count_images()
+            if count is None:
+                return None
+            total += count
+        else:
+            total += 1
+    return total
+
+
+def iter_image_sources(paths):
+    """按顺序遍历图像来源
+        :param paths: 图像文件或归档文件路径列表，也可以包含 (名称, 内存数据) 元组，
+            内存数据为已编码的图像数据或已解码的图像数组（见 ModelLoader.decode_image），名称作为结果中的图像路径
+        :return: 生成 (图像路径, 数据来源)，普通文件的数据来源为路径本身，归档成员为内存数据
+    """
+    for path in paths:
+        if isinstance(path, tuple):
+            yield path
+        elif is_archive(path):
+            with ArchiveReader(path) as reader:
+                for member_name, data in reader.iter_members():
+                    yield make_member_path(path, member_name), data
+        else:
+            yield path, path
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应批大小模块：根据实测推理耗时和进程内存调整批大小，并按 模型 + 主机 记录最优值
+"""
+
+import os
+import json
+import socket
+import hashlib
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+DEFAULT_PROFILE_PATH = os.path.join(os.path.expanduser('~'), '.selfmodel_vision', 'batch_profiles.json')
+
+
+def get_rss_bytes():
+    """获取当前进程的常驻内存（字节），无法获取时返回None"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        # Linux下不依赖psutil，从 /proc 读取常驻页数
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_model_hash(model_path):
+    """计算模型文件内容的哈希"""
+    sha1 = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()[:16]
+
+
+def get_profile_key(model_path):
+    """批大小记录的键：模型哈希@主机名"""
+    return f"{get_model_hash(model_path)}@{socket.gethostname()}"
+
+
+class BatchProfileStore:
+    """批大小记录，保存为一个小的JSON文件"""
+
+    def __init__(self, path=DEFAULT_PROFILE_PATH):
+        self.path = path
+        self.profiles = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.profiles = json.load(f)
+            except Exception as e:
+                print(f"批大小记录加载失败: {str(e)}")
+
+    def get(self, key):
+        """获取记录的最优批大小，没有记录时返回None"""
+        profile = self.profiles.get(key)
+        return int(profile['batch_size']) if profile else None
+
+    def put(self, key, batch_size, images_per_second):
+        """保存最优批大小，先写临时文件再原子替换"""
+        self.profiles[key] = {'batch_size': int(batch_size), 'images_per_second': images_per_second}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.profiles, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"批大小记录保存失败: {str(e)}")
+
+
+class AdaptiveBatchController:
+    """自适应批大小控制器
+
+    每个批大小测量若干批（丢弃首批，其中包含缓冲区分配）后计算吞吐量，
+    吞吐量提升时批大小翻倍，不再提升时回到最优值并保持；
+    单批耗时超过 latency_target_ms 或常驻内存超过 memory_budget_bytes 时减半，
+    且之后不再尝试不小于该值的批大小。
+    """
+
+    def __init__(self, initial=1, max_size=64, latency_target_ms=None, memory_budget_bytes=None,
+                 samples_per_size=3, min_gain=0.05):
+        self.max_size = max(1, int(max_size))
+        self.batch_size = min(max(1, int(initial)), self.max_size)
+        self.latency_target_ms = latency_target_ms
+        self.memory_budget_bytes = memory_budget_bytes
+        self.samples_per_size = samples_per_size
+        self.min_gain = min_gain
+        # 不允许达到的批大小（因超时或超内存而回退过）
+        self.ceiling = self.max_size + 1
+        self.settled = False
+        self.best_batch_size = self.batch_size
+        self.best_throughput = 0.0
+        self.backoff_rss = None
+        self._reset_samples()
+
+    def start(self, initial=None, max_size=None):
+        """以记录的批大小（或模型允许的上限）重新开始调整"""
+        if max_size is not None:
+            self.max_size = max(1, int(max_size))
+            self.ceiling = min(self.ceiling, self.max_size + 1)
+        if initial is not None:
+            self.best_batch_size = min(max(1, int(initial)), self.max_size)
+        self.best_batch_size = min(self.best_batch_size, self.max_size)
+        self.best_throughput = 0.0
+        self.settled = False
+        self._set_batch_size(self.best_batch_size)
+
+    def _reset_samples(self):
+        self.sample_count = 0
+        self.sample_images = 0
+        self.sample_seconds = 0.0
+
+    def _set_batch_size(self, batch_size):
+        self.batch_size = batch_size
+        self._reset_samples()
+
+    def _back_off(self):
+        """回退到一半的批大小，并禁止再尝试当前大小"""
+        self.ceiling = min(self.ceiling, self.batch_size)
+        if self.best_batch_size >= self.ceiling:
+            self.best_batch_size = max(1, self.ceiling // 2)
+            self.best_throughput = 0.0
+        self._set_batch_size(max(1, self.batch_size // 2))
+
+    def record(self, images, seconds, rss=None):
+        """记录一批的测量结果
+            :param images: 该批图像数
+            :param seconds: 该批推理耗时（秒）
+            :param rss: 推理后的常驻内存（字节）
+        """
+        if self.latency_target_ms is not None and seconds * 1000 > self.latency_target_ms and self.batch_size > 1:
+            self._back_off()
+            return
+        if self.memory_budget_bytes is not None and rss is not None and rss > self.memory_budget_bytes:
+            # ORT的内存池不会立即归还内存，只有内存继续增长时才再次回退
+            if self.batch_size > 1 and (self.backoff_rss is None or rss > self.backoff_rss):
+                self.backoff_rss = rss
+                self._back_off()
+            return
+        if self.settled:
+            return
+
+        self.sample_count += 1
+        if self.sample_count == 1:
+            # 首批包含新形状的缓冲区分配，不计入吞吐量
+            return
+        self.sample_images += images
+        self.sample_seconds += seconds
+        if self.sample_count <= self.samples_per_size:
+            return
+
+        throughput = self.sample_images / self.sample_seconds if self.sample_seconds > 0 else 0.0
+        if throughput > self.best_throughput * (1 + self.min_gain):
+            self.best_batch_size = self.batch_size
+            self.best_throughput = throughput
+            if self.batch_size * 2 < self.ceiling and self.batch_size < self.max_size:
+                self._set_batch_size(min(self.batch_size * 2, self.max_size))
+                return
+        # 吞吐量不再提升或已到上限，固定在最优值
+        self.settled = True
+        self._set_batch_size(self.best_batch_size)
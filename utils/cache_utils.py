@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预处理张量缓存模块，以内存映射的 .npy 文件持久保存预处理结果
+"""
+
+import os
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+# 预处理实现变化时递增，使旧缓存失效
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.selfmodel_vision', 'tensor_cache')
+DEFAULT_CACHE_BYTES = 2 * 1024 ** 3
+
+
+def hash_bytes(data):
+    """计算编码后图像数据的哈希"""
+    return hashlib.sha1(memoryview(data)).hexdigest()
+
+
+def hash_plan(plan):
+    """计算预处理方案的哈希"""
+    return hashlib.sha1(repr((CACHE_VERSION, plan)).encode('utf-8')).hexdigest()[:16]
+
+
+class TensorCache:
+    """预处理张量缓存
+
+    键为 图像内容哈希 + 预处理方案哈希，每个条目是一个 .npy 文件，读取时内存映射，
+    不需要解码和预处理。总大小超过 max_bytes 时按最近使用时间（文件修改时间）淘汰。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # 路径 -> 文件大小，按最近使用排序（末尾最新）
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        """扫描缓存目录，按修改时间重建索引"""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.npy'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, path, stat.st_size))
+        found.sort()
+        self.entries = OrderedDict((path, size) for _, path, size in found)
+        self.total_bytes = sum(self.entries.values())
+        self.evict()
+
+    def get_path(self, image_hash, plan_hash):
+        """条目文件路径"""
+        return os.path.join(self.cache_dir, plan_hash, image_hash[:2], image_hash + '.npy')
+
+    def get(self, image_hash, plan_hash):
+        """读取缓存的张量（只读内存映射），未命中返回None"""
+        path = self.get_path(image_hash, plan_hash)
+        if path not in self.entries:
+            self.misses += 1
+            return None
+        try:
+            array = np.load(path, mmap_mode='r')
+            # 更新修改时间，跨进程保持LRU顺序
+            os.utime(path)
+        except (OSError, ValueError):
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(path)
+        self.hits += 1
+        return array
+
+    def put(self, image_hash, plan_hash, array):
+        """写入张量，先写临时文件再原子替换"""
+        path = self.get_path(image_hash, plan_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+
+        size = os.path.getsize(path)
+        self.total_bytes += size - self.entries.pop(path, 0)
+        self.entries[path] = size
+        self.evict()
+
+    def evict(self):
+        """淘汰最久未使用的条目，直到总大小不超过上限"""
+        while self.entries and self.total_bytes > self.max_bytes:
+            path = next(iter(self.entries))
+            self._remove(path)
+
+    def _remove(self, path):
+        size = self.entries.pop(path, 0)
+        self.total_bytes -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
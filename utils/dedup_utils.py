@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图像去重工具模块，按内容摘要跳过重复图像的推理，可选按感知哈希（dHash）复用近似重复图像的结果
+"""
+
+import hashlib
+
+import cv2
+import numpy as np
+
+
+def dhash(img, hash_size=16):
+    """计算差值哈希
+        :param img: 解码后的BGR图像
+        :param hash_size: 哈希边长，得到 hash_size * hash_size 位的哈希
+        :return: 整数形式的哈希值
+    """
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def content_digest(img):
+    """计算解码后像素的内容摘要，像素和尺寸完全相同的图像摘要相同"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(img.shape).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.digest()
+
+
+def hamming_distance(a, b):
+    """计算两个哈希的汉明距离"""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """按汉明距离组织的BK树，用于查找相近的哈希"""
+
+    def __init__(self):
+        # 节点结构: [哈希, 值, {距离: 子节点}]
+        self.root = None
+        self.size = 0
+
+    def add(self, image_hash, value):
+        """插入哈希及其对应的值"""
+        self.size += 1
+        if self.root is None:
+            self.root = [image_hash, value, {}]
+            return
+        node = self.root
+        while True:
+            dist = hamming_distance(image_hash, node[0])
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [image_hash, value, {}]
+                return
+            node = child
+
+    def find(self, image_hash, max_distance=0):
+        """查找距离不超过 max_distance 的最近哈希
+            :return: (值, 距离)，未找到返回None
+        """
+        if self.root is None:
+            return None
+        best = None
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            dist = hamming_distance(image_hash, node[0])
+            if dist <= max_distance and (best is None or dist < best[1]):
+                best = (node[1], dist)
+                if dist == 0:
+                    break
+            # 三角不等式剪枝：只有距离在 [dist - max, dist + max] 的子树可能命中
+            for child_dist, child in node[2].items():
+                if dist - max_distance <= child_dist <= dist + max_distance:
+                    stack.append(child)
+        return best
+
+
+class Deduplicator:
+    """重复图像检测器，记录每组的代表图像及其推理结果
+
+    默认只复用内容完全相同的图像的结果；dHash 相同不代表内容相同（例如只差几个字符的文本行），
+    max_distance 大于0时才按感知哈希复用近似重复图像的结果
+    """
+
+    def __init__(self, max_distance=0, hash_size=16):
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.exact = {}
+        self.tree = BKTree() if max_distance > 0 else None
+        self.saved_inferences = 0
+
+    def compute_key(self, img):
+        """计算图像的去重键：(内容摘要, 感知哈希)；未启用近似去重时不计算感知哈希"""
+        image_hash = dhash(img, self.hash_size) if self.tree is not None else None
+        return content_digest(img), image_hash
+
+    def lookup(self, key):
+        """查找内容相同的已推理图像，启用近似去重时再查找哈希相近的
+            :return: (代表图像路径, 预测结果, 置信度)，未找到返回None
+        """
+        digest, image_hash = key
+        match = self.exact.get(digest)
+        if match is None and self.tree is not None:
+            found = self.tree.find(image_hash, self.max_distance)
+            match = found[0] if found is not None else None
+        if match is None:
+            return None
+        self.saved_inferences += 1
+        return match
+
+    def add(self, key, img_path, prediction, confidence):
+        """登记新的代表图像及其推理结果"""
+        digest, image_hash = key
+        value = (img_path, prediction, confidence)
+        self.exact.setdefault(digest, value)
+        if self.tree is not None:
+            self.tree.add(image_hash, value)
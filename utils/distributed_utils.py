@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分布式批量推理模块：协调节点将输入清单切分为租约，工作节点通过HTTP领取租约、回传结果并续约
+"""
+
+import os
+import hmac
+import json
+import time
+import socket
+import ipaddress
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from utils.model_utils import ModelConfig
+from utils.eval_utils import StreamingEvaluator
+
+
+LEASE_PENDING = 'pending'
+LEASE_LEASED = 'leased'
+LEASE_DONE = 'done'
+# 共享令牌的环境变量，避免令牌出现在命令行（进程列表）中
+TOKEN_ENV = 'SELFMODEL_VISION_TOKEN'
+
+
+def is_loopback_host(host):
+    """监听地址是否只限本机访问"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def to_json_value(value):
+    """将numpy标量等转换为JSON可序列化的值"""
+    if hasattr(value, 'item'):
+        return value.item()
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+class Lease:
+    """一段连续的输入路径"""
+
+    def __init__(self, lease_id, paths):
+        self.lease_id = lease_id
+        self.paths = paths
+        self.state = LEASE_PENDING
+        self.worker = None
+        self.expires_at = 0.0
+        self.results = []
+        self.attempts = 0
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    """协调节点的HTTP接口，请求和响应都是JSON；设置了共享令牌时请求需带 Authorization: Bearer <令牌>"""
+
+    def check_token(self):
+        """校验共享令牌，不通过时返回401"""
+        token = self.server.coordinator.token
+        if not token:
+            return True
+        header = self.headers.get('Authorization', '')
+        if hmac.compare_digest(header.encode('utf-8'), f"Bearer {token}".encode('utf-8')):
+            return True
+        self.send_json({'error': "令牌无效"}, 401)
+        return False
+
+    def do_POST(self):
+        if not self.check_token():
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            routes = {
+                '/lease': self.server.coordinator.handle_lease,
+                '/heartbeat': self.server.coordinator.handle_heartbeat,
+                '/results': self.server.coordinator.handle_results,
+            }
+            if self.path not in routes:
+                self.send_json({'error': f"未知接口: {self.path}"}, 404)
+                return
+            self.send_json(routes[self.path](payload))
+        except Exception as e:
+            self.send_json({'error': str(e)}, 500)
+
+    def do_GET(self):
+        if not self.check_token():
+            return
+        if self.path == '/status':
+            self.send_json(self.server.coordinator.get_status())
+        else:
+            self.send_json({'error': f"未知接口: {self.path}"}, 404)
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False, default=to_json_value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不逐条打印访问日志
+        pass
+
+
+class Coordinator:
+    """协调节点
+
+    输入清单按 lease_size 切分为租约，工作节点领取后需在 lease_ttl 秒内续约，
+    超时的租约收回并重新分配（已回传的部分结果丢弃）。
+    结果按租约顺序合并写出，与单机处理的顺序一致。
+    默认只监听本机；监听其他地址时必须设置共享令牌，工作节点请求时携带。
+    """
+
+    def __init__(self, paths, host='127.0.0.1', port=8765, lease_size=256, lease_ttl=60.0, config_path=None,
+                 token=None):
+        if not token and not is_loopback_host(host):
+            raise Exception(f"监听非本机地址 {host or '0.0.0.0'} 时需要设置共享令牌")
+        self.token = token
+        self.leases = [Lease(i, paths[start:start + lease_size])
+                       for i, start in enumerate(range(0, len(paths), lease_size))]
+        self.lease_ttl = lease_ttl
+        self.config_path = config_path
+        self.evaluator = None
+        # 工作节点回传的任务信息：model_kind、result_fields、model_names
+        self.job_info = None
+        self.condition = threading.Condition()
+        # 下一个待写出的租约
+        self.next_write = 0
+        self.written = 0
+        self.reassigned = 0
+        self.workers = {}
+        self.server = ThreadingHTTPServer((host, port), CoordinatorHandler)
+        self.server.daemon_threads = True
+        self.server.coordinator = self
+
+    @property
+    def address(self):
+        """实际监听的地址（端口为0时由系统分配）"""
+        host, port = self.server.server_address[:2]
+        return f"http://{socket.gethostname() if host == '0.0.0.0' else host}:{port}"
+
+    def _expire_leases(self, now):
+        """收回超时的租约"""
+        for lease in self.leases:
+            if lease.state == LEASE_LEASED and now > lease.expires_at:
+                print(f"租约 {lease.lease_id} 超时（{lease.worker}），重新分配")
+                lease.state = LEASE_PENDING
+                lease.worker = None
+                lease.results = []
+                self.reassigned += 1
+
+    def _get_lease(self, payload):
+        lease_id = payload.get('lease_id')
+        if not isinstance(lease_id, int) or not 0 <= lease_id < len(self.leases):
+            raise Exception(f"无效的租约: {lease_id}")
+        return self.leases[lease_id]
+
+    def handle_lease(self, payload):
+        """分配一个租约；没有可分配的租约时让工作节点稍后重试，全部完成时通知其退出"""
+        worker = payload.get('worker', '')
+        with self.condition:
+            now = time.monotonic()
+            self._expire_leases(now)
+            self.workers[worker] = now
+            for lease in self.leases:
+                if lease.state == LEASE_PENDING:
+                    lease.state = LEASE_LEASED
+                    lease.worker = worker
+                    lease.expires_at = now + self.lease_ttl
+                    lease.results = []
+                    lease.attempts += 1
+                    return {'lease_id': lease.lease_id, 'paths': lease.paths, 'lease_ttl': self.lease_ttl}
+            if all(lease.state == LEASE_DONE for lease in self.leases):
+                return {'done': True}
+            return {'wait': min(1.0, self.lease_ttl / 4)}
+
+    def handle_heartbeat(self, payload):
+        """续约，租约已被收回时返回 ok=False，工作节点应放弃该租约"""
+        with self.condition:
+            lease = self._get_lease(payload)
+            now = time.monotonic()
+            self.workers[payload.get('worker', '')] = now
+            if lease.state != LEASE_LEASED or lease.worker != payload.get('worker'):
+                return {'ok': False}
+            lease.expires_at = now + self.lease_ttl
+            return {'ok': True}
+
+    def handle_results(self, payload):
+        """接收一段结果（同时续约）；offset 与已收到的数量不一致时返回期望的 offset"""
+        with self.condition:
+            lease = self._get_lease(payload)
+            if lease.state != LEASE_LEASED or lease.worker != payload.get('worker'):
+                return {'ok': False}
+            if payload.get('offset') != len(lease.results):
+                return {'ok': True, 'expected_offset': len(lease.results)}
+            lease.results.extend(payload.get('results', []))
+            lease.expires_at = time.monotonic() + self.lease_ttl
+            if self.job_info is None and payload.get('job_info'):
+                self.job_info = payload['job_info']
+                self.evaluator = StreamingEvaluator(self.job_info['model_kind'],
+                                                    ModelConfig(self.config_path).classDict)
+            if payload.get('final'):
+                lease.state = LEASE_DONE
+                self.condition.notify_all()
+            return {'ok': True, 'expected_offset': len(lease.results)}
+
+    def get_status(self):
+        """各状态的租约数和已写出的结果数"""
+        with self.condition:
+            counts = {LEASE_PENDING: 0, LEASE_LEASED: 0, LEASE_DONE: 0}
+            for lease in self.leases:
+                counts[lease.state] += 1
+            return dict(counts, written=self.written, reassigned=self.reassigned, workers=len(self.workers))
+
+    def _take_ordered(self):
+        """取出可以按顺序写出的已完成租约的结果"""
+        results = []
+        while self.next_write < len(self.leases) and self.leases[self.next_write].state == LEASE_DONE:
+            lease = self.leases[self.next_write]
+            results.extend(lease.results)
+            lease.results = []
+            self.next_write += 1
+        return results
+
+    def iter_results(self, shutdown_grace=2.0):
+        """启动服务并按输入顺序生成合并后的结果，全部完成后停止服务
+            :param shutdown_grace: 完成后继续服务的秒数，让等待中的工作节点收到退出通知
+        """
+        server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            while True:
+                with self.condition:
+                    self._expire_leases(time.monotonic())
+                    results = self._take_ordered()
+                    finished = self.next_write >= len(self.leases)
+                    if not results and not finished:
+                        self.condition.wait(timeout=1.0)
+                        continue
+                for result in results:
+                    if self.evaluator is not None:
+                        self.evaluator.add(result)
+                    self.written += 1
+                    yield result
+                if finished:
+                    break
+            time.sleep(shutdown_grace)
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class Worker:
+    """工作节点：模型只加载一次，循环领取租约并推理
+
+    心跳线程按 lease_ttl 的三分之一续约；租约被收回时放弃当前租约。
+    结果每满 chunk_size 条回传一次。
+    """
+
+    def __init__(self, coordinator_url, job, worker_id=None, chunk_size=64, timeout=30.0, max_retries=5,
+                 token=None):
+        self.url = coordinator_url.rstrip('/')
+        self.job = job
+        self.token = token
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.processed = 0
+        self.job_info = {
+            'model_kind': job.model_loader.get_model_kind(),
+            'result_fields': job.result_fields,
+            'model_names': getattr(job, 'model_names', None)
+        }
+
+    def post(self, path, payload):
+        """发送JSON请求，网络错误时重试"""
+        data = json.dumps(dict(payload, worker=self.worker_id), ensure_ascii=False,
+                          default=to_json_value).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        for attempt in range(self.max_retries):
+            request = urllib.request.Request(self.url + path, data=data, headers=headers)
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                raise Exception(f"协调节点返回错误 {e.code}: {e.read().decode('utf-8', 'replace')}")
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(min(5.0, 0.5 * 2 ** attempt))
+
+    def run(self):
+        """循环领取并处理租约，直到协调节点通知全部完成（或无法连接）
+
+        单个租约处理失败时放弃该租约，停止续约后由协调节点超时收回、重新分配；连续 max_retries 个租约失败时退出。
+        """
+        failures = 0
+        while True:
+            try:
+                response = self.post('/lease', {})
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                print("无法连接协调节点，退出")
+                return
+            except Exception as e:
+                print(f"领取租约失败: {str(e)}，退出")
+                return
+            if response.get('done'):
+                return
+            if 'wait' in response:
+                time.sleep(response['wait'])
+                continue
+            try:
+                self.process_lease(response['lease_id'], response['paths'], response['lease_ttl'])
+                failures = 0
+            except Exception as e:
+                failures += 1
+                print(f"租约 {response['lease_id']} 处理失败: {str(e)}，放弃该租约，等待协调节点重新分配")
+                if failures >= self.max_retries:
+                    print(f"连续 {failures} 个租约处理失败，退出")
+                    return
+
+    def process_lease(self, lease_id, paths, lease_ttl):
+        """处理一个租约，边推理边回传结果"""
+        lost = threading.Event()
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            while not stop_heartbeat.wait(lease_ttl / 3):
+                try:
+                    if not self.post('/heartbeat', {'lease_id': lease_id}).get('ok'):
+                        lost.set()
+                        return
+                except Exception:
+                    # 暂时无法连接时继续推理，由协调节点判断是否超时
+                    pass
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            self.job.image_paths = paths
+            offset = 0
+            chunk = []
+            for result in self.job.iter_results():
+                if lost.is_set():
+                    print(f"租约 {lease_id} 已被收回，放弃")
+                    return
+                chunk.append(result)
+                if len(chunk) >= self.chunk_size:
+                    offset = self.send_results(lease_id, offset, chunk, final=False)
+                    if offset is None:
+                        return
+                    chunk = []
+            self.send_results(lease_id, offset, chunk, final=True)
+        finally:
+            stop_heartbeat.set()
+
+    def send_results(self, lease_id, offset, results, final):
+        """回传一段结果，返回新的offset；租约已被收回时返回None"""
+        response = self.post('/results', {
+            'lease_id': lease_id,
+            'offset': offset,
+            'results': results,
+            'final': final,
+            'job_info': self.job_info
+        })
+        if not response.get('ok'):
+            print(f"租约 {lease_id} 已被收回，放弃")
+            return None
+        if response.get('expected_offset') != offset + len(results):
+            raise Exception(f"租约 {lease_id} 结果不连续: 期望 {response.get('expected_offset')}")
+        self.processed += len(results)
+        return offset + len(results)
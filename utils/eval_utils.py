@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式评测模块，结果逐条累加，内存占用与数据集大小无关
+"""
+
+import os
+import json
+import math
+
+import numpy as np
+
+from utils.model_utils import MODEL_KIND_CLASSIFICATION
+
+
+def get_report_path(export_path):
+    """由导出文件路径得到评测报告路径（同名 .report.json）"""
+    return os.path.splitext(export_path)[0] + '.report.json'
+
+
+def align_counts(ref, hyp):
+    """编辑距离对齐，统计替换、插入、删除
+        :param ref: 参考序列（字符串或词列表）
+        :param hyp: 预测序列
+        :return: (替换数, 插入数, 删除数, 对齐操作列表 [(操作, 参考元素, 预测元素), ...])
+            操作为 'ok' / 'sub' / 'ins' / 'del'
+    """
+    n, m = len(ref), len(hyp)
+    # 文本行较短，逐行用列表计算比逐元素访问numpy数组更快
+    dist = [list(range(m + 1))]
+    for i in range(1, n + 1):
+        prev = dist[-1]
+        row = [i] + [0] * m
+        r = ref[i - 1]
+        for j in range(1, m + 1):
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + (r != hyp[j - 1]))
+        dist.append(row)
+
+    # 回溯得到对齐操作
+    ops = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and dist[i][j] == dist[i - 1][j - 1] + (ref[i - 1] != hyp[j - 1]):
+            ops.append(('ok' if ref[i - 1] == hyp[j - 1] else 'sub', ref[i - 1], hyp[j - 1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and dist[i][j] == dist[i - 1][j] + 1:
+            ops.append(('del', ref[i - 1], None))
+            i -= 1
+        else:
+            ops.append(('ins', None, hyp[j - 1]))
+            j -= 1
+    ops.reverse()
+    subs = sum(1 for op in ops if op[0] == 'sub')
+    ins = sum(1 for op in ops if op[0] == 'ins')
+    dels = sum(1 for op in ops if op[0] == 'del')
+    return subs, ins, dels, ops
+
+
+class QuantileSketch:
+    """对数分桶的分位数草图，相对误差约为 relative_accuracy，桶数与样本数无关"""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """加入一个非负样本"""
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= 0:
+            self.zero_count += 1
+            return
+        key = int(math.ceil(math.log(value) / self.log_gamma))
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def quantile(self, q):
+        """估计分位数，q取值0~1"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # 取桶的中点，保证相对误差
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """均值与常用分位数"""
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max
+        }
+
+
+class StreamingEvaluator:
+    """流式评测器
+
+    文本识别统计CER/WER（含替换、插入、删除）和逐字符错误表，
+    分类统计混淆矩阵和各类精确率/召回率，另统计解码和推理耗时分位数。
+    """
+
+    def __init__(self, model_kind=None, class_names=None):
+        self.model_kind = model_kind
+        self.total = 0
+        self.successful = 0
+        self.labelled = 0
+        self.accuracy_sum = 0.0
+        self.accuracy_count = 0
+        self.latency = {'decode_ms': QuantileSketch(), 'infer_ms': QuantileSketch()}
+
+        # 文本识别：[替换, 插入, 删除, 参考长度]
+        self.char_counts = np.zeros(4, dtype=np.int64)
+        self.word_counts = np.zeros(4, dtype=np.int64)
+        self.exact_matches = 0
+        # 字符 -> [参考中出现次数, 被替换, 被删除, 被多插入]
+        self.char_table = {}
+
+        # 分类：混淆矩阵（行为真实类别，列为预测类别），按需分配
+        self.class_names = list(class_names or [])
+        self.class_index = {}
+        for i, name in enumerate(self.class_names):
+            self.class_index.setdefault(name, i)
+        self.confusion = None
+        self.unknown_labels = 0
+        # 附加的统计（名称 -> 带 add/report 方法的对象），结果同样逐条累加并写入报告
+        self.sections = {}
+
+    def add(self, result):
+        """累加一条结果"""
+        self.total += 1
+        for section in self.sections.values():
+            section.add(result)
+        for key, sketch in self.latency.items():
+            if result.get(key) is not None:
+                sketch.add(result[key])
+        if result.get('status') != '成功':
+            return
+        self.successful += 1
+
+        if result.get('accuracy') is not None:
+            self.accuracy_sum += result['accuracy']
+            self.accuracy_count += 1
+
+        answer = result.get('answer')
+        if not answer:
+            return
+        self.labelled += 1
+        prediction = str(result['prediction']).strip()
+        answer = str(answer).strip()
+        if self.model_kind == MODEL_KIND_CLASSIFICATION:
+            self.add_classification(prediction, answer)
+        else:
+            self.add_text(prediction, answer)
+
+    def add_text(self, prediction, answer):
+        """累加一条文本识别结果"""
+        if prediction == answer:
+            self.exact_matches += 1
+        subs, ins, dels, ops = align_counts(answer, prediction)
+        self.char_counts += (subs, ins, dels, len(answer))
+        for op, ref_char, hyp_char in ops:
+            if ref_char is not None:
+                entry = self.char_table.setdefault(ref_char, [0, 0, 0, 0])
+                entry[0] += 1
+                if op == 'sub':
+                    entry[1] += 1
+                elif op == 'del':
+                    entry[2] += 1
+            elif op == 'ins':
+                self.char_table.setdefault(hyp_char, [0, 0, 0, 0])[3] += 1
+
+        ref_words = answer.split()
+        subs, ins, dels, _ = align_counts(ref_words, prediction.split())
+        self.word_counts += (subs, ins, dels, len(ref_words))
+
+    def add_classification(self, prediction, answer):
+        """累加一条分类结果"""
+        if prediction == answer:
+            self.exact_matches += 1
+        true_idx = self.class_index.get(answer)
+        pred_idx = self.class_index.get(prediction)
+        if true_idx is None or pred_idx is None:
+            self.unknown_labels += 1
+            return
+        if self.confusion is None:
+            n = len(self.class_names)
+            self.confusion = np.zeros((n, n), dtype=np.int64)
+        self.confusion[true_idx, pred_idx] += 1
+
+    @property
+    def mean_accuracy(self):
+        """平均正确率（编辑距离正确率），没有标准答案时为None"""
+        return self.accuracy_sum / self.accuracy_count if self.accuracy_count else None
+
+    @staticmethod
+    def _error_rate(counts):
+        subs, ins, dels, ref_len = (int(c) for c in counts)
+        return {
+            'rate': (subs + ins + dels) / ref_len if ref_len else None,
+            'substitutions': subs,
+            'insertions': ins,
+            'deletions': dels,
+            'reference_length': ref_len
+        }
+
+    def report(self, top_chars=50):
+        """生成评测报告字典
+            :param top_chars: 字符错误表只列出错误最多的前若干个字符
+        """
+        report = {
+            'total': self.total,
+            'successful': self.successful,
+            'labelled': self.labelled,
+            'mean_accuracy': self.mean_accuracy,
+            'exact_match': self.exact_matches / self.labelled if self.labelled else None,
+            'latency_ms': {key: sketch.summary() for key, sketch in self.latency.items()}
+        }
+        if self.model_kind == MODEL_KIND_CLASSIFICATION:
+            report['classification'] = self.classification_report()
+        else:
+            char_errors = sorted(
+                ({'char': char, 'count': c[0], 'substituted': c[1], 'deleted': c[2], 'inserted': c[3]}
+                 for char, c in self.char_table.items() if c[1] + c[2] + c[3] > 0),
+                key=lambda e: e['substituted'] + e['deleted'] + e['inserted'], reverse=True)
+            report['cer'] = self._error_rate(self.char_counts)
+            report['wer'] = self._error_rate(self.word_counts)
+            report['char_errors'] = char_errors[:top_chars]
+        for name, section in self.sections.items():
+            report[name] = section.report()
+        return report
+
+    def classification_report(self):
+        """由混淆矩阵计算各类精确率、召回率"""
+        if self.confusion is None:
+            return {'unknown_labels': self.unknown_labels, 'classes': []}
+        tp = np.diag(self.confusion).astype(np.float64)
+        predicted = self.confusion.sum(axis=0)
+        actual = self.confusion.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(predicted > 0, tp / predicted, np.nan)
+            recall = np.where(actual > 0, tp / actual, np.nan)
+        classes = []
+        # 只列出出现过的类别
+        for i in np.nonzero((predicted + actual) > 0)[0]:
+            classes.append({
+                'class': self.class_names[i],
+                'support': int(actual[i]),
+                'predicted': int(predicted[i]),
+                'precision': None if np.isnan(precision[i]) else float(precision[i]),
+                'recall': None if np.isnan(recall[i]) else float(recall[i])
+            })
+        valid_recall = recall[~np.isnan(recall)]
+        return {
+            'unknown_labels': self.unknown_labels,
+            'macro_recall': float(valid_recall.mean()) if valid_recall.size else None,
+            'classes': classes,
+            'confusion_nonzero': [[self.class_names[t], self.class_names[p], int(self.confusion[t, p])]
+                                  for t, p in zip(*np.nonzero(self.confusion))]
+        }
+
+    def save_report(self, path):
+        """将评测报告写出为JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+
+class CascadeEvaluator:
+    """级联识别统计：升级率、推理加速比，以及与仅用大模型相比的正确率
+
+    对比模式下每张图像都有两个模型的结果，按快速模型置信度（0.01一档）累加直方图，
+    由此计算不同阈值下的升级率和正确率，便于调整阈值。
+    """
+
+    def __init__(self, threshold, bins=100):
+        self.threshold = threshold
+        self.bins = bins
+        self.total = 0
+        self.escalated = 0
+        self.fast_ms = 0.0
+        self.large_ms = 0.0
+        # 对比模式：大模型对未升级图像的推理耗时
+        self.compare_ms = 0.0
+        self.compared = 0
+        self.agreements = 0
+        # 有标准答案的图像数和级联正确率累计
+        self.labelled = 0
+        self.accuracy_sum = 0.0
+        # 对比模式：有标准答案的图像数和 [快速模型, 大模型] 正确率累计
+        self.compared_labelled = 0
+        self.compared_sums = np.zeros(2)
+        # 阈值扫描：快速模型文本为空的图像总会升级，单独计数；其余按置信度分档
+        # 每档 [图像数, 有答案数, 快速模型正确率和, 大模型正确率和]
+        self.empty = np.zeros(4)
+        self.histogram = np.zeros((bins, 4))
+
+    def add(self, result):
+        """累加一条结果"""
+        if 'escalated' not in result:
+            return
+        self.total += 1
+        self.escalated += int(result['escalated'])
+        self.fast_ms += result.get('fast_infer_ms') or 0.0
+        self.large_ms += result.get('large_infer_ms') or 0.0
+        self.compare_ms += result.get('compare_infer_ms') or 0.0
+
+        labelled = result.get('accuracy') is not None
+        if labelled:
+            self.labelled += 1
+            self.accuracy_sum += result['accuracy']
+        if 'large_prediction' not in result:
+            return
+        self.compared += 1
+        if result['large_prediction'] == result['prediction']:
+            self.agreements += 1
+        fast_accuracy = result.get('fast_accuracy')
+        large_accuracy = result.get('large_accuracy')
+        if labelled and fast_accuracy is not None and large_accuracy is not None:
+            self.compared_labelled += 1
+            self.compared_sums += (fast_accuracy, large_accuracy)
+            row = (1, 1, fast_accuracy, large_accuracy)
+        else:
+            row = (1, 0, 0.0, 0.0)
+        if not result['fast_prediction']:
+            self.empty += row
+        else:
+            index = min(self.bins - 1, max(0, int(result['fast_confidence'] * self.bins)))
+            self.histogram[index] += row
+
+    def threshold_sweep(self):
+        """各阈值下的升级率和级联正确率（仅对比模式）"""
+        if not self.compared:
+            return []
+        # 阈值 t 时置信度低于 t 的档升级：升级部分用大模型正确率，其余用快速模型正确率
+        below = np.vstack([np.zeros(4), np.cumsum(self.histogram, axis=0)])
+        total = self.histogram.sum(axis=0)
+        sweep = []
+        for i in range(self.bins + 1):
+            escalated = self.empty + below[i]
+            kept = total - below[i]
+            labelled = escalated[1] + kept[1]
+            sweep.append({
+                'threshold': i / self.bins,
+                'escalation_rate': escalated[0] / self.compared,
+                'mean_accuracy': (escalated[3] + kept[2]) / labelled if labelled else None
+            })
+        return sweep
+
+    def report(self):
+        """生成级联统计报告
+            推理耗时不含解码（两种方式都只解码一次）；非对比模式下仅用大模型的耗时按升级图像的平均耗时估算
+        """
+        cascade_ms = self.fast_ms + self.large_ms
+        if self.compared:
+            large_only_ms = self.large_ms + self.compare_ms
+        elif self.escalated:
+            large_only_ms = self.large_ms / self.escalated * self.total
+        else:
+            large_only_ms = None
+        compared_accuracy = self.compared_sums / self.compared_labelled if self.compared_labelled else [None] * 2
+        return {
+            'threshold': self.threshold,
+            'total': self.total,
+            'escalated': self.escalated,
+            'escalation_rate': self.escalated / self.total if self.total else None,
+            'fast_infer_seconds': self.fast_ms / 1000,
+            'large_infer_seconds': self.large_ms / 1000,
+            'large_only_infer_seconds': large_only_ms / 1000 if large_only_ms is not None else None,
+            'large_only_estimated': not self.compared,
+            'speedup': large_only_ms / cascade_ms if large_only_ms and cascade_ms else None,
+            'mean_accuracy': self.accuracy_sum / self.labelled if self.labelled else None,
+            'fast_only_mean_accuracy': compared_accuracy[0],
+            'large_only_mean_accuracy': compared_accuracy[1],
+            'agreement_with_large': self.agreements / self.compared if self.compared else None,
+            'threshold_sweep': self.threshold_sweep()
+        }
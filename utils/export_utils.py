@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结果导出工具模块，推理过程中逐条写出结果（CSV / JSONL / Parquet）
+"""
+
+import os
+import csv
+import json
+from abc import ABC, abstractmethod
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# 导出的结果字段
+RESULT_FIELDS = ['image_path', 'prediction', 'confidence', 'answer', 'accuracy', 'status', 'decode_ms', 'infer_ms',
+                 'reused_from']
+# 数值字段，其余字段按字符串导出；多模型对比时各模型的 <模型名>.confidence、<模型名>.accuracy 也是数值
+NUMERIC_FIELDS = {'confidence', 'accuracy', 'decode_ms', 'infer_ms', 'fast_confidence'}
+# 布尔字段（级联识别是否升级到大模型）
+BOOL_FIELDS = {'escalated'}
+# 文件写缓冲区大小
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def is_numeric_field(field):
+    """判断字段是否为数值字段（含多模型对比的各模型列）"""
+    return field in NUMERIC_FIELDS or field.rsplit('.', 1)[-1] in ('confidence', 'accuracy')
+
+
+def get_field_kind(field):
+    """字段的导出类型：'float'、'bool' 或 'string'"""
+    if field in BOOL_FIELDS:
+        return 'bool'
+    return 'float' if is_numeric_field(field) else 'string'
+
+
+class ResultWriter(ABC):
+    """结果写出器基类
+
+    unique 为True时（监视目录，文件被重写后会再次识别）同一图像只保留一行：
+    再次写出时替换之前的行，在下次 flush() 或 close() 时重写文件；为此需在内存中保留所有行。
+    """
+
+    def __init__(self, path, fields=None, unique=False):
+        self.path = path
+        self.fields = fields or RESULT_FIELDS
+        self.count = 0
+        self.unique = unique
+        self.rows = []
+        # 图像路径 -> 行号
+        self.row_index = {}
+        self.needs_rewrite = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, result):
+        """写出一条结果"""
+        row = [result.get(field) for field in self.fields]
+        if self.unique:
+            index = self.row_index.get(result.get('image_path'))
+            if index is not None:
+                self.rows[index] = row
+                self.needs_rewrite = True
+                return
+            self.row_index[result.get('image_path')] = len(self.rows)
+            self.rows.append(row)
+        self.write_row(row)
+        self.count += 1
+
+    @abstractmethod
+    def write_row(self, row):
+        """追加写出一行"""
+
+    @abstractmethod
+    def rewrite(self):
+        """有行被替换时，按 self.rows 重写整个文件"""
+
+    def flush(self):
+        """将已写出的结果刷新到文件（监视模式下每批结果后调用）"""
+        if self.needs_rewrite:
+            self.rewrite()
+            self.needs_rewrite = False
+
+    @abstractmethod
+    def close(self):
+        """刷新并关闭文件"""
+
+
+class CsvResultWriter(ResultWriter):
+    """CSV写出器（带BOM，便于Excel打开中文）"""
+
+    def __init__(self, path, fields=None, unique=False):
+        super().__init__(path, fields, unique)
+        self.file = open(path, 'w', encoding='utf-8-sig', newline='', buffering=WRITE_BUFFER_SIZE)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.fields)
+
+    def write_row(self, row):
+        self.writer.writerow(['' if value is None else value for value in row])
+
+    def rewrite(self):
+        self.file.close()
+        self.file = open(self.path, 'w', encoding='utf-8-sig', newline='', buffering=WRITE_BUFFER_SIZE)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.fields)
+        for row in self.rows:
+            self.write_row(row)
+
+    def flush(self):
+        super().flush()
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            super().flush()
+            self.file.close()
+
+
+class JsonlResultWriter(ResultWriter):
+    """JSON Lines写出器，每行一条结果"""
+
+    def __init__(self, path, fields=None, unique=False):
+        super().__init__(path, fields, unique)
+        self.file = open(path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE)
+
+    def write_row(self, row):
+        self.file.write(json.dumps(dict(zip(self.fields, row)), ensure_ascii=False))
+        self.file.write('\n')
+
+    def rewrite(self):
+        self.file.close()
+        self.file = open(self.path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE)
+        for row in self.rows:
+            self.write_row(row)
+
+    def flush(self):
+        super().flush()
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            super().flush()
+            self.file.close()
+
+
+class ParquetResultWriter(ResultWriter):
+    """Parquet写出器，按列缓存，每满 row_group_size 行写出一个行组"""
+
+    def __init__(self, path, fields=None, unique=False, row_group_size=65536):
+        if pa is None:
+            raise Exception("导出Parquet需要安装pyarrow")
+        super().__init__(path, fields, unique)
+        self.row_group_size = row_group_size
+        self.columns = [[] for _ in self.fields]
+        self.kinds = [get_field_kind(field) for field in self.fields]
+        types = {'float': pa.float64(), 'bool': pa.bool_(), 'string': pa.string()}
+        self.schema = pa.schema([(field, types[kind]) for field, kind in zip(self.fields, self.kinds)])
+        self.writer = None
+
+    def write_row(self, row):
+        for kind, column, value in zip(self.kinds, self.columns, row):
+            if value is not None:
+                if kind == 'string':
+                    value = str(value)
+                elif kind == 'bool':
+                    value = bool(value)
+            column.append(value)
+        if len(self.columns[0]) >= self.row_group_size:
+            self.write_row_group()
+
+    def write_row_group(self):
+        """将缓存的行写出为一个行组"""
+        if not self.columns[0]:
+            return
+        table = pa.table(self.columns, schema=self.schema)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(table)
+        self.columns = [[] for _ in self.fields]
+
+    def rewrite(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.columns = [[] for _ in self.fields]
+        for row in self.rows:
+            self.write_row(row)
+
+    def flush(self):
+        # Parquet文件在关闭时才写出文件尾，中途无法读取，不为此写出过小的行组，替换的行也在关闭时重写
+        pass
+
+    def close(self):
+        super().flush()
+        self.write_row_group()
+        if self.writer is None and self.count == 0:
+            # 没有任何结果时也写出只含表头的文件
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+RESULT_WRITERS = {
+    '.csv': CsvResultWriter,
+    '.jsonl': JsonlResultWriter,
+    '.parquet': ParquetResultWriter,
+}
+
+
+def create_result_writer(path, fields=None, unique=False):
+    """根据文件扩展名创建结果写出器
+        :param unique: 同一图像只保留最新的一行（监视目录时使用）
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in RESULT_WRITERS:
+        raise Exception(f"不支持的导出格式: {ext}")
+    return RESULT_WRITERS[ext](path, fields, unique)
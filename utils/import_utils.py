@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图像导入模块：并行递归扫描目录，只读取图像头校验文件，损坏或不支持的文件在识别前剔除
+"""
+
+import os
+import time
+import struct
+import zipfile
+import tarfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from PIL import Image
+
+from utils.archive_utils import is_image_file, is_archive
+
+
+SCAN_WORKERS = 8
+VALIDATE_WORKERS = 16
+# 每个校验任务处理的文件数，避免为每个文件创建一个任务
+VALIDATE_CHUNK_SIZE = 256
+# OpenCV能解码的图像格式（PIL识别出的格式名）
+SUPPORTED_FORMATS = ('PNG', 'JPEG', 'MPO', 'BMP', 'TIFF', 'WEBP')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 带尺寸信息的JPEG帧起始标记（SOF0~SOF15，排除DHT、JPG、DAC）
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# 没有长度字段的JPEG标记（TEM、RST0~RST7）
+JPEG_STANDALONE_MARKERS = frozenset([0x01] + list(range(0xD0, 0xD8)))
+
+
+def scan_directory(directory):
+    """列出单个目录
+        :return: (图像和归档文件, [(不支持的文件, 原因), ...], 子目录)，均按名称排序
+    """
+    files = []
+    unsupported = []
+    subdirs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif not entry.is_file():
+                    continue
+                elif is_image_file(entry.name) or is_archive(entry.name):
+                    files.append(entry.path)
+                else:
+                    unsupported.append((entry.path, '不支持的文件类型'))
+            except OSError:
+                continue
+    return sorted(files), sorted(unsupported), sorted(subdirs)
+
+
+def scan_tree(roots, workers=SCAN_WORKERS):
+    """并行递归扫描目录，每个目录的 scandir 作为一个任务，发现子目录后立即提交
+        :param roots: 目录或文件路径列表，文件按扩展名直接归类
+        :return: (候选文件, [(跳过的文件, 原因), ...])；顺序与按名称排序的 os.walk 相同
+    """
+    listings = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan_directory, root): root for root in roots if os.path.isdir(root)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = pending.pop(future)
+                try:
+                    listing = future.result()
+                except OSError as e:
+                    listing = ([], [(directory, f'无法读取目录: {e.strerror or e}')], [])
+                listings[directory] = listing
+                for subdir in listing[2]:
+                    pending[executor.submit(scan_directory, subdir)] = subdir
+
+    # 按目录树深度优先合并，保证结果顺序确定
+    candidates = []
+    skipped = []
+    for root in roots:
+        if root not in listings:
+            if is_image_file(root) or is_archive(root):
+                candidates.append(root)
+            else:
+                skipped.append((root, '不支持的文件类型'))
+            continue
+        stack = [root]
+        while stack:
+            files, unsupported, subdirs = listings[stack.pop()]
+            candidates.extend(files)
+            skipped.extend(unsupported)
+            stack.extend(reversed(subdirs))
+    return candidates, skipped
+
+
+def read_jpeg_size(f):
+    """按标记段跳读JPEG，直到帧起始标记取得尺寸"""
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise Exception("JPEG标记损坏")
+        code = marker[1]
+        # 标记前可以有任意个填充字节0xFF
+        while code == 0xFF:
+            fill = f.read(1)
+            if not fill:
+                raise Exception("JPEG标记损坏")
+            code = fill[0]
+        if code in JPEG_STANDALONE_MARKERS:
+            continue
+        length_data = f.read(2)
+        if len(length_data) < 2:
+            raise Exception("JPEG文件被截断")
+        length = struct.unpack('>H', length_data)[0]
+        if code in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                raise Exception("JPEG文件被截断")
+            _, height, width = struct.unpack('>BHH', frame)
+            return width, height
+        if code == 0xDA or length < 2:
+            raise Exception("JPEG缺少帧起始标记")
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_header_size(f):
+    """直接解析PNG、JPEG、BMP的文件头，比通过PIL打开快数倍
+        :return: (格式, 宽, 高)；其他格式返回None，由PIL识别
+    """
+    head = f.read(26)
+    if head.startswith(PNG_SIGNATURE):
+        if len(head) < 24 or head[12:16] != b'IHDR':
+            raise Exception("PNG文件头损坏")
+        width, height = struct.unpack('>II', head[16:24])
+        return 'PNG', width, height
+    if head.startswith(b'\xff\xd8'):
+        return ('JPEG',) + read_jpeg_size(f)
+    if head.startswith(b'BM') and len(head) >= 26:
+        width, height = struct.unpack('<ii', head[18:26])
+        # 高度为负表示自上而下存储
+        return 'BMP', width, abs(height)
+    return None
+
+
+def check_file_header(path):
+    """只读取文件头校验图像或归档文件（像素数据损坏无法发现）
+        :return: 通过时返回None，否则返回跳过原因
+    """
+    try:
+        if os.path.getsize(path) == 0:
+            return '空文件'
+        if is_archive(path):
+            valid = zipfile.is_zipfile(path) if path.lower().endswith('.zip') else tarfile.is_tarfile(path)
+            return None if valid else '归档文件损坏'
+        with open(path, 'rb') as f:
+            header = read_header_size(f)
+            if header is None:
+                # 其他格式交给PIL，打开时只解析文件头，不解码像素
+                f.seek(0)
+                with Image.open(f) as image:
+                    header = (image.format,) + image.size
+        image_format, width, height = header
+    except OSError as e:
+        if isinstance(e, Image.UnidentifiedImageError):
+            return '无法识别的图像'
+        return f'无法读取: {e.strerror or e}'
+    except Exception as e:
+        return f'图像头损坏: {e}'
+    if image_format not in SUPPORTED_FORMATS:
+        return f'不支持的图像格式: {image_format}'
+    if width <= 0 or height <= 0:
+        return '图像尺寸无效'
+    return None
+
+
+def check_file_headers(paths):
+    """校验一组文件，返回对应的跳过原因列表"""
+    return [check_file_header(path) for path in paths]
+
+
+def validate_paths(paths, workers=VALIDATE_WORKERS, progress=None):
+    """在线程池中校验文件头
+        :param progress: 进度回调 progress(已校验数, 总数)
+        :return: (通过的文件, [(跳过的文件, 原因), ...])，保持输入顺序
+    """
+    chunks = [paths[i:i + VALIDATE_CHUNK_SIZE] for i in range(0, len(paths), VALIDATE_CHUNK_SIZE)]
+    valid = []
+    skipped = []
+    checked = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk, reasons in zip(chunks, executor.map(check_file_headers, chunks)):
+            for path, reason in zip(chunk, reasons):
+                if reason is None:
+                    valid.append(path)
+                else:
+                    skipped.append((path, reason))
+            checked += len(chunk)
+            if progress is not None:
+                progress(checked, len(paths))
+    return valid, skipped
+
+
+class ImportReport:
+    """一次导入的结果：可识别的文件、跳过的文件及原因、耗时"""
+
+    def __init__(self, paths, skipped, scan_seconds, validate_seconds):
+        self.paths = paths
+        self.skipped = skipped
+        self.scan_seconds = scan_seconds
+        self.validate_seconds = validate_seconds
+
+    def reason_counts(self):
+        """按原因统计跳过的文件数"""
+        counts = {}
+        for _, reason in self.skipped:
+            counts[reason] = counts.get(reason, 0) + 1
+        return sorted(counts.items(), key=lambda item: item[1], reverse=True)
+
+    def summary(self, max_files=20):
+        """跳过文件的文字说明，最多列出 max_files 个文件"""
+        lines = [f"{reason}: {count} 个" for reason, count in self.reason_counts()]
+        for path, reason in self.skipped[:max_files]:
+            lines.append(f"  {path}（{reason}）")
+        if len(self.skipped) > max_files:
+            lines.append(f"  …另有 {len(self.skipped) - max_files} 个")
+        return '\n'.join(lines)
+
+
+def import_images(roots, validate=True, scan_workers=SCAN_WORKERS, validate_workers=VALIDATE_WORKERS,
+                  progress=None):
+    """扫描目录（或文件列表）并校验文件头
+        :param validate: 是否校验文件头，否则只按扩展名筛选
+        :param progress: 校验进度回调 progress(已校验数, 总数)
+        :return: ImportReport
+    """
+    scan_start = time.perf_counter()
+    candidates, skipped = scan_tree(roots, scan_workers)
+    scan_seconds = time.perf_counter() - scan_start
+
+    validate_start = time.perf_counter()
+    if validate:
+        candidates, invalid = validate_paths(candidates, validate_workers, progress)
+        skipped += invalid
+    return ImportReport(candidates, skipped, scan_seconds, time.perf_counter() - validate_start)
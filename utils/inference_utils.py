@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推理任务模块，不依赖界面，供模型处理线程和命令行共用
+"""
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.model_utils import ModelLoader, ImageDecodeError, MODEL_KIND_TEXT, find_config_file
+from utils.archive_utils import count_image_sources, iter_image_sources, image_basename, split_member_path
+from utils.dedup_utils import Deduplicator
+from utils.cache_utils import hash_bytes, hash_plan
+from utils.export_utils import RESULT_FIELDS
+from utils.eval_utils import StreamingEvaluator, CascadeEvaluator
+from utils.batch_utils import BatchProfileStore, get_profile_key, get_rss_bytes
+from utils.ocr_utils import TextDetector, PageOCRPipeline
+
+
+def create_model_loader(model_path, config_path=None, intra_op_num_threads=None):
+    """查找配置文件，创建并加载模型和标签映射
+        :return: (模型加载器, 实际使用的配置文件路径)
+    """
+    if not config_path:
+        config_path = find_config_file(model_path)
+
+    model_loader = ModelLoader(model_path, config_path)
+    model_loader.intra_op_num_threads = intra_op_num_threads
+    model_loader.load_model()
+
+    if config_path and os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+            if 'label_map_file' in config:
+                model_loader.load_label_map(config['label_map_file'])
+    return model_loader, config_path
+
+
+def get_model_names(model_paths):
+    """由模型路径生成不重复的模型显示名称"""
+    names = []
+    for path in model_paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        unique_name = name
+        index = 2
+        while unique_name in names:
+            unique_name = f"{name}_{index}"
+            index += 1
+        names.append(unique_name)
+    return names
+
+
+class InferenceJob:
+    """批量推理任务"""
+
+    def __init__(self, model_path, image_paths, config_path=None, dedup=False, dedup_distance=0,
+                 answer_matcher=None, result_writer=None, tensor_cache=None, batch_controller=None,
+                 batch_profile_store=None):
+        self.model_path = model_path
+        # 图像或归档文件路径，也可以包含 (名称, 内存数据) 元组（见 iter_image_sources）
+        self.image_paths = image_paths
+        self.config_path = config_path
+        self.model_loader = None
+        # 可选的标准答案匹配器，用于补充正确答案和正确率
+        self.answer_matcher = answer_matcher
+        # 可选的结果写出器，结果产生时即写出
+        self.result_writer = result_writer
+        # 可选的重复图像检测，重复图像复用代表图像的结果
+        self.deduplicator = Deduplicator(dedup_distance) if dedup else None
+        # 可选的预处理张量缓存，命中时跳过解码和预处理
+        self.tensor_cache = tensor_cache
+        self.plan_hash = None
+        # 流式评测器，模型加载后按模型类型创建
+        self.evaluator = None
+        # 可选的自适应批大小控制器，最优批大小按 模型 + 主机 记录
+        self.batch_controller = batch_controller
+        self.batch_profile_store = batch_profile_store
+        self.batch_profile_key = None
+        # 可选的内存监测器，每产生一条结果计一张图像
+        self.memory_monitor = None
+        # 可选的结果过滤函数，返回False的结果不评测、不写出、不产出（监视目录时未写完的文件等待重试）
+        self.result_filter = None
+
+    @property
+    def saved_inferences(self):
+        """去重节省的推理次数"""
+        return self.deduplicator.saved_inferences if self.deduplicator else 0
+
+    @property
+    def result_fields(self):
+        """导出的结果字段"""
+        return RESULT_FIELDS
+
+    def load(self):
+        """查找配置文件，加载模型和标签映射"""
+        self.model_loader, self.config_path = create_model_loader(self.model_path, self.config_path)
+        self.plan_hash = hash_plan(self.model_loader.get_preprocess_plan())
+        self.create_evaluator()
+        if self.batch_controller is not None:
+            if self.batch_profile_store is None:
+                self.batch_profile_store = BatchProfileStore()
+            self.batch_profile_key = get_profile_key(self.model_path)
+            # 从记录的最优批大小开始调整；批维度已固定时不能超过固定值
+            self.batch_controller.start(self.batch_profile_store.get(self.batch_profile_key),
+                                        self.model_loader.fixed_batch_size)
+
+    def create_evaluator(self):
+        """按模型类型创建流式评测器"""
+        self.evaluator = StreamingEvaluator(self.model_loader.get_model_kind(), self.model_loader.config.classDict)
+
+    def count_images(self):
+        """统计待处理的图像数量（归档按成员数计），含有压缩的tar时返回None"""
+        return count_image_sources(self.image_paths)
+
+    def annotate_result(self, result):
+        """补充标准答案和正确率"""
+        if self.answer_matcher is None:
+            return
+        answer = self.answer_matcher.get_answer(image_basename(result['image_path']))
+        result['answer'] = answer if answer is not None else ''
+        if answer is not None:
+            result['accuracy'] = self.answer_matcher.calculate_accuracy(result['prediction'], answer)
+        else:
+            result['accuracy'] = None
+
+    def iter_results(self):
+        """逐张推理并生成结果字典，同时写出到导出文件并累加评测统计"""
+        for result in self.iter_predictions():
+            if self.result_filter is not None and not self.result_filter(result):
+                continue
+            self.annotate_result(result)
+            if self.evaluator is not None:
+                self.evaluator.add(result)
+            if self.result_writer is not None:
+                self.result_writer.write(result)
+            if self.memory_monitor is not None:
+                self.memory_monitor.tick()
+            yield result
+
+    def predict_interactive(self, img_path):
+        """插队识别单张图像，批处理进行中调用时在下一个批边界执行（需设置模型的调度器）"""
+        decode_start = time.perf_counter()
+        img = self.model_loader.decode_image(img_path)
+        decode_ms = (time.perf_counter() - decode_start) * 1000
+
+        infer_start = time.perf_counter()
+        prediction, confidence = self.model_loader.predict_image(img, interactive=True)
+        result = {
+            'image_path': img_path,
+            'prediction': prediction,
+            'confidence': confidence,
+            'status': '成功',
+            'decode_ms': decode_ms,
+            'infer_ms': (time.perf_counter() - infer_start) * 1000
+        }
+        self.annotate_result(result)
+        return result
+
+    def iter_watch_results(self, watcher, batch_window=0.1, should_stop=None):
+        """监视目录，新文件写完后按小批识别（模型只加载一次，需先调用 load）
+            读取或解码失败的文件可能还没写完，放回监视器等待重试，多次失败后才记录为失败
+            :param watcher: FolderWatcher
+            :return: 逐批生成结果列表；文件被重写后会再次产出该文件的结果，由使用方替换之前的结果
+        """
+        def keep_result(result):
+            # 归档成员按所在的归档文件重试
+            path, member_name = split_member_path(result['image_path'])
+            if result.get('decode_failed'):
+                # 归档交出后没有再变化时，成员解码失败说明成员本身损坏，直接记录失败
+                if not (member_name is not None and watcher.is_unchanged(path)) and watcher.retry(path):
+                    return False
+            watcher.done(path)
+            return True
+
+        self.result_filter = keep_result
+        try:
+            for batch in watcher.iter_batches(batch_window, should_stop=should_stop):
+                self.image_paths = batch
+                results = list(self.iter_results())
+                if self.result_writer is not None:
+                    self.result_writer.flush()
+                if results:
+                    yield results
+        finally:
+            self.result_filter = None
+
+    def iter_predictions(self):
+        """逐张推理，生成包含预测结果和耗时的结果字典
+            启用自适应批大小时按控制器给出的批大小攒批推理，结果仍保持输入顺序
+        """
+        results = []
+        pending = []
+        for img_path, source in iter_image_sources(self.image_paths):
+            try:
+                result, item, image_hash = self.prepare_source(img_path, source)
+            except Exception as e:
+                result, item, image_hash = {
+                    'image_path': img_path,
+                    'prediction': '错误',
+                    'confidence': 0.0,
+                    'status': f'失败: {str(e)}',
+                    'decode_failed': isinstance(e, ImageDecodeError)
+                }, None, None
+            results.append(result)
+            if item is not None:
+                pending.append((result, item, image_hash))
+
+            batch_size = self.batch_controller.batch_size if self.batch_controller is not None else 1
+            if len(pending) >= batch_size:
+                self.run_pending(pending)
+                pending = []
+            if not pending:
+                yield from results
+                results = []
+
+        if pending:
+            self.run_pending(pending)
+        yield from results
+        self.save_batch_profile()
+
+    def prepare_source(self, img_path, source):
+        """解码图像来源，按需经过张量缓存和重复图像检测
+            :return: (结果字典, 待推理的输入, 去重键)；命中去重时无需推理，待推理的输入为None
+                启用张量缓存时待推理的输入为预处理后的数组，否则为解码后的图像
+        """
+        decode_start = time.perf_counter()
+        result = {
+            'image_path': img_path,
+            'prediction': None,
+            'confidence': None,
+            'status': '成功'
+        }
+        # 已解码的图像数组没有编码数据可作为缓存键，不经过张量缓存
+        use_cache = self.tensor_cache is not None and not self.model_loader.is_image_array(source)
+        if use_cache:
+            data = self.model_loader.read_image_data(source)
+            cache_key = hash_bytes(data)
+            array = self.tensor_cache.get(cache_key, self.plan_hash)
+            if array is not None:
+                # 命中缓存，跳过解码和预处理，直接从内存映射推理
+                result['decode_ms'] = (time.perf_counter() - decode_start) * 1000
+                return result, array, None
+            img = self.model_loader.decode_image_data(data)
+        else:
+            img = self.model_loader.decode_image(source)
+        result['decode_ms'] = (time.perf_counter() - decode_start) * 1000
+
+        dedup_key = None
+        if self.deduplicator is not None:
+            # 同一批内尚未推理的重复图像查不到代表图像，会各自推理
+            dedup_key = self.deduplicator.compute_key(img)
+            match = self.deduplicator.lookup(dedup_key)
+            if match is not None:
+                rep_path, prediction, confidence = match
+                result.update(prediction=prediction, confidence=confidence, reused_from=rep_path, infer_ms=0.0)
+                return result, None, None
+
+        if self.tensor_cache is not None:
+            array = self.model_loader.preprocess_decoded(img)
+            if use_cache:
+                self.tensor_cache.put(cache_key, self.plan_hash, array)
+            return result, array, dedup_key
+        return result, img, dedup_key
+
+    def run_pending(self, pending):
+        """对攒好的一批输入推理，填入结果并登记去重
+            :param pending: [(结果字典, 待推理的输入, 去重键), ...]
+        """
+        infer_start = time.perf_counter()
+        try:
+            items = [item for _, item, _ in pending]
+            if self.tensor_cache is not None:
+                predictions = self.model_loader.predict_arrays(items)
+            else:
+                predictions = self.model_loader.predict_images(items)
+        except Exception as e:
+            for result, _, _ in pending:
+                result.update(prediction='错误', confidence=0.0, status=f'失败: {str(e)}')
+            return
+        elapsed = time.perf_counter() - infer_start
+
+        for (result, _, dedup_key), (prediction, confidence) in zip(pending, predictions):
+            result.update(prediction=prediction, confidence=confidence, infer_ms=elapsed * 1000 / len(pending))
+            if dedup_key is not None:
+                self.deduplicator.add(dedup_key, result['image_path'], prediction, confidence)
+        if self.batch_controller is not None:
+            self.batch_controller.record(len(pending), elapsed, get_rss_bytes())
+
+    def save_batch_profile(self):
+        """记录本次测得的最优批大小"""
+        controller = self.batch_controller
+        if controller is None or controller.best_throughput <= 0:
+            return
+        self.batch_profile_store.put(self.batch_profile_key, controller.best_batch_size, controller.best_throughput)
+
+
+class MultiModelJob(InferenceJob):
+    """多模型对比任务
+
+    每张图像只解码一次，按预处理方案各预处理一次，再交给所有模型并发推理，
+    结果中 'models' 按模型名称给出各自的预测结果和正确率。
+    """
+
+    def __init__(self, model_paths, image_paths, answer_matcher=None, result_writer=None):
+        super().__init__(model_paths[0], image_paths, answer_matcher=answer_matcher, result_writer=result_writer)
+        self.model_paths = model_paths
+        self.model_names = get_model_names(model_paths)
+        self.model_loaders = []
+        self.model_stats = {name: {'images': 0, 'infer_seconds': 0.0} for name in self.model_names}
+        self.reduced_decode = False
+
+    @property
+    def result_fields(self):
+        """导出的结果字段，每个模型追加预测结果、置信度和正确率列"""
+        fields = list(RESULT_FIELDS)
+        for name in self.model_names:
+            fields += [f"{name}.prediction", f"{name}.confidence", f"{name}.accuracy"]
+        return fields
+
+    def load(self):
+        """加载所有模型，按模型数量均分CPU线程"""
+        threads = max(1, (os.cpu_count() or 1) // len(self.model_paths))
+        self.model_loaders = [create_model_loader(path, intra_op_num_threads=threads)[0]
+                              for path in self.model_paths]
+        self.model_loader = self.model_loaders[0]
+        # 顶层结果取第一个模型，评测也针对第一个模型
+        self.create_evaluator()
+        # 各模型的目标尺寸不同时，缩小解码可能不满足其他模型，改为按原图解码
+        self.reduced_decode = len({(loader.get_model_kind(), loader.use_reduced_decode())
+                                   for loader in self.model_loaders}) == 1
+
+    def get_model_summary(self):
+        """各模型的推理吞吐量统计"""
+        summary = []
+        for name in self.model_names:
+            stats = self.model_stats[name]
+            seconds = stats['infer_seconds']
+            summary.append({
+                'model': name,
+                'images': stats['images'],
+                'infer_seconds': seconds,
+                'images_per_second': stats['images'] / seconds if seconds > 0 else 0.0
+            })
+        return summary
+
+    def annotate_result(self, result):
+        """为每个模型补充正确率，并展开为导出列"""
+        super().annotate_result(result)
+        answer = result.get('answer')
+        for name, entry in result.get('models', {}).items():
+            if answer:
+                entry['accuracy'] = self.answer_matcher.calculate_accuracy(entry['prediction'], answer)
+            else:
+                entry['accuracy'] = None
+            result[f"{name}.prediction"] = entry['prediction']
+            result[f"{name}.confidence"] = entry['confidence']
+            result[f"{name}.accuracy"] = entry['accuracy']
+
+    def _predict_with(self, name, model_loader, array):
+        """在线程池中用单个模型推理"""
+        try:
+            infer_start = time.perf_counter()
+            prediction, confidence = model_loader.predict_arrays([array])[0]
+            infer_seconds = time.perf_counter() - infer_start
+            stats = self.model_stats[name]
+            stats['images'] += 1
+            stats['infer_seconds'] += infer_seconds
+            return {'prediction': prediction, 'confidence': confidence, 'status': '成功',
+                    'infer_ms': infer_seconds * 1000}
+        except Exception as e:
+            return {'prediction': '错误', 'confidence': 0.0, 'status': f'失败: {str(e)}', 'infer_ms': None}
+
+    def iter_predictions(self):
+        """逐张解码一次，所有模型并发推理"""
+        with ThreadPoolExecutor(max_workers=len(self.model_loaders)) as executor:
+            for img_path, source in iter_image_sources(self.image_paths):
+                try:
+                    decode_start = time.perf_counter()
+                    img = self.model_loader.decode_image(source, self.reduced_decode)
+                    decode_ms = (time.perf_counter() - decode_start) * 1000
+
+                    # 预处理方案相同的模型共用同一份预处理结果
+                    arrays = {}
+                    for model_loader in self.model_loaders:
+                        plan = model_loader.get_preprocess_plan()
+                        if plan not in arrays:
+                            arrays[plan] = model_loader.preprocess_decoded(img)
+
+                    infer_start = time.perf_counter()
+                    futures = [executor.submit(self._predict_with, name, model_loader,
+                                               arrays[model_loader.get_preprocess_plan()])
+                               for name, model_loader in zip(self.model_names, self.model_loaders)]
+                    models = {name: future.result() for name, future in zip(self.model_names, futures)}
+                    infer_ms = (time.perf_counter() - infer_start) * 1000
+
+                    # 顶层字段取第一个模型的结果，任一模型失败则整体标记为失败
+                    first = models[self.model_names[0]]
+                    failed = [entry['status'] for entry in models.values() if entry['status'] != '成功']
+                    yield {
+                        'image_path': img_path,
+                        'prediction': first['prediction'],
+                        'confidence': first['confidence'],
+                        'status': failed[0] if failed else '成功',
+                        'models': models,
+                        'decode_ms': decode_ms,
+                        'infer_ms': infer_ms
+                    }
+                except Exception as e:
+                    yield {
+                        'image_path': img_path,
+                        'prediction': '错误',
+                        'confidence': 0.0,
+                        'status': f'失败: {str(e)}',
+                        'decode_failed': isinstance(e, ImageDecodeError)
+                    }
+
+
+class CascadeJob(InferenceJob):
+    """级联识别任务：先用快速模型识别，置信度低于阈值或文本为空的图像再交给大模型
+
+    每批图像只解码一次，快速模型整批推理后，需要升级的图像重新组成一批送入大模型。
+    对比模式（compare）下未升级的图像也用大模型推理一次，用于统计仅用大模型时的耗时和正确率，
+    结果仍取级联的结果。
+    """
+
+    def __init__(self, fast_model_path, model_path, image_paths, config_path=None, threshold=0.9,
+                 compare=False, batch_size=16, answer_matcher=None, result_writer=None):
+        super().__init__(model_path, image_paths, config_path,
+                         answer_matcher=answer_matcher, result_writer=result_writer)
+        self.fast_model_path = fast_model_path
+        self.fast_model_loader = None
+        self.threshold = threshold
+        self.compare = compare
+        self.batch_size = batch_size
+        self.reduced_decode = False
+
+    @property
+    def result_fields(self):
+        """导出的结果字段，追加是否升级和快速模型的结果"""
+        fields = list(RESULT_FIELDS) + ['escalated', 'fast_prediction', 'fast_confidence']
+        if self.compare:
+            fields.append('large_prediction')
+        return fields
+
+    def load(self):
+        """加载快速模型和大模型，两者都必须是文本识别模型"""
+        self.fast_model_loader = create_model_loader(self.fast_model_path)[0]
+        self.model_loader, self.config_path = create_model_loader(self.model_path, self.config_path)
+        for loader in (self.fast_model_loader, self.model_loader):
+            if loader.get_model_kind() != MODEL_KIND_TEXT:
+                raise Exception(f"级联识别只支持文本识别模型: {loader.model_path}")
+        self.create_evaluator()
+        self.evaluator.sections['cascade'] = CascadeEvaluator(self.threshold)
+        # 两个模型的预处理方案相同时才能共用缩小解码的图像
+        self.reduced_decode = (self.fast_model_loader.get_preprocess_plan() == self.model_loader.get_preprocess_plan()
+                               and self.model_loader.use_reduced_decode())
+
+    @property
+    def cascade_report(self):
+        """级联统计报告"""
+        return self.evaluator.sections['cascade'].report()
+
+    def should_escalate(self, prediction, confidence):
+        """判断快速模型的结果是否需要交给大模型"""
+        return not prediction or confidence < self.threshold
+
+    def annotate_result(self, result):
+        """对比模式下同时计算快速模型和大模型的正确率"""
+        super().annotate_result(result)
+        answer = result.get('answer')
+        if not answer or 'large_prediction' not in result:
+            return
+        result['fast_accuracy'] = self.answer_matcher.calculate_accuracy(result['fast_prediction'], answer)
+        result['large_accuracy'] = self.answer_matcher.calculate_accuracy(result['large_prediction'], answer)
+
+    def iter_predictions(self):
+        """按批解码，快速模型整批推理，需要升级的图像再组批送入大模型"""
+        batch = []
+        for img_path, source in iter_image_sources(self.image_paths):
+            decode_start = time.perf_counter()
+            result = {'image_path': img_path}
+            try:
+                img = self.model_loader.decode_image(source, self.reduced_decode)
+            except Exception as e:
+                result.update(prediction='错误', confidence=0.0, status=f'失败: {str(e)}',
+                              decode_failed=isinstance(e, ImageDecodeError))
+                img = None
+            result['decode_ms'] = (time.perf_counter() - decode_start) * 1000
+            batch.append((result, img))
+            if len(batch) >= self.batch_size:
+                yield from self.run_cascade(batch)
+                batch = []
+        if batch:
+            yield from self.run_cascade(batch)
+
+    def _timed_predict(self, model_loader, images):
+        """整批推理，返回 (结果列表, 每张平均耗时毫秒)"""
+        infer_start = time.perf_counter()
+        predictions = model_loader.predict_images(images)
+        return predictions, (time.perf_counter() - infer_start) * 1000 / len(images)
+
+    def run_cascade(self, batch):
+        """对一批已解码的图像运行级联推理，按输入顺序返回结果"""
+        pending = [(result, img) for result, img in batch if img is not None]
+        if not pending:
+            return [result for result, _ in batch]
+        try:
+            predictions, fast_ms = self._timed_predict(self.fast_model_loader, [img for _, img in pending])
+            escalate = []
+            keep = []
+            for (result, img), (prediction, confidence) in zip(pending, predictions):
+                escalated = self.should_escalate(prediction, confidence)
+                result.update(prediction=prediction, confidence=confidence, status='成功', escalated=escalated,
+                              fast_prediction=prediction, fast_confidence=confidence, fast_infer_ms=fast_ms,
+                              infer_ms=fast_ms)
+                (escalate if escalated else keep).append((result, img))
+
+            if escalate:
+                predictions, large_ms = self._timed_predict(self.model_loader, [img for _, img in escalate])
+                for (result, _), (prediction, confidence) in zip(escalate, predictions):
+                    result.update(prediction=prediction, confidence=confidence, large_infer_ms=large_ms,
+                                  infer_ms=result['infer_ms'] + large_ms)
+                    if self.compare:
+                        result['large_prediction'] = prediction
+            if self.compare and keep:
+                predictions, compare_ms = self._timed_predict(self.model_loader, [img for _, img in keep])
+                for (result, _), (prediction, _) in zip(keep, predictions):
+                    result.update(large_prediction=prediction, compare_infer_ms=compare_ms)
+        except Exception as e:
+            for result, _ in pending:
+                result.update(prediction='错误', confidence=0.0, status=f'失败: {str(e)}')
+                result.pop('escalated', None)
+        return [result for result, _ in batch]
+
+
+class PageOCRJob(InferenceJob):
+    """整页OCR任务：先检测文本行，再将所有页面的文本行分批送入识别模型"""
+
+    def __init__(self, det_model_path, rec_model_path, image_paths, config_path=None,
+                 answer_matcher=None, result_writer=None, det_workers=None, rec_batch_size=16):
+        super().__init__(rec_model_path, image_paths, config_path,
+                         answer_matcher=answer_matcher, result_writer=result_writer)
+        self.det_model_path = det_model_path
+        # 检测线程数默认为CPU核数
+        self.det_workers = det_workers or os.cpu_count() or 1
+        self.rec_batch_size = rec_batch_size
+        self.pipeline = None
+
+    def load(self):
+        """加载识别模型和检测模型"""
+        super().load()
+        detector = TextDetector(self.det_model_path)
+        # 各检测线程共用一个会话，按线程数分摊会话内部线程
+        detector.intra_op_num_threads = max(1, (os.cpu_count() or 1) // self.det_workers)
+        detector.load_model()
+        self.pipeline = PageOCRPipeline(detector, self.model_loader, self.det_workers, self.rec_batch_size)
+
+    def predict_interactive(self, img_path):
+        """插队识别单页：检测在调用线程中进行，识别在批边界插队"""
+        result = self.pipeline.recognize_page(img_path, interactive=True)
+        self.annotate_result(result)
+        return result
+
+    def iter_predictions(self):
+        """逐页生成整页识别结果，文本按阅读顺序以换行分隔"""
+        return self.pipeline.iter_pages(iter_image_sources(self.image_paths))
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存监测模块：定期采样常驻内存和 tracemalloc 快照，按处理阶段归类存活的内存，发现持续增长
+"""
+
+import os
+import csv
+import time
+import inspect
+import tracemalloc
+from collections import deque
+
+import numpy as np
+
+from utils.batch_utils import get_rss_bytes
+
+
+MB = 1024 ** 2
+# 状态栏显示用的阶段名称
+STAGE_LABELS = {
+    'decode': '解码',
+    'preprocess': '预处理',
+    'inference': '推理',
+    'postprocess': '后处理',
+    'results': '结果',
+    'export': '导出',
+    'evaluation': '评测',
+    'dedup': '去重',
+    'thumbnails': '缩略图',
+    'other': '其他',
+    'untraced': '原生内存',
+    'rss': '常驻内存',
+}
+
+
+def get_memory_log_path(export_path):
+    """内存时间序列的路径：与导出文件同名，扩展名为 .memory.csv"""
+    return os.path.splitext(export_path)[0] + '.memory.csv'
+
+
+def get_default_stages():
+    """默认的阶段划分：阶段名 -> 函数或类（类包含其全部方法）"""
+    from utils.model_utils import ModelLoader, BoundBuffers
+    from utils.archive_utils import ArchiveReader, iter_image_sources
+    from utils.inference_utils import InferenceJob, MultiModelJob, CascadeJob
+    from utils.ocr_utils import TextDetector, PageOCRPipeline, crop_text_region
+    from utils.export_utils import ResultWriter, CsvResultWriter, JsonlResultWriter, ParquetResultWriter
+    from utils.eval_utils import StreamingEvaluator, CascadeEvaluator
+    from utils.dedup_utils import Deduplicator, BKTree, dhash
+    return {
+        'decode': [ModelLoader.read_image_data, ModelLoader.decode_image_data, ModelLoader.decode_image,
+                   ArchiveReader, iter_image_sources],
+        'preprocess': [ModelLoader.prepare_image, ModelLoader.fill_input, ModelLoader.preprocess_image,
+                       ModelLoader.preprocess_decoded, TextDetector.preprocess, crop_text_region],
+        # 会话和IOBinding缓冲区；ORT在C++中分配的内存（含内存池）不经过 tracemalloc，计入原生内存
+        'inference': [BoundBuffers, ModelLoader.load_model, ModelLoader._create_session, ModelLoader.warmup,
+                      ModelLoader.get_bound_buffers, ModelLoader._run_batches, TextDetector.detect],
+        'postprocess': [ModelLoader.process_output, TextDetector.boxes_from_bitmap],
+        'results': [InferenceJob.iter_results, InferenceJob.iter_predictions, InferenceJob.prepare_source,
+                    InferenceJob.run_pending, InferenceJob.annotate_result, MultiModelJob.iter_predictions,
+                    MultiModelJob.annotate_result, CascadeJob.run_cascade, CascadeJob.iter_predictions,
+                    PageOCRPipeline._finish_page],
+        'export': [ResultWriter, CsvResultWriter, JsonlResultWriter, ParquetResultWriter],
+        'evaluation': [StreamingEvaluator, CascadeEvaluator],
+        'dedup': [Deduplicator, BKTree, dhash],
+    }
+
+
+def iter_functions(obj):
+    """展开函数或类中的所有函数"""
+    if inspect.isclass(obj):
+        for value in vars(obj).values():
+            if isinstance(value, (staticmethod, classmethod)):
+                value = value.__func__
+            elif isinstance(value, property):
+                value = value.fget
+            if inspect.isfunction(value):
+                yield value
+    else:
+        yield inspect.unwrap(obj)
+
+
+class GrowthDetector:
+    """持续增长检测：对最近 window 个采样点（已处理图像数, 内存）做线性拟合，
+    相关系数高且窗口内增长超过 min_growth_bytes 时视为持续增长（而不是波动或一次性分配）
+    """
+
+    def __init__(self, window=8, min_growth_bytes=8 * MB, min_correlation=0.9):
+        self.window = window
+        self.min_growth_bytes = min_growth_bytes
+        self.min_correlation = min_correlation
+        self.points = deque(maxlen=window)
+
+    def add(self, images, value):
+        self.points.append((images, value))
+
+    @property
+    def slope(self):
+        """每张图像的增长字节数，点数不足或图像数没有变化时为None"""
+        if len(self.points) < 3:
+            return None
+        x, y = np.array(self.points, dtype=np.float64).T
+        if np.ptp(x) == 0:
+            return None
+        return float(np.polyfit(x, y, 1)[0])
+
+    @property
+    def growing(self):
+        if len(self.points) < self.window:
+            return False
+        x, y = np.array(self.points, dtype=np.float64).T
+        if np.ptp(x) == 0 or np.ptp(y) == 0:
+            return False
+        correlation = np.corrcoef(x, y)[0, 1]
+        return correlation >= self.min_correlation and y[-1] - y[0] >= self.min_growth_bytes
+
+
+class MemoryMonitor:
+    """内存监测器
+
+    每隔 interval 秒采样一次：
+    - 常驻内存（RSS）
+    - tracemalloc 快照中存活的内存，按分配位置所在的函数归到各阶段（取调用栈中最内层的已登记函数）
+    - 量表（gauge）：tracemalloc 看不到的已知内存，如界面缩略图
+    - 原生内存：RSS 减去 tracemalloc 跟踪的内存、其自身开销和量表，主要是ORT会话和内存池、OpenCV等C++分配
+      （onnxruntime 的Python接口不提供内存池统计，只能这样估算）
+    采样写入CSV时间序列，并对每一列检测随处理图像数的持续增长；每次采样结果交给 on_sample 回调，由调用方提示增长。
+    tracemalloc 会明显拖慢内存分配，只在需要排查时开启。
+    """
+
+    def __init__(self, csv_path=None, interval=10.0, nframes=4, stages=None, on_sample=None):
+        self.csv_path = csv_path
+        self.interval = interval
+        self.nframes = nframes
+        self.on_sample = on_sample
+        self.stages = {}
+        # 文件名 -> [(起始行, 结束行, 阶段), ...]
+        self.code_ranges = {}
+        self.frame_stages = {}
+        self.gauges = {}
+        self.detectors = {}
+        self.images = 0
+        self.samples = 0
+        self.last_sample = None
+        self.start_time = None
+        self.next_sample = 0.0
+        self.started_tracing = False
+        self.csv_file = None
+        self.csv_writer = None
+        self.columns = None
+        for name, objects in (stages if stages is not None else get_default_stages()).items():
+            self.register_stage(name, objects)
+
+    def register_stage(self, name, objects):
+        """登记阶段包含的函数或类"""
+        self.stages.setdefault(name, [])
+        for obj in objects:
+            for func in iter_functions(obj):
+                try:
+                    lines, start = inspect.getsourcelines(func)
+                except (OSError, TypeError):
+                    continue
+                filename = func.__code__.co_filename
+                self.code_ranges.setdefault(filename, []).append((start, start + len(lines) - 1, name))
+                self.stages[name].append(func)
+        self.frame_stages.clear()
+
+    def add_gauge(self, name, func):
+        """登记量表：返回当前字节数的函数，用于统计 tracemalloc 看不到的内存"""
+        self.gauges[name] = func
+
+    def start(self):
+        """开始跟踪内存分配"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+            self.started_tracing = True
+        self.start_time = time.monotonic()
+        self.next_sample = self.start_time
+        if self.csv_path:
+            self.csv_file = open(self.csv_path, 'w', newline='', encoding='utf-8')
+            self.csv_writer = csv.writer(self.csv_file)
+        self.sample()
+
+    def stop(self):
+        """最后采样一次，关闭时间序列并停止跟踪"""
+        if self.start_time is None:
+            return
+        self.sample()
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        self.start_time = None
+
+    def tick(self, images=1):
+        """记录已处理的图像数，到采样间隔时采样"""
+        self.images += images
+        if self.start_time is not None and time.monotonic() >= self.next_sample:
+            self.sample()
+
+    def get_frame_stage(self, filename, lineno):
+        """查找代码位置所属的阶段，嵌套时取范围最小的"""
+        key = (filename, lineno)
+        if key not in self.frame_stages:
+            best = None
+            for start, end, name in self.code_ranges.get(filename, ()):
+                if start <= lineno <= end and (best is None or end - start < best[0]):
+                    best = (end - start, name)
+            self.frame_stages[key] = best[1] if best else None
+        return self.frame_stages[key]
+
+    def get_stage_bytes(self, snapshot):
+        """按阶段汇总快照中存活的内存"""
+        totals = dict.fromkeys(self.stages, 0)
+        totals['other'] = 0
+        for stat in snapshot.statistics('traceback'):
+            # 跳过采样本身的分配
+            if stat.traceback[-1].filename in (__file__, tracemalloc.__file__):
+                continue
+            stage = 'other'
+            # 从最内层的调用开始找已登记的函数
+            for frame in reversed(stat.traceback):
+                name = self.get_frame_stage(frame.filename, frame.lineno)
+                if name is not None:
+                    stage = name
+                    break
+            totals[stage] += stat.size
+        return totals
+
+    def sample(self):
+        """采样一次，写入时间序列并检测持续增长"""
+        if not tracemalloc.is_tracing():
+            return None
+        sample_start = time.monotonic()
+        snapshot = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        rss = get_rss_bytes() or 0
+        gauges = {name: func() or 0 for name, func in self.gauges.items()}
+
+        # tracemalloc 自身保存跟踪记录的内存也不计入原生内存
+        untraced = rss - traced - tracemalloc.get_tracemalloc_memory() - sum(gauges.values())
+        values = {'rss': rss, 'traced': traced, 'traced_peak': peak, 'untraced': max(0, untraced)}
+        values.update(self.get_stage_bytes(snapshot))
+        values.update(gauges)
+
+        # 采样耗时随存活对象数增长，间隔至少为采样耗时的20倍，开销不超过约5%
+        now = time.monotonic()
+        self.next_sample = now + max(self.interval, 20 * (now - sample_start))
+        growing = []
+        for name, value in values.items():
+            if name in ('traced', 'traced_peak'):
+                continue
+            detector = self.detectors.setdefault(name, GrowthDetector())
+            detector.add(self.images, value)
+            if detector.growing:
+                growing.append(name)
+        # 本次新出现持续增长的列及其增长速度（字节/张），由 on_sample 的调用方决定如何提示
+        newly_growing = {name: self.detectors[name].slope for name in growing
+                         if name not in (self.last_sample or {}).get('growing', [])}
+
+        sample = {
+            'elapsed_s': now - self.start_time,
+            'images': self.images,
+            'values': values,
+            'growing': growing,
+            'newly_growing': newly_growing
+        }
+        self.write_row(sample)
+        self.samples += 1
+        self.last_sample = sample
+        if self.on_sample is not None:
+            self.on_sample(sample)
+        return sample
+
+    def write_row(self, sample):
+        """写入一行时间序列，列在第一次采样时确定"""
+        if self.csv_writer is None:
+            return
+        if self.columns is None:
+            self.columns = list(sample['values'])
+            self.csv_writer.writerow(['elapsed_s', 'images'] + [f"{name}_mb" for name in self.columns] + ['growing'])
+        row = [f"{sample['elapsed_s']:.1f}", sample['images']]
+        row += [f"{sample['values'].get(name, 0) / MB:.2f}" for name in self.columns]
+        row.append('|'.join(sample['growing']))
+        self.csv_writer.writerow(row)
+        self.csv_file.flush()
+
+    def report(self):
+        """各列的最终内存和增长速度（MB/千张）"""
+        if self.last_sample is None:
+            return {}
+        report = {'images': self.images, 'samples': self.samples, 'growing': self.last_sample['growing'],
+                  'series': {}}
+        for name, value in self.last_sample['values'].items():
+            detector = self.detectors.get(name)
+            slope = detector.slope if detector is not None else None
+            report['series'][name] = {
+                'mb': value / MB,
+                'mb_per_1000_images': slope * 1000 / MB if slope is not None else None
+            }
+        return report
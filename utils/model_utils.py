@@ -5,12 +5,55 @@
 """
 
 import os
+import io
 import json
 import cv2
 import numpy as np
 import onnxruntime as ort
 from PIL import Image
 import sys
+from collections import OrderedDict
+from contextlib import nullcontext
+
+try:
+    import onnx
+except ImportError:
+    onnx = None
+
+
+# ImageNet数据集的均值和标准差（按CHW广播）
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
+
+# 模型类型，由输入节点名称确定
+MODEL_KIND_TEXT = 'text_recognition'
+MODEL_KIND_CLASSIFICATION = 'classification'
+MODEL_KINDS = {
+    'TextRecognizerInput': MODEL_KIND_TEXT,
+    'ImageClassificationInput': MODEL_KIND_CLASSIFICATION,
+}
+# 各类型模型单个样本的输入形状 (C, H, W)
+SAMPLE_SHAPES = {
+    MODEL_KIND_TEXT: (3, 48, 320),
+    MODEL_KIND_CLASSIFICATION: (3, 224, 224),
+}
+# 未配置时预热的批大小（文本识别最多拆分为2个片段）
+DEFAULT_BATCH_SIZES = {
+    MODEL_KIND_TEXT: [1, 2],
+    MODEL_KIND_CLASSIFICATION: [1],
+}
+# 缩小解码时需要保留的最小尺寸：文本识别为行高，分类为短边（缩放到256后再中心裁剪）
+DECODE_MIN_SIZES = {
+    MODEL_KIND_TEXT: 48,
+    MODEL_KIND_CLASSIFICATION: 256,
+}
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+# 只有JPEG能在解码时按DCT缩小，其他格式缩小解码仍需完整解码
+REDUCED_DECODE_FORMATS = ('JPEG', 'MPO')
 
 
 def get_resource_path(relative_path):
@@ -25,6 +68,58 @@ def get_resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+class BufferReader(io.RawIOBase):
+    """内存中编码数据的只读文件对象，直接引用原缓冲区（io.BytesIO 会拷贝整个缓冲区），读取时只拷贝请求的部分"""
+
+    def __init__(self, data):
+        super().__init__()
+        self.view = memoryview(data).cast('B')
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.view[self.pos:self.pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self.pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+def read_image_header(data):
+    """只读取图像头，获取格式和尺寸
+        :param data: 编码后的图像数据（支持缓冲区协议的对象），不拷贝
+        :return: (格式, 宽, 高)，EXIF方向为旋转90°时宽高互换；无法识别时返回None
+    """
+    try:
+        # PIL按小段读取图像头，加一层缓冲减少逐次调用的开销
+        with Image.open(io.BufferedReader(BufferReader(data))) as image:
+            width, height = image.size
+            if image.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                width, height = height, width
+            return image.format, width, height
+    except Exception:
+        return None
+
+
+class ImageDecodeError(Exception):
+    """图像读取或解码失败，如文件被截断、尚未写完或已被删除"""
+
+
 class ModelConfig:
     """模型配置类"""
     
@@ -71,6 +166,41 @@ class ModelConfig:
         """获取预处理配置"""
         return self.config['preprocess']
 
+    def get_runtime_config(self):
+        """获取运行时配置（批大小、预热次数等），未配置时返回空字典"""
+        return self.config.get('runtime', {})
+
+
+class BoundBuffers:
+    """某一批形状对应的IOBinding及预分配的输入/输出缓冲区
+
+    输入OrtValue直接引用 self.input 的内存（CPU上零拷贝），预处理写入 self.input 即可；
+    输出在首次推理后绑定到固定内存，之后的推理不再分配新数组。
+    注意：run() 返回的输出数组会在下一次推理时被覆盖。
+    """
+
+    def __init__(self, session, input_names, output_names, shape, dtype=np.float32):
+        self.session = session
+        self.output_names = output_names
+        self.input = np.zeros(shape, dtype=dtype)
+        self.ort_input = ort.OrtValue.ortvalue_from_numpy(self.input)
+        self.binding = session.io_binding()
+        for name in input_names:
+            self.binding.bind_ortvalue_input(name, self.ort_input)
+        for name in output_names:
+            self.binding.bind_output(name, 'cpu')
+        self.outputs = None
+
+    def run(self):
+        """在绑定的缓冲区上运行推理，返回输出数组列表"""
+        self.session.run_with_iobinding(self.binding)
+        if self.outputs is None:
+            # 首次推理由ORT分配输出，随后将输出重新绑定到这块内存上复用
+            self.outputs = [np.ascontiguousarray(output) for output in self.binding.copy_outputs_to_cpu()]
+            for name, output in zip(self.output_names, self.outputs):
+                self.binding.bind_output(name, 'cpu', 0, output.dtype.type, list(output.shape), output.ctypes.data)
+        return self.outputs
+
 
 class ModelLoader:
     """模型加载器"""
@@ -80,40 +210,149 @@ class ModelLoader:
         self.session = None
         self.label_map = {}
         self.config = ModelConfig(config_path)
+        # 按批形状缓存的IOBinding缓冲区；批行数向上取整到分档大小，每个模型只保留少量固定的缓冲区
+        self._bound_buffers = OrderedDict()
+        self.max_bound_shapes = 8
+        # 模型元数据，加载模型时解析一次
+        self.input_names = None
+        self.output_names = None
+        self.model_kind = None
+        self.fixed_batch_size = None
+        # 会话内部线程数，多个模型并发推理时可调小以避免CPU超额占用
+        self.intra_op_num_threads = None
+        # 可选的优先调度器，批处理进行中交互请求在批边界插队
+        self.scheduler = None
 
     def get_input_name(self):
         """获取输入节点名称"""
-        input_name = []
-        for node in self.session.get_inputs():
-            input_name.append(node.name)
-        return input_name
+        if self.input_names is None:
+            self.input_names = [node.name for node in self.session.get_inputs()]
+        return self.input_names
     
     def get_output_name(self):
         """获取输出节点名称"""
-        output_name = []
-        for node in self.session.get_outputs():
-            output_name.append(node.name)
-        return output_name
+        if self.output_names is None:
+            self.output_names = [node.name for node in self.session.get_outputs()]
+        return self.output_names
+
+    def get_model_kind(self):
+        """获取模型类型"""
+        if self.model_kind is None:
+            input_name = self.get_input_name()[0]
+            if input_name not in MODEL_KINDS:
+                raise Exception(f"不支持的模型输入: {input_name}")
+            self.model_kind = MODEL_KINDS[input_name]
+        return self.model_kind
+
+    def get_batch_sizes(self):
+        """获取需要预热的批大小列表"""
+        batch_sizes = self.config.get_runtime_config().get('batch_sizes')
+        if batch_sizes:
+            return [int(b) for b in batch_sizes]
+        return DEFAULT_BATCH_SIZES[self.get_model_kind()]
     
-    def get_input_feed(self, input_name, image_numpy):
-        """
-        input_feed={self.input_name: image_numpy}
-        :param input_name:
-        :param image_numpy:
-        :return:
-        """
-        input_feed = {}
-        for name in input_name:
-            input_feed[name] = image_numpy
-        return input_feed
-        
     def load_model(self):
-        """加载模型"""
+        """加载模型，解析并固定输入输出元数据，随后预热"""
         try:
-            self.session = ort.InferenceSession(self.model_path, None, providers=['CPUExecutionProvider'])
+            # 先不创建会话读取输入元数据，将动态维度固定为预处理实际使用的尺寸，便于ORT按静态形状优化
+            inputs = self.read_model_inputs()
+            self.input_names = [name for name, _ in inputs]
+            self.model_kind = None
+            overrides = self.get_free_dimension_overrides(inputs[0][1])
+
+            self.session = self._create_session(overrides)
+            self._reset_metadata()
+            self.warmup()
             return True
         except Exception as e:
             raise Exception(f"模型加载失败: {str(e)}")
+
+    def _create_session(self, overrides=None):
+        """创建推理会话
+            :param overrides: 动态维度的固定值 {维度名称: 值}
+        """
+        sess_options = ort.SessionOptions()
+        if self.intra_op_num_threads:
+            sess_options.intra_op_num_threads = self.intra_op_num_threads
+        for dim_name, value in (overrides or {}).items():
+            sess_options.add_free_dimension_override_by_name(dim_name, value)
+        return ort.InferenceSession(self.model_path, sess_options, providers=['CPUExecutionProvider'])
+
+    def read_model_inputs(self):
+        """读取模型输入的名称和形状，不创建正式的推理会话
+            :return: [(名称, 形状), ...]，形状中动态维度为维度名称（字符串）
+        """
+        if onnx is not None:
+            # 只解析图结构，外部权重文件不读取
+            graph = onnx.load(self.model_path, load_external_data=False).graph
+            initializers = {initializer.name for initializer in graph.initializer}
+            inputs = []
+            for value in graph.input:
+                if value.name in initializers:
+                    continue
+                shape = [dim.dim_param if dim.HasField('dim_param') else
+                         (dim.dim_value if dim.HasField('dim_value') else None)
+                         for dim in value.type.tensor_type.shape.dim]
+                inputs.append((value.name, shape))
+            return inputs
+
+        # 未安装onnx时用不做图优化的会话读取，开销远小于正式会话
+        sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        session = ort.InferenceSession(self.model_path, sess_options, providers=['CPUExecutionProvider'])
+        return [(node.name, node.shape) for node in session.get_inputs()]
+
+    def _reset_metadata(self):
+        """重新解析当前会话的元数据"""
+        self._bound_buffers.clear()
+        self.input_names = None
+        self.output_names = None
+        self.model_kind = None
+        self.fixed_batch_size = None
+        self.get_input_name()
+        self.get_output_name()
+        self.get_model_kind()
+
+    def get_free_dimension_overrides(self, input_shape):
+        """计算动态维度的固定值
+            空间维度固定为预处理输出尺寸；仅配置了单一批大小时才固定批维度
+            :param input_shape: 模型输入的形状，动态维度为维度名称
+            :return: {维度名称: 值}
+        """
+        runtime_config = self.config.get_runtime_config()
+        if not runtime_config.get('free_dimension_overrides', True):
+            return {}
+
+        batch_sizes = runtime_config.get('batch_sizes') or []
+        batch_value = int(batch_sizes[0]) if len(batch_sizes) == 1 else None
+        wanted = [batch_value] + list(SAMPLE_SHAPES[self.get_model_kind()])
+
+        overrides = {}
+        conflicts = set()
+        for dim, value in zip(input_shape, wanted):
+            # 只有带名称的动态维度可以覆盖
+            if not isinstance(dim, str) or value is None:
+                continue
+            if overrides.get(dim, value) != value:
+                conflicts.add(dim)
+            overrides[dim] = value
+        for dim in conflicts:
+            del overrides[dim]
+        return overrides
+
+    def warmup(self):
+        """用全零张量对各批大小预热，使首张图像的耗时与稳态一致"""
+        runtime_config = self.config.get_runtime_config()
+        warmup_runs = int(runtime_config.get('warmup_runs', 1))
+
+        batch_sizes = self.get_batch_sizes()
+        if len(batch_sizes) == 1 and runtime_config.get('batch_sizes'):
+            self.fixed_batch_size = batch_sizes[0]
+
+        for batch_size in batch_sizes:
+            buffers = self.get_bound_buffers((batch_size,) + self.get_sample_shape())
+            for _ in range(warmup_runs):
+                buffers.run()
     
     def load_label_map(self, label_map_path=None):
         """加载标签映射"""
@@ -124,13 +363,113 @@ class ModelLoader:
             except Exception as e:
                 print(f"标签映射加载失败: {str(e)}")
     
-    def preprocess_image(self, img_path):
-        """预处理图像"""
-        img_array = None
-        input_name = self.get_input_name()[0]
+    def get_bound_buffers(self, shape):
+        """获取（必要时创建）指定批形状的IOBinding缓冲区，按最近使用顺序保留若干个"""
+        shape = tuple(shape)
+        buffers = self._bound_buffers.get(shape)
+        if buffers is None:
+            buffers = BoundBuffers(self.session, self.get_input_name(), self.get_output_name(), shape)
+            self._bound_buffers[shape] = buffers
+            while len(self._bound_buffers) > self.max_bound_shapes:
+                self._bound_buffers.popitem(last=False)
+        else:
+            self._bound_buffers.move_to_end(shape)
+        return buffers
+
+    def get_batch_bucket(self, rows):
+        """批行数对应的缓冲区批大小：批维度固定时为固定批大小，否则取不小于行数的预热批大小或2的幂"""
+        if self.fixed_batch_size:
+            return self.fixed_batch_size
+        bucket = 1 << max(rows - 1, 0).bit_length()
+        return min([b for b in self.get_batch_sizes() if b >= rows] + [bucket])
+
+    def get_sample_shape(self):
+        """获取单个样本的输入形状 (C, H, W)"""
+        return SAMPLE_SHAPES[self.get_model_kind()]
+
+    def read_image_data(self, img_path):
+        """读取编码后的图像数据
+            :param img_path: 图像文件路径，或已编码图像数据（bytes/memoryview/一维uint8数组等支持缓冲区协议的对象，
+                如归档成员、HTTP上传的文件）
+            :return: uint8数组，内存中的数据直接引用，不拷贝
+        """
+        if isinstance(img_path, (str, os.PathLike)):
+            try:
+                return np.fromfile(img_path, dtype=np.uint8)
+            except OSError as e:
+                raise ImageDecodeError(f"图像读取失败: {e.strerror or e}")
+        return np.frombuffer(img_path, dtype=np.uint8)
+
+    def is_tensor_input(self, source):
+        """是否为已预处理好的输入数组：float32，形状为 (C, H, W) 或 [n, C, H, W]"""
+        return (isinstance(source, np.ndarray) and source.dtype == np.float32 and source.ndim in (3, 4)
+                and source.shape[-3:] == self.get_sample_shape())
+
+    @staticmethod
+    def is_image_array(source):
+        """是否为已解码的图像数组（HxW 或 HxWxC）；一维uint8数组按编码数据处理"""
+        return isinstance(source, np.ndarray) and source.ndim in (2, 3)
+
+    @staticmethod
+    def to_bgr(img):
+        """检查已解码的图像数组，灰度和带透明通道的图像转换为3通道BGR，其他情况直接使用，不拷贝"""
+        if img.dtype != np.uint8:
+            raise Exception(f"图像数组应为uint8类型，实际为 {img.dtype}")
+        if img.ndim == 2 or img.shape[2] == 1:
+            return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        if img.shape[2] == 4:
+            return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+        if img.shape[2] != 3:
+            raise Exception(f"不支持的图像通道数: {img.shape[2]}")
+        # 视频帧的裁剪区域等非连续视图才需要拷贝
+        return img if img.flags.c_contiguous else np.ascontiguousarray(img)
+
+    def use_reduced_decode(self):
+        """是否在解码时缩小大图（运行时配置 reduced_decode，默认开启）"""
+        return bool(self.config.get_runtime_config().get('reduced_decode', True))
+
+    def get_decode_flag(self, data):
+        """根据图像头选择解码标志：JPEG取缩小后仍不小于目标尺寸的最大倍数"""
+        header = read_image_header(data)
+        if header is None or header[0] not in REDUCED_DECODE_FORMATS:
+            return cv2.IMREAD_COLOR
+        _, width, height = header
+        model_kind = self.get_model_kind()
+        size = height if model_kind == MODEL_KIND_TEXT else min(width, height)
+        for scale, flag in REDUCED_DECODE_FLAGS:
+            if size / scale >= DECODE_MIN_SIZES[model_kind]:
+                return flag
+        return cv2.IMREAD_COLOR
+
+    def decode_image_data(self, data, reduced=True):
+        """解码 read_image_data 读取的数据（BGR）
+            :param reduced: 是否允许按模型输入尺寸缩小解码（整页检测等需要原图时传False）
+        """
+        flag = cv2.IMREAD_COLOR
+        if reduced and self.use_reduced_decode():
+            flag = self.get_decode_flag(data)
+        img = cv2.imdecode(data, flag)
+        if img is None:
+            raise ImageDecodeError("图像解码失败")
+        return img
+
+    def decode_image(self, img_path, reduced=True):
+        """读取并解码图像（BGR）
+            :param img_path: 图像文件路径、已编码图像数据（见 read_image_data），
+                或已解码的图像数组（HxW 或 HxWx3/4，uint8，BGR顺序，与 cv2.imread 相同，如视频帧、相机缓冲区）
+        """
+        if self.is_image_array(img_path):
+            return self.to_bgr(img_path)
+        return self.decode_image_data(self.read_image_data(img_path), reduced)
+
+    def prepare_image(self, img):
+        """完成与归一化无关的缩放、裁剪
+            :param img: 解码后的图像
+            :return: (中间结果, 该图像占用的batch行数)
+        """
+        model_kind = self.get_model_kind()
 
-        img = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_COLOR)
-        if input_name == 'TextRecognizerInput':
+        if model_kind == MODEL_KIND_TEXT:
             img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)  # 转换为BGR
 
             h, w = img.shape[:2]
@@ -139,49 +478,22 @@ class ModelLoader:
             target_height, target_width = 48, 320
 
             new_w = int(np.ceil(target_height * ratio))
+            resized_img = cv2.resize(img, (new_w, target_height))
             if new_w > target_width:
-                resized_img = cv2.resize(img, (new_w, target_height))
                 # 如果宽度超过320，拆分为多个片段
-                img_arrays = []
+                segments = []
 
                 start_x = 0
                 end_x = min(target_width, new_w)
                 while start_x < end_x:
-                    # 裁剪当前片段
-                    segment = resized_img[:, start_x:end_x, :]
-                    
-                    # 如果片段宽度不足320，进行填充
-                    if segment.shape[1] < target_width:
-                        padded_segment = np.zeros((target_height, target_width, 3), dtype=np.uint8)
-                        padded_segment[:, :segment.shape[1], :] = segment
-                        segment = padded_segment
-                    
-                    # 转换为CHW格式并归一化
-                    segment_array = segment.transpose(2, 0, 1)  # HWC转换为CHW格式
-                    segment_array = segment_array.astype(np.float32) / 255.0
-                    segment_array = (segment_array - 0.5) / 0.5
-                    
-                    img_arrays.append(segment_array)
+                    segments.append(resized_img[:, start_x:end_x, :])
 
                     start_x = end_x
                     end_x = min(target_width + target_width, new_w)
-                
-                # 组成batch
-                img_array = np.stack(img_arrays, axis=0)  # 添加batch维度
             else:
-                # 正常处理
-                resized_img = cv2.resize(img, (new_w, target_height))
-                padded_img = np.zeros((target_height, target_width, 3), dtype=np.uint8)
-                padded_img[:, :new_w, :] = resized_img
-
-                img_array = padded_img.transpose(2, 0, 1) # HWC转换为CHW格式
-
-                # 归一化到[-1, 1]
-                img_array = img_array.astype(np.float32) / 255.0
-                img_array = (img_array - 0.5) / 0.5
-
-                img_array = img_array[np.newaxis, ...] # 添加batch维度
-        elif input_name == 'ImageClassificationInput':
+                segments = [resized_img]
+            return segments, len(segments)
+        elif model_kind == MODEL_KIND_CLASSIFICATION:
             # 将输入图像的最小边（宽或高）缩放到256像素，同时保持原始宽高比
             def image_resize(image, min_len):
                 image = Image.fromarray(image)
@@ -203,56 +515,200 @@ class ModelLoader:
                 return image[start_y:start_y + crop_h, start_x:start_x + crop_w, :]
 
             image = crop_center(image, 224, 224)
-
+            return image, 1
+
+    def fill_input(self, prepared, out):
+        """将 prepare_image 的结果归一化后直接写入 out（形状为 [n, C, H, W] 的float32数组）"""
+        model_kind = self.get_model_kind()
+
+        if model_kind == MODEL_KIND_TEXT:
+            for i, segment in enumerate(prepared):
+                # HWC转换为CHW格式写入，宽度不足320的部分填充0
+                seg_w = segment.shape[1]
+                out[i, :, :, :seg_w] = segment.transpose(2, 0, 1)
+                out[i, :, :, seg_w:] = 0
+            # 归一化到[-1, 1]，即 (x / 255 - 0.5) / 0.5
+            rows = out[:len(prepared)]
+            rows *= 2.0 / 255.0
+            rows -= 1.0
+        elif model_kind == MODEL_KIND_CLASSIFICATION:
             # 将图像从HWC格式（高度、宽度、通道）转换为CHW格式（通道、高度、宽度）
-            image = image.transpose(2, 0, 1)
-
-            # 将像素值从uint8转换为float32类型
-            img_data = image.astype('float32')
+            sample = out[0]
+            sample[...] = prepared.transpose(2, 0, 1)
 
             # 先除以255将像素值缩放到[0,1]范围, 然后使用ImageNet数据集的均值和标准差进行标准化
-            mean_vec = np.array([0.485, 0.456, 0.406])
-            stddev_vec = np.array([0.229, 0.224, 0.225])
-            norm_img_data = np.zeros(img_data.shape).astype('float32')
-            for i in range(img_data.shape[0]):
-                norm_img_data[i, :, :] = (img_data[i, :, :] / 255 - mean_vec[i]) / stddev_vec[i]
-
-            # add batch channel
-            norm_img_data = norm_img_data.reshape(1, 3, 224, 224).astype('float32')
-            img_array = norm_img_data
+            sample /= 255.0
+            sample -= IMAGENET_MEAN
+            sample /= IMAGENET_STD
+
+    def preprocess_image(self, img_path):
+        """预处理图像，返回新分配的输入数组
+            :param img_path: 图像文件路径、已编码图像数据或已解码的图像数组（见 decode_image）
+        """
+        return self.preprocess_decoded(self.decode_image(img_path))
+
+    def preprocess_decoded(self, img):
+        """预处理已解码的图像，返回新分配的输入数组"""
+        prepared, rows = self.prepare_image(img)
+        img_array = np.empty((rows,) + self.get_sample_shape(), dtype=np.float32)
+        self.fill_input(prepared, img_array)
         return img_array
     
-    def predict(self, img_path):
-        """进行预测"""
+    def predict(self, img_path, interactive=False):
+        """进行预测
+            :param img_path: 图像文件路径，也可以是 predict_sources 支持的内存数据
+            :return: (预测结果, 置信度)
+        """
+        result = self.predict_sources([img_path], interactive=interactive)[0]
+        return result['prediction'], result['confidence']
+
+    def predict_sources(self, sources, keys=None, interactive=False):
+        """对内存中或磁盘上的一批图像进行预测，尽量合并为一次推理，无需先写入临时文件
+            :param sources: 每项可以是：
+                - 图像文件路径
+                - 已编码图像数据：bytes/memoryview/一维uint8数组等支持缓冲区协议的对象（不拷贝）
+                - 已解码的图像数组：HxW 或 HxWx3/4，uint8，BGR顺序（不拷贝）
+                - 已预处理好的输入数组：float32，形状为 (C, H, W) 或 [n, C, H, W]，直接写入输入缓冲区
+            :param keys: 与 sources 一一对应的标识（如帧号、请求ID），原样放入结果；默认为序号
+            :param interactive: 是否为交互请求
+            :return: [{'key': 标识, 'prediction': 预测结果, 'confidence': 置信度}, ...]
+        """
+        if self.session is None:
+            raise Exception("模型未加载")
+        if keys is None:
+            keys = range(len(sources))
+        elif len(keys) != len(sources):
+            raise Exception(f"keys 数量（{len(keys)}）与 sources 数量（{len(sources)}）不一致")
+
+        # 图像和预处理好的数组可以混在同一批，按类型写入缓冲区
+        items = []
+        for source in sources:
+            if self.is_tensor_input(source):
+                array = source if source.ndim == 4 else source[np.newaxis]
+                items.append(((None, array), array.shape[0]))
+            else:
+                prepared, rows = self.prepare_image(self.decode_image(source))
+                items.append(((prepared, None), rows))
+
+        def fill_source(data, out):
+            prepared, array = data
+            if array is None:
+                self.fill_input(prepared, out)
+            else:
+                np.copyto(out, array)
+
+        predictions = self._run_batches(items, fill_source, interactive)
+        return [{'key': key, 'prediction': prediction, 'confidence': confidence}
+                for key, (prediction, confidence) in zip(keys, predictions)]
+
+    def predict_image(self, img, interactive=False):
+        """对已解码的单张图像进行预测"""
+        return self.predict_images([img], interactive)[0]
+
+    def get_preprocess_plan(self):
+        """获取预处理方案标识，方案相同的模型可以共用同一份预处理结果"""
+        return (self.get_model_kind(),) + self.get_sample_shape() + (self.use_reduced_decode(),)
+
+    def predict_images(self, images, interactive=False):
+        """对已解码的一批图像进行预测，尽量合并为一次推理
+            :param images: 解码后的图像列表
+            :param interactive: 是否为交互请求（设置了调度器时优先于批处理执行）
+            :return: [(预测结果, 置信度), ...]
+        """
         if self.session is None:
             raise Exception("模型未加载")
-        
-        # 预处理图像
-        processed_img = self.preprocess_image(img_path)
-        
-        # 运行推理
-        input_name = self.get_input_name()
-        output_name = self.get_output_name()
-
-        input_feed = self.get_input_feed(input_name, processed_img)
-
-        outputs = self.session.run(output_name, input_feed=input_feed)
-        # 处理结果
-        prediction, confidence = self.process_output(outputs[0])
-        
-        return prediction, confidence
+
+        # 预处理直接写入已绑定的输入缓冲区
+        return self._run_batches([self.prepare_image(img) for img in images], self.fill_input, interactive)
+
+    def predict_arrays(self, arrays, interactive=False):
+        """对已预处理好的输入数组进行预测（如多模型共用的预处理结果）
+            :param arrays: 形状为 [n, C, H, W] 的float32数组列表，每个数组对应一张图像
+            :param interactive: 是否为交互请求
+            :return: [(预测结果, 置信度), ...]
+        """
+        if self.session is None:
+            raise Exception("模型未加载")
+
+        def copy_input(array, out):
+            np.copyto(out, array)
+
+        return self._run_batches([(array, array.shape[0]) for array in arrays], copy_input, interactive)
+
+    def run_slot(self, interactive=False):
+        """取得一批推理的执行权，未设置调度器时不做限制"""
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(interactive)
+
+    def _run_batches(self, items, fill, interactive=False):
+        """按批运行推理
+            :param items: [(待写入的数据, 占用的batch行数), ...]
+            :param fill: 将数据写入输入缓冲区的函数 fill(数据, 缓冲区切片)
+            :param interactive: 是否为交互请求
+        """
+        limit = self.fixed_batch_size
+        results = []
+        start = 0
+        while start < len(items):
+            if limit and items[start][1] > limit:
+                # 单张图像的行数超过固定批大小（如宽文本行拆分出的多个片段），分几次推理后拼接输出
+                results.append(self._run_split(items[start], fill, interactive))
+                start += 1
+                continue
+
+            # 批维度已固定时按固定批大小分组；缓冲区按分档大小分配，不足的部分保持填充，输出只取有效行
+            end = start
+            rows = 0
+            while end < len(items) and (not limit or end == start or rows + items[end][1] <= limit):
+                rows += items[end][1]
+                end += 1
+
+            # 缓冲区在各请求间共用，写入、推理和解析输出都在执行权内完成
+            with self.run_slot(interactive):
+                buffers = self.get_bound_buffers((self.get_batch_bucket(rows),) + self.get_sample_shape())
+                row_ranges = []
+                offset = 0
+                for data, n in items[start:end]:
+                    fill(data, buffers.input[offset:offset + n])
+                    row_ranges.append((offset, offset + n))
+                    offset += n
+
+                # 运行推理并按图像拆分输出
+                outputs = buffers.run()
+                for row_start, row_end in row_ranges:
+                    results.append(self.process_output(outputs[0][row_start:row_end]))
+            start = end
+        return results
     
+    def _run_split(self, item, fill, interactive=False):
+        """对行数超过固定批大小的单张图像分几次推理，拼接各次的输出后再解析"""
+        data, rows = item
+        limit = self.fixed_batch_size
+        sample_shape = self.get_sample_shape()
+        inputs = np.empty((rows,) + sample_shape, dtype=np.float32)
+        fill(data, inputs)
+        outputs = []
+        for row_start in range(0, rows, limit):
+            chunk = inputs[row_start:row_start + limit]
+            with self.run_slot(interactive):
+                buffers = self.get_bound_buffers((limit,) + sample_shape)
+                buffers.input[:len(chunk)] = chunk
+                # 输出缓冲区在各次推理间复用，需要复制
+                outputs.append(buffers.run()[0][:len(chunk)].copy())
+        return self.process_output(np.concatenate(outputs))
+
     def process_output(self, output, is_remove_duplicate=True):
         """处理模型输出
             :param output: 模型输出
             :param is_remove_duplicate: 是否去除重复
             :return: 预测结果
         """
-        input_name = self.get_input_name()[0]
+        model_kind = self.get_model_kind()
         text = ''
         conf = 0.0
 
-        if input_name == 'TextRecognizerInput':
+        if model_kind == MODEL_KIND_TEXT:
             preds_idx = output.argmax(axis=2) # 取每个时间步（seq_len）上概率最大的类别索引，得到每个字符的预测类别，shape为[batch, seq_len]
             preds_prob = output.max(axis=2) # 取每个时间步（seq_len）上概率最大的概率值，得到每个字符的置信度，shape为[batch, seq_len]
 
@@ -283,7 +739,7 @@ class ModelLoader:
             # 合并所有片段的结果
             text = ''.join(all_texts)
             conf = float(np.mean(all_confs)) if all_confs else 0.0
-        elif input_name == 'ImageClassificationInput':
+        elif model_kind == MODEL_KIND_CLASSIFICATION:
             idx = output.argmax()
             text = self.config.classDict[idx]
 
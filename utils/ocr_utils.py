@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+整页OCR模块：文本检测（DB概率图）+ 批量文本行识别
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+from utils.model_utils import IMAGENET_MEAN, IMAGENET_STD, MODEL_KIND_TEXT, ImageDecodeError
+
+
+class TextDetector:
+    """DB类文本检测模型，输出概率图并提取文本框"""
+
+    def __init__(self, model_path, limit_side_len=960, thresh=0.3, box_thresh=0.6,
+                 unclip_ratio=1.5, min_size=3, max_candidates=1000):
+        self.model_path = model_path
+        self.limit_side_len = limit_side_len
+        self.thresh = thresh
+        self.box_thresh = box_thresh
+        self.unclip_ratio = unclip_ratio
+        self.min_size = min_size
+        self.max_candidates = max_candidates
+        self.session = None
+        self.input_name = None
+        # 会话内部线程数，多个检测线程共用会话时调小以避免CPU超额占用
+        self.intra_op_num_threads = None
+
+    def load_model(self):
+        """加载检测模型"""
+        try:
+            sess_options = ort.SessionOptions()
+            if self.intra_op_num_threads:
+                sess_options.intra_op_num_threads = self.intra_op_num_threads
+            self.session = ort.InferenceSession(self.model_path, sess_options, providers=['CPUExecutionProvider'])
+            self.input_name = self.session.get_inputs()[0].name
+            return True
+        except Exception as e:
+            raise Exception(f"检测模型加载失败: {str(e)}")
+
+    def preprocess(self, img):
+        """缩放到32的倍数（长边不超过 limit_side_len）并标准化
+            :return: (输入张量, 高方向缩放比, 宽方向缩放比)
+        """
+        h, w = img.shape[:2]
+        ratio = min(1.0, float(self.limit_side_len) / max(h, w))
+        resize_h = max(32, int(round(h * ratio / 32)) * 32)
+        resize_w = max(32, int(round(w * ratio / 32)) * 32)
+        resized = cv2.resize(img, (resize_w, resize_h))
+
+        tensor = np.empty((1, 3, resize_h, resize_w), dtype=np.float32)
+        tensor[0] = resized.transpose(2, 0, 1)
+        tensor[0] /= 255.0
+        tensor[0] -= IMAGENET_MEAN
+        tensor[0] /= IMAGENET_STD
+        return tensor, resize_h / float(h), resize_w / float(w)
+
+    def detect(self, img):
+        """检测文本框
+            :param img: 解码后的BGR图像
+            :return: [(4x2的框坐标（原图坐标，顺时针从左上开始）, 得分), ...]
+        """
+        if self.session is None:
+            raise Exception("检测模型未加载")
+        tensor, ratio_h, ratio_w = self.preprocess(img)
+        prob_map = self.session.run(None, {self.input_name: tensor})[0][0, 0]
+        boxes = self.boxes_from_bitmap(prob_map, prob_map > self.thresh)
+
+        h, w = img.shape[:2]
+        results = []
+        for box, score in boxes:
+            box[:, 0] = np.clip(box[:, 0] / ratio_w, 0, w - 1)
+            box[:, 1] = np.clip(box[:, 1] / ratio_h, 0, h - 1)
+            results.append((box, score))
+        return results
+
+    def boxes_from_bitmap(self, prob_map, bitmap):
+        """从二值图中提取最小外接矩形，按平均概率过滤后向外扩张"""
+        contours, _ = cv2.findContours((bitmap * 255).astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for contour in contours[:self.max_candidates]:
+            rect = cv2.minAreaRect(contour)
+            if min(rect[1]) < self.min_size:
+                continue
+            score = self.box_score(prob_map, cv2.boxPoints(rect))
+            if score < self.box_thresh:
+                continue
+
+            # 按DB的做法以 面积 * unclip_ratio / 周长 的距离向外扩张
+            (cx, cy), (rw, rh), angle = rect
+            distance = rw * rh * self.unclip_ratio / max(1e-6, 2 * (rw + rh))
+            expanded = ((cx, cy), (rw + 2 * distance, rh + 2 * distance), angle)
+            if min(expanded[1]) < self.min_size + 2:
+                continue
+            boxes.append((order_points(cv2.boxPoints(expanded)), score))
+        return boxes
+
+    @staticmethod
+    def box_score(prob_map, box):
+        """计算框内概率的平均值"""
+        h, w = prob_map.shape
+        xmin = int(np.clip(np.floor(box[:, 0].min()), 0, w - 1))
+        xmax = int(np.clip(np.ceil(box[:, 0].max()), 0, w - 1))
+        ymin = int(np.clip(np.floor(box[:, 1].min()), 0, h - 1))
+        ymax = int(np.clip(np.ceil(box[:, 1].max()), 0, h - 1))
+        mask = np.zeros((ymax - ymin + 1, xmax - xmin + 1), dtype=np.uint8)
+        shifted = box.copy()
+        shifted[:, 0] -= xmin
+        shifted[:, 1] -= ymin
+        cv2.fillPoly(mask, [shifted.astype(np.int32)], 1)
+        return cv2.mean(prob_map[ymin:ymax + 1, xmin:xmax + 1], mask)[0]
+
+
+def order_points(points):
+    """将四个角点排列为 左上、右上、右下、左下"""
+    points = np.asarray(points, dtype=np.float32)
+    ordered = np.zeros((4, 2), dtype=np.float32)
+    s = points.sum(axis=1)
+    d = np.diff(points, axis=1).ravel()
+    ordered[0] = points[np.argmin(s)]
+    ordered[2] = points[np.argmax(s)]
+    ordered[1] = points[np.argmin(d)]
+    ordered[3] = points[np.argmax(d)]
+    return ordered
+
+
+def crop_text_region(img, box):
+    """透视变换裁剪文本框，竖排的窄长区域旋转为横排"""
+    width = int(max(np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[2] - box[3])))
+    height = int(max(np.linalg.norm(box[0] - box[3]), np.linalg.norm(box[1] - box[2])))
+    width, height = max(1, width), max(1, height)
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    matrix = cv2.getPerspectiveTransform(box.astype(np.float32), target)
+    crop = cv2.warpPerspective(img, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE,
+                               flags=cv2.INTER_CUBIC)
+    if height / float(width) >= 1.5:
+        crop = np.rot90(crop)
+    return np.ascontiguousarray(crop)
+
+
+def sort_reading_order(boxes):
+    """按阅读顺序（从上到下、同一行从左到右）排列文本框
+        :param boxes: 4x2的框坐标列表
+        :return: 按行分组的框下标 [[行内下标, ...], ...]
+    """
+    if not boxes:
+        return []
+    centers = [(box[:, 1].mean(), box[:, 0].min(), box[:, 1].max() - box[:, 1].min()) for box in boxes]
+    order = sorted(range(len(boxes)), key=lambda i: (centers[i][0], centers[i][1]))
+
+    lines = []
+    line_center = None
+    for i in order:
+        y, x, h = centers[i]
+        # 中心高度差小于半个框高视为同一行
+        if lines and abs(y - line_center) < max(1.0, h / 2):
+            lines[-1].append(i)
+        else:
+            lines.append([i])
+            line_center = y
+    return [sorted(line, key=lambda i: centers[i][1]) for line in lines]
+
+
+class PageOCRPipeline:
+    """整页OCR流水线
+
+    检测在线程池中进行（解码、检测、裁剪），识别在调用线程中按批进行，
+    检测下一页的同时识别已裁剪好的文本行，两个阶段相互重叠。
+    来自多个页面的文本行按宽高比排序后组成批次送入识别模型。
+    det_workers 默认为CPU核数。
+    """
+
+    def __init__(self, detector, recognizer, det_workers=None, rec_batch_size=16):
+        if recognizer.get_model_kind() != MODEL_KIND_TEXT:
+            raise Exception("整页OCR需要文本识别模型")
+        self.detector = detector
+        self.recognizer = recognizer
+        self.det_workers = det_workers or os.cpu_count() or 1
+        self.rec_batch_size = rec_batch_size
+
+    def _detect_page(self, source):
+        """解码、检测并裁剪一页（在检测线程中运行）"""
+        decode_start = time.perf_counter()
+        # 检测需要整页原图，不按识别模型的行高缩小解码
+        img = self.recognizer.decode_image(source, reduced=False)
+        decode_ms = (time.perf_counter() - decode_start) * 1000
+
+        detect_start = time.perf_counter()
+        detections = self.detector.detect(img)
+        boxes = [box for box, _ in detections]
+        crops = [crop_text_region(img, box) for box in boxes]
+        detect_ms = (time.perf_counter() - detect_start) * 1000
+        return boxes, crops, decode_ms, detect_ms
+
+    def recognize_page(self, source, interactive=False):
+        """单独识别一页（如批处理进行中的交互请求），不经过流水线"""
+        boxes, crops, decode_ms, detect_ms = self._detect_page(source)
+        infer_start = time.perf_counter()
+        texts = self.recognizer.predict_images(crops, interactive) if crops else []
+        page = {
+            'image_path': source,
+            'boxes': boxes,
+            'texts': texts,
+            'decode_ms': decode_ms,
+            'detect_ms': detect_ms,
+            'infer_ms': (time.perf_counter() - infer_start) * 1000
+        }
+        return self._finish_page(page)
+
+    def _recognize(self, pending):
+        """识别一批文本行，pending 为 [(页面, 行下标, 裁剪图), ...]"""
+        infer_start = time.perf_counter()
+        try:
+            predictions = self.recognizer.predict_images([crop for _, _, crop in pending])
+        except Exception as e:
+            for page, _, _ in pending:
+                page['error'] = str(e)
+                page['remaining'] -= 1
+            return
+        elapsed_ms = (time.perf_counter() - infer_start) * 1000
+        for (page, index, _), prediction in zip(pending, predictions):
+            page['texts'][index] = prediction
+            page['remaining'] -= 1
+            page['infer_ms'] += elapsed_ms / len(pending)
+
+    @staticmethod
+    def _finish_page(page):
+        """按阅读顺序组装整页文本"""
+        lines = []
+        text_lines = []
+        confs = []
+        for line in sort_reading_order(page['boxes']):
+            parts = []
+            for i in line:
+                text, conf = page['texts'][i]
+                lines.append({'box': page['boxes'][i].tolist(), 'text': text, 'confidence': conf})
+                if text:
+                    parts.append(text)
+                    confs.append(conf)
+            if parts:
+                text_lines.append(' '.join(parts))
+        return {
+            'image_path': page['image_path'],
+            'prediction': '\n'.join(text_lines),
+            'confidence': float(np.mean(confs)) if confs else 0.0,
+            'status': '成功',
+            'lines': lines,
+            'decode_ms': page['decode_ms'],
+            'infer_ms': page['detect_ms'] + page['infer_ms']
+        }
+
+    def iter_pages(self, sources):
+        """逐页生成OCR结果（保持输入顺序）
+            :param sources: 可迭代的 (图像路径, 数据来源)
+        """
+        sources = iter(sources)
+        pages = deque()
+        pending = []
+        max_in_flight = self.det_workers * 2
+
+        with ThreadPoolExecutor(max_workers=self.det_workers) as executor:
+            def submit_next():
+                for img_path, source in sources:
+                    # 归档成员的内存视图在迭代后失效，先复制；路径、bytes和已解码的图像数组直接使用
+                    data = bytes(source) if isinstance(source, memoryview) else source
+                    pages.append({'image_path': img_path, 'future': executor.submit(self._detect_page, data)})
+                    return True
+                return False
+
+            while len(pages) < max_in_flight and submit_next():
+                pass
+
+            while pages:
+                # 取出已完成检测的页面中的文本行
+                for page in pages:
+                    future = page.get('future')
+                    if future is None or not future.done():
+                        continue
+                    page.pop('future')
+                    try:
+                        boxes, crops, decode_ms, detect_ms = future.result()
+                    except Exception as e:
+                        page.update(error=str(e), remaining=0, decode_failed=isinstance(e, ImageDecodeError))
+                        continue
+                    page.update(boxes=boxes, texts=[None] * len(boxes), remaining=len(boxes),
+                                decode_ms=decode_ms, detect_ms=detect_ms, infer_ms=0.0)
+                    pending.extend((page, i, crop) for i, crop in enumerate(crops))
+
+                # 宽高比相近（拆分片段数相同）的行放在同一批
+                pending.sort(key=lambda item: item[2].shape[1] / float(item[2].shape[0]))
+                while len(pending) >= self.rec_batch_size:
+                    self._recognize(pending[:self.rec_batch_size])
+                    del pending[:self.rec_batch_size]
+                detecting = [page for page in pages if 'future' in page]
+                if pending and not detecting:
+                    # 没有正在检测的页面，剩余的文本行不足一批也直接识别
+                    self._recognize(pending)
+                    pending = []
+
+                # 按输入顺序产出已完成的页面，并补充新的检测任务
+                yielded = False
+                while pages and 'future' not in pages[0] and pages[0]['remaining'] == 0:
+                    page = pages.popleft()
+                    if 'error' in page:
+                        yield {
+                            'image_path': page['image_path'],
+                            'prediction': '错误',
+                            'confidence': 0.0,
+                            'status': f"失败: {page['error']}",
+                            'decode_failed': page.get('decode_failed', False)
+                        }
+                    else:
+                        yield self._finish_page(page)
+                    submit_next()
+                    yielded = True
+
+                if not yielded and detecting:
+                    # 暂时没有可产出的页面，等待任一检测任务完成
+                    wait([page['future'] for page in detecting], return_when=FIRST_COMPLETED)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推理调度模块：批处理进行中，交互请求（如点击缩略图识别单张）在下一个批边界插队执行
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+
+class PriorityScheduler:
+    """共享会话前的两级优先调度
+
+    每一批推理（写入输入缓冲区、运行会话、解析输出）都需要先取得执行权，同一时刻只有一批在执行。
+    有交互请求等待时，批处理在当前批结束后让出执行权，交互请求最多等待一批的推理耗时。
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.busy = False
+        self.waiting_interactive = 0
+        # 统计
+        self.interactive_count = 0
+        self.interactive_wait_seconds = 0.0
+
+    @contextmanager
+    def slot(self, interactive=False):
+        """取得执行权
+            :param interactive: 是否为交互请求，交互请求优先于批处理
+        """
+        wait_start = time.perf_counter()
+        with self.condition:
+            if interactive:
+                self.waiting_interactive += 1
+                while self.busy:
+                    self.condition.wait()
+                self.waiting_interactive -= 1
+                self.interactive_count += 1
+                self.interactive_wait_seconds += time.perf_counter() - wait_start
+            else:
+                while self.busy or self.waiting_interactive:
+                    self.condition.wait()
+            self.busy = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目录监视模块：发现新写入的图像文件并按小批交给识别任务
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from utils.archive_utils import is_image_file, is_archive
+
+
+# inotify事件掩码（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def load_inotify():
+    """通过ctypes加载libc中的inotify函数，不支持时返回None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def is_watch_candidate(name):
+    """判断文件名是否需要识别（跳过隐藏文件和写入中的临时文件）"""
+    if name.startswith('.') or name.endswith(('.tmp', '.part', '.crdownload')):
+        return False
+    return is_image_file(name) or is_archive(name)
+
+
+class FolderWatcher:
+    """目录监视器
+
+    Linux下使用inotify，文件关闭写入（IN_CLOSE_WRITE）或移入（IN_MOVED_TO）后立即视为就绪；
+    其他平台或inotify不可用时定期扫描目录，文件大小和修改时间在 settle_seconds 内不再变化才视为就绪。
+    写入中途停顿的文件可能被提前交出，识别时读取或解码失败的文件通过 retry() 放回，
+    等待时间逐次加倍，最多重试 max_retries 次。
+    只监视目录本身，不包含子目录。
+    """
+
+    def __init__(self, directory, poll_interval=0.5, settle_seconds=0.3, include_existing=False,
+                 use_inotify=True, max_retries=5):
+        self.directory = os.path.abspath(directory)
+        if not os.path.isdir(self.directory):
+            raise Exception(f"监视目录不存在: {directory}")
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.max_retries = max_retries
+        # 已交给识别的文件 -> (大小, 修改时间)，文件被重写后会再次识别，文件删除后移除
+        self.processed = {}
+        # 等待写完的文件 -> (大小, 修改时间, 最近一次变化的时间)
+        self.candidates = {}
+        # 识别失败放回等待的文件 -> 已重试次数
+        self.retries = {}
+        self.next_scan = 0.0
+        self.fd = None
+
+        libc = load_inotify() if use_inotify else None
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM
+            if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) >= 0:
+                self.fd = fd
+            elif fd >= 0:
+                os.close(fd)
+        if self.fd is None and use_inotify:
+            print("inotify不可用，改为定期扫描目录")
+
+        if include_existing:
+            self._scan(time.monotonic())
+        else:
+            # 已存在的文件视为已处理
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and is_watch_candidate(entry.name):
+                    self.processed[entry.path] = self._signature(entry.stat())
+
+    @property
+    def mode(self):
+        """监视方式"""
+        return 'inotify' if self.fd is not None else 'polling'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    @staticmethod
+    def _signature(stat):
+        return stat.st_size, stat.st_mtime_ns
+
+    def _scan(self, now):
+        """扫描目录，登记新出现或被修改的文件，移除已删除文件的记录"""
+        present = set()
+        for entry in os.scandir(self.directory):
+            if not is_watch_candidate(entry.name):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                signature = self._signature(entry.stat())
+            except OSError:
+                continue
+            present.add(entry.path)
+            if self.processed.get(entry.path) == signature:
+                continue
+            previous = self.candidates.get(entry.path)
+            if previous is None or previous[:2] != signature:
+                self.candidates[entry.path] = signature + (now,)
+        for path in [path for path in self.processed if path not in present]:
+            self.forget(path)
+        for path in [path for path in self.candidates if path not in present]:
+            self.forget(path)
+        self.next_scan = now + self.poll_interval
+
+    def forget(self, path):
+        """移除已删除文件的记录"""
+        self.processed.pop(path, None)
+        self.candidates.pop(path, None)
+        self.retries.pop(path, None)
+
+    def retry(self, path):
+        """将识别时读取或解码失败的文件放回等待（可能还没写完），文件再次稳定后重新交出
+            :return: 是否已放回；重试次数用完时返回False，由调用方记录失败
+        """
+        if path in self.candidates:
+            # 已在等待（如同一归档的多个成员失败，或文件又被修改），不重复计数
+            return True
+        retries = self.retries.get(path, 0)
+        if retries >= self.max_retries:
+            self.retries.pop(path, None)
+            return False
+        try:
+            signature = self._signature(os.stat(path))
+        except OSError:
+            # 文件已被删除，不再识别
+            self.forget(path)
+            return True
+        self.retries[path] = retries + 1
+        self.processed.pop(path, None)
+        # 等待时间逐次加倍：settle_seconds、2倍、4倍……
+        self.candidates[path] = signature + (time.monotonic() + self.settle_seconds * (2 ** retries - 1),)
+        return True
+
+    def is_unchanged(self, path):
+        """文件交出后大小和修改时间是否未再变化"""
+        try:
+            return self.processed.get(path) == self._signature(os.stat(path))
+        except OSError:
+            return False
+
+    def done(self, path):
+        """文件已识别完成，清除重试计数"""
+        self.retries.pop(path, None)
+
+    def _take_stable(self, now):
+        """取出大小和修改时间已稳定的候选文件"""
+        ready = []
+        for path, (size, mtime, changed) in list(self.candidates.items()):
+            if size > 0 and now - changed >= self.settle_seconds:
+                del self.candidates[path]
+                self.processed[path] = (size, mtime)
+                ready.append(path)
+        return ready
+
+    def _read_events(self):
+        """读取inotify事件，返回已写完的文件；队列溢出时返回None（需要重新扫描）"""
+        ready = []
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif mask & IN_ISDIR or not is_watch_candidate(name):
+                    continue
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    path = os.path.join(self.directory, name)
+                    self.forget(path)
+                    if path in ready:
+                        ready.remove(path)
+                else:
+                    ready.append(os.path.join(self.directory, name))
+        return None if overflow else ready
+
+    def poll(self, timeout):
+        """等待至多 timeout 秒，返回已就绪（写完）的文件路径列表"""
+        if self.fd is not None:
+            readable, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+            if not readable:
+                return self._take_stable(time.monotonic())
+            paths = self._read_events()
+            now = time.monotonic()
+            if paths is None:
+                # 事件丢失，退回到扫描目录并按稳定性判断
+                self._scan(now)
+                return self._take_stable(now)
+            ready = []
+            for path in paths:
+                try:
+                    signature = self._signature(os.stat(path))
+                except OSError:
+                    continue
+                if signature[0] > 0:
+                    self.candidates.pop(path, None)
+                    self.processed[path] = signature
+                    ready.append(path)
+            return ready + self._take_stable(now)
+
+        now = time.monotonic()
+        if now < self.next_scan:
+            time.sleep(min(max(0.0, timeout), self.next_scan - now))
+            now = time.monotonic()
+        if now >= self.next_scan:
+            self._scan(now)
+        return self._take_stable(now)
+
+    def iter_batches(self, batch_window=0.1, max_batch=64, should_stop=None, idle_timeout=0.2):
+        """按小批产出新文件：第一个文件就绪后再等待 batch_window 秒收集同批到达的文件
+            :param should_stop: 返回True时停止监视的函数
+            :param idle_timeout: 没有文件时每次等待的时长，决定响应停止请求的速度
+        """
+        batch = []
+        deadline = None
+        while should_stop is None or not should_stop():
+            timeout = idle_timeout if deadline is None else deadline - time.monotonic()
+            batch.extend(self.poll(timeout))
+            if batch and deadline is None:
+                deadline = time.monotonic() + batch_window
+            if batch and (time.monotonic() >= deadline or len(batch) >= max_batch):
+                yield batch
+                batch = []
+                deadline = None
+        if batch:
+            yield batch